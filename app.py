@@ -3,44 +3,74 @@ from http import HTTPStatus
 import os
 import uuid
 import time
+from urllib.parse import urlparse
 import gradio as gr
 from gradio_client import utils as client_utils
 import modelscope_studio.components.antd as antd
 import modelscope_studio.components.antdx as antdx
 import modelscope_studio.components.base as ms
 import modelscope_studio.components.pro as pro
-from config import DEFAULT_THEME, DEFAULT_SYS_PROMPT, save_history, get_text, user_config, bot_config, welcome_config, markdown_config, upload_config, api_key, base_url, MODEL, THINKING_MODEL, bucket
+from config import DEFAULT_THEME, DEFAULT_SYS_PROMPT, save_history, get_text, user_config, bot_config, welcome_config, markdown_config, upload_config, api_key, base_url, MODEL, THINKING_MODEL, get_bucket, UI_CONCURRENCY_ID, UI_CONCURRENCY_LIMIT, GENERATION_CONCURRENCY_ID, GENERATION_CONCURRENCY_LIMIT, MEDIA_URL_TTL, MEDIA_CACHE_TTL, ATTACHMENT_DEDUP, PROMPT_CACHE_MARKERS, OSS_UPLOAD_PREFIX, CLIENT_COOKIE, UPSTREAM_READ_TIMEOUT
 from ui_components.logo import Logo
 from ui_components.thinking_button import ThinkingButton
-
-from openai import OpenAI
-import socket
-import requests
+from ui_components.compare_button import CompareButton
+from services.resilience import CircuitOpenError
+from services.cancellation import streams
+from services.completion import Completion
+from services.scheduler import scheduler, classify_turn, RateLimited
+from services.metrics import ATTACHMENT_PREPARE
+from services.server import serve
+from services.health import prober
+from services.diagnostics import run_diagnostics
+from services.tracing import start_trace, NOOP_SPAN
+from services.profiler import should_profile, profile_generator
+from services.shared_state import instance_id, media_cache
+from services.usage import ledger, QuotaExceeded
+from services.log import setup_logging, get_logger, new_request_id, request_logger
+from services.chat_api import ChatAPI
+from services.dedup import AttachmentDeduplicator
+from services.media import chat_view, file_digest
+from services.prompt_cache import mark_cache_breakpoints
+from services.janitor import janitor
+
+import queue
+import threading
 import urllib3
-from urllib3.util.retry import Retry
-from requests.adapters import HTTPAdapter
 
 # Disable SSL warnings for testing purposes
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
-# Initialize OpenAI client with enhanced network configuration
+setup_logging()
+logger = get_logger("app")
+
+# OpenAI client, built by get_client() on first use or by warm_up() in the
+# background at startup (importing openai takes a few hundred ms).
+# Benchmarks assign a stand-in here directly.
 client = None
-if api_key:
-    # Configuration de timeout pour la production
-    timeout_config = (30, 300)  # (connect timeout, read timeout)
-    
-    try:
-        client = OpenAI(
-            api_key=api_key,
-            base_url=base_url,
-            timeout=timeout_config
-        )
-        print("✅ OpenAI client initialized with enhanced network configuration")
-    except Exception as e:
-        print(f"❌ Failed to initialize OpenAI client: {e}")
-        print("Continuing with client=None - API calls will fail but app will run")
-        client = None
-else:
+_client_lock = threading.Lock()
+
+
+def get_client():
+    global client
+    if client is None and api_key:
+        with _client_lock:
+            if client is None:
+                from openai import OpenAI
+                # Configuration de timeout pour la production
+                timeout_config = (30, UPSTREAM_READ_TIMEOUT)  # (connect timeout, read timeout)
+                try:
+                    client = OpenAI(
+                        api_key=api_key,
+                        base_url=base_url,
+                        timeout=timeout_config
+                    )
+                    logger.info("OpenAI client initialized")
+                except Exception as e:
+                    logger.error("Failed to initialize OpenAI client, API calls will fail: %s", e)
+    return client
+
+
+if not api_key:
     print("Warning: API_KEY environment variable not set. The application will run but API calls will fail.")
     print("Please set the API_KEY environment variable to use the application properly.")
     print("For OpenRouter, you can get your API key from: https://openrouter.ai/")
@@ -57,69 +87,92 @@ def file_path_to_oss_url(file_path: str):
     """Upload file to OSS with enhanced error handling and port support"""
     if file_path.startswith("http"):
         return file_path
-    
+    return oss_url(file_path, os.stat(file_path))[0]
+
+
+def oss_url(file_path, stat):
+    """
+    Signed OSS URL of a local file and the time until which it may be
+    reused, or the file path itself when OSS is not available.
+    """
     # If bucket is not configured, return the original file path
+    bucket = get_bucket()
     if not bucket:
-        print("OSS bucket not configured, returning local file path")
-        return file_path
-        
+        logger.debug("OSS bucket not configured, returning local file path")
+        return file_path, float("inf")
+
+    # Named by content and shared with the other workers: the same bytes
+    # are uploaded once and keep the same URL for MEDIA_CACHE_TTL
+    digest = file_digest(file_path, stat)
+    cache_key = f"sha256:{digest}"
+    cached = media_cache.get(cache_key)
+    if cached:
+        return cached["url"], cached["reuse_until"]
+
     ext = file_path.split('.')[-1]
-    object_name = f'studio-temp/Qwen3-VL-Demo/{uuid.uuid4()}.{ext}'
+    # Under a prefix of this host, the janitor only reclaims its own objects
+    object_name = f'{OSS_UPLOAD_PREFIX}{instance_id()}/{digest}.{ext}'
     try:
-        # Configuration avec timeout étendu pour upload
-        bucket.put_object_from_file(object_name, file_path, progress_callback=None)
-        file_url = file_path
-        
-        # Génération d'URL avec signature
-        file_url = bucket.sign_url('GET',
-                                   object_name,
-                                   60 * 60,  # 1 heure
-                                   slash_safe=True)
-        print(f"✅ File uploaded to OSS: {object_name}")
-        return file_url
+        with janitor.signing(object_name, stat.st_size):
+            if not bucket.object_exists(object_name):
+                # Configuration avec timeout étendu pour upload
+                bucket.put_object_from_file(object_name, file_path, progress_callback=None)
+                logger.info("File uploaded to OSS", extra={"object": object_name})
+
+            # Génération d'URL avec signature
+            file_url = bucket.sign_url('GET',
+                                       object_name,
+                                       MEDIA_URL_TTL,
+                                       slash_safe=True)
+        reuse_until = time.time() + MEDIA_CACHE_TTL
+        media_cache.set(cache_key, {
+            "url": file_url,
+            "reuse_until": reuse_until
+        }, ttl=MEDIA_CACHE_TTL)
+        return file_url, reuse_until
     except Exception as e:
-        print(f"⚠️ Warning: Could not upload file to OSS: {e}")
-        print("Continuing with local file path")
-        return file_path
+        logger.warning("Could not upload file to OSS, using local file path",
+                       extra={"error": str(e)})
+        return file_path, 0
+
+
+def media_url(file_path, span=NOOP_SPAN):
+    """URL the upstream reads a local file from: OSS, else a data URI"""
+    file_size = os.path.getsize(file_path)
+    with span.child("upload", file_size=file_size):
+        file_url = file_path_to_oss_url(file_path)
+    if not file_url.startswith("http"):
+        with span.child("encode", file_size=file_size):
+            file_url = encode_file_to_base64(file_path=file_path)
+    return file_url
+
 
 def test_network_connectivity():
     """Test de la connectivité réseau vers les services externes"""
-    import json
-    import requests
-    from datetime import datetime
+    diagnostics = run_diagnostics(
+        http_services={
+            'openrouter': 'https://openrouter.ai/api/v1/models',
+            'github': 'https://api.github.com',
+        },
+        dns_hosts=['openrouter.ai'],
+        ports=[])
     
     results = {
-        'timestamp': datetime.now().isoformat(),
-        'status': 'healthy',
+        'timestamp': diagnostics['timestamp'],
+        'status': 'healthy' if diagnostics['status'] == 'OK' else 'degraded',
         'tests': {}
     }
     
-    # Test DNS resolution
-    try:
-        import socket
-        socket.gethostbyname('openrouter.ai')
-        results['tests']['dns'] = 'OK'
-    except Exception as e:
-        results['tests']['dns'] = f'FAILED: {e}'
-        results['status'] = 'degraded'
-    
-    # Test OpenRouter API connectivity
-    try:
-        response = requests.get('https://openrouter.ai/api/v1/models', timeout=10)
-        results['tests']['openrouter'] = f'HTTP {response.status_code}'
-    except Exception as e:
-        results['tests']['openrouter'] = f'FAILED: {e}'
-        results['status'] = 'degraded'
-    
-    # Test GitHub connectivity
-    try:
-        response = requests.get('https://api.github.com', timeout=10)
-        results['tests']['github'] = f'HTTP {response.status_code}'
-    except Exception as e:
-        results['tests']['github'] = f'FAILED: {e}'
-        results['status'] = 'degraded'
+    dns = diagnostics['dns_resolution']['openrouter.ai']
+    results['tests']['dns'] = 'OK' if dns['status'] == 'OK' else \
+        f"{dns['status']}: {dns.get('error', '')}"
+    for name, result in diagnostics['external_services'].items():
+        results['tests'][name] = f"HTTP {result['status_code']}" \
+            if result['status'] == 'OK' else \
+            f"{result['status']}: {result.get('error', '')}"
     
     # Test OSS endpoint if configured
+    bucket = get_bucket()
     if bucket:
         try:
             # Test basique de connectivité OSS
@@ -132,45 +185,152 @@ def test_network_connectivity():
     return results
 
 
-def format_history(history, oss_cache, sys_prompt=None):
+def warm_up():
+    """Build the lazy clients and check connectivity, off the startup path"""
+    started = time.monotonic()
+    get_client()
+    get_bucket()
+    logger.info("Clients ready in %.2fs", time.monotonic() - started)
+    try:
+        connectivity = test_network_connectivity()
+        logger.info("Connectivity: %s", connectivity['status'])
+    except Exception as e:
+        logger.warning("Connectivity test failed: %s", e)
+
+
+def start_warm_up():
+    threading.Thread(target=warm_up, name="warm-up", daemon=True).start()
+
+
+def get_session_id(request):
+    """
+    Key used for per-user scheduling, rate limit and quota: the login user,
+    else the browser's client cookie, which outlives a page reload, else the
+    Gradio session. Never the IP, a whole office can share one.
+    """
+    if request is None:
+        return "anonymous"
+    if request.username:
+        return f"user:{request.username}"
+    client_id = (request.cookies or {}).get(CLIENT_COOKIE)
+    if client_id:
+        return f"client:{client_id}"
+    if request.session_hash:
+        return f"session:{request.session_hash}"
+    return "anonymous"
+
+
+def check_admission(session_id):
+    """Rate limit and token quota, checked before a turn goes upstream"""
+    try:
+        scheduler.check_rate(session_id)
+        ledger.check_quota(session_id)
+    except RateLimited as e:
+        raise gr.Error(
+            get_text(f"Too many requests, please retry in {e.retry_in:.0f}s.",
+                     f"请求过于频繁，请在 {e.retry_in:.0f} 秒后重试。"))
+    except QuotaExceeded as e:
+        minutes = max(1, round(e.retry_in / 60))
+        raise gr.Error(
+            get_text(
+                f"Token quota reached, please retry in {minutes} min.",
+                f"已达到 Token 配额，请在 {minutes} 分钟后重试。"))
+
+
+# Attribution headers sent with every completion request (OpenRouter)
+UPSTREAM_HEADERS = {
+    "HTTP-Referer": "https://qwen3-vl-demo.com",
+    "X-Title": "Qwen3-VL Demo",
+}
+
+
+def select_model(enable_thinking):
+    return THINKING_MODEL if enable_thinking else MODEL
+
+
+# Headless /api/chat, same client, model choice and media path as the UI
+chat_api = ChatAPI(get_client, select_model, media_url, UPSTREAM_HEADERS)
+
+
+def format_history(history, oss_cache, sys_prompt=None, span=NOOP_SPAN,
+                   touch=True, missing=None):
     messages = [{
         "role": "system",
         "content": DEFAULT_SYS_PROMPT,
     }]
+    dedup = AttachmentDeduplicator() if ATTACHMENT_DEDUP else None
     for item in history:
         if item["role"] == "user":
             files = []
             for file_path in item["content"][0]["content"]:
                 if file_path.startswith("http"):
+                    mime_type = client_utils.get_mimetype(
+                        urlparse(file_path).path) or ""
+                    kind = "video" if mime_type.startswith("video/") \
+                        else "image"
+                    reference = dedup and dedup.check_url(file_path, kind)
+                    if reference:
+                        files.append({"type": "text", "text": reference})
+                        continue
                     files.append({
-                        "type": "image_url",
-                        "image_url": {
+                        "type": f"{kind}_url",
+                        f"{kind}_url": {
                             "url": file_path
                         }
                     })
                 elif os.path.exists(file_path):
-                    file_url = oss_cache.get(file_path,
-                                             file_path_to_oss_url(file_path))
-                    oss_cache[file_path] = file_url
-
-                    file_url = file_url if file_url.startswith(
-                        "http") else encode_file_to_base64(file_path=file_path)
-
-                    mime_type = client_utils.get_mimetype(file_path)
-                    if mime_type.startswith("image"):
+                    mime_type = client_utils.get_mimetype(file_path) or ""
+                    kind = mime_type.split("/")[0]
+                    if kind not in ("image", "video"):
+                        continue
+                    stat = os.stat(file_path)
+                    if touch:
+                        # Still in use, kept by the janitor
+                        janitor.touch(file_path, stat)
+                    # Sent once per request, later copies are a reference
+                    reference = dedup and dedup.check_file(file_path, stat, kind)
+                    if reference:
+                        files.append({"type": "text", "text": reference})
+                        continue
+                    file_size = stat.st_size
+                    cached = oss_cache.get(file_path)
+                    if cached and cached[1] > time.time():
+                        file_url = cached[0]
+                    else:
+                        with span.child("upload", file_size=file_size):
+                            file_url, reuse_until = oss_url(file_path, stat)
+                        oss_cache[file_path] = (file_url, reuse_until)
+
+                    if not file_url.startswith("http"):
+                        with span.child("encode", file_size=file_size):
+                            file_url = encode_file_to_base64(
+                                file_path=file_path)
+
+                    if kind == "image":
                         files.append({
                             "type": "image_url",
                             "image_url": {
                                 "url": file_url
                             }
                         })
-                    elif mime_type.startswith("video"):
+                    else:
                         files.append({
                             "type": "video_url",
                             "video_url": {
                                 "url": file_url
                             }
                         })
+                else:
+                    # Reclaimed by the janitor, the model is told it is gone
+                    name = os.path.basename(file_path)
+                    logger.warning("Attachment no longer available",
+                                   extra={"file": name})
+                    if missing is not None:
+                        missing.append(name)
+                    files.append({
+                        "type": "text",
+                        "text": f"[Attachment {name} is no longer available]"
+                    })
 
             messages.append({
                 "role":
@@ -186,26 +346,179 @@ def format_history(history, oss_cache, sys_prompt=None):
                 "type": "text",
                 "text": content["content"]
             } for content in item["content"] if content["type"] == "text"]
+            if "answer" in item:
+                # A compare turn, several answers are shown but one is kept
+                contents = [{"type": "text", "text": item["answer"]}]
             messages.append({
                 "role":
                 "assistant",
                 "content":
                 contents[0]["text"] if len(contents) > 0 else ""
             })
+    if dedup:
+        dedup.report(span)
+    if PROMPT_CACHE_MARKERS:
+        messages = mark_cache_breakpoints(messages)
     return messages
 
 
+def answer_parts(completion):
+    """Chatbot content of a streamed answer: the reasoning, then the answer"""
+    parts = []
+    if completion.reasoning:
+        if completion.thought_seconds is None:
+            title = get_text("Thinking...", "思考中...")
+            status = "pending"
+        else:
+            thought_cost_time = "{:.2f}".format(completion.thought_seconds)
+            title = get_text(f"End of Thought ({thought_cost_time}s)",
+                             f"已深度思考 (用时{thought_cost_time}s)")
+            status = "done"
+        parts.append({
+            "type": "tool",
+            "content": completion.reasoning,
+            "options": {
+                "title": title,
+                "status": status
+            },
+            "copyable": False,
+            "editable": False
+        })
+    if completion.answer:
+        parts.append({"type": "text", "content": completion.answer})
+    return parts
+
+
+def error_part(message):
+    return {
+        "type": "text",
+        "content": f'<span style="color: var(--color-red-500)">{message}</span>'
+    }
+
+
+def error_message(e):
+    if isinstance(e, CircuitOpenError):
+        return get_text(
+            "The model service is temporarily unavailable, please try again shortly.",
+            "模型服务暂时不可用，请稍后再试。")
+    return str(e)
+
+
+# Compare mode lanes: key, model, label
+COMPARE_LANES = (
+    ("fast", MODEL, get_text("⚡ Fast", "⚡ 快速")),
+    ("thinking", THINKING_MODEL, get_text("🧠 Thinking", "🧠 深度思考")),
+)
+
+
+def lane_stream_key(conversation_id, lane):
+    return f"{conversation_id}:{lane}"
+
+
+class CompareLane:
+    """One model of a compare turn, streamed in its own thread."""
+
+    def __init__(self, key, model, label, completion):
+        self.key = key
+        self.model = model
+        self.label = label
+        self.completion = completion
+        self.error = None
+        self.done = False
+
+    def run(self, updates):
+        try:
+            for _ in self.completion:
+                updates.put(self)
+        except Exception as e:
+            self.error = e
+        finally:
+            self.done = True
+            updates.put(self)
+
+    def parts(self):
+        completion = self.completion
+        if self.error is not None:
+            status = get_text("Failed", "失败")
+        elif completion.completed:
+            status = "{:.2f}s".format(completion.duration)
+        elif self.done:
+            status = get_text("Stopped", "已停止")
+        else:
+            status = "…"
+        parts = [{
+            "type": "text",
+            "content": f"**{self.label}** · `{self.model}` · {status}",
+            "copyable": False,
+            "editable": False
+        }, *answer_parts(completion)]
+        if self.error is not None:
+            parts.append({
+                **error_part(error_message(self.error)), "editable": False
+            })
+        return parts
+
+
+def lane_answers(content):
+    """Answer text of each lane in the content of a compare turn"""
+    answers = []
+    for part in content:
+        if part.get("type") != "text":
+            continue
+        if part.get("editable") is False:
+            # A lane header starts the next lane, errors are not answers
+            if part.get("copyable") is False:
+                answers.append("")
+            continue
+        if answers:
+            answers[-1] += part["content"]
+    return answers
+
+
+def compare_view(lanes):
+    """Content of a compare turn: each lane, then a stop chip per running lane"""
+    parts = [part for lane in lanes for part in lane.parts()]
+    running = [lane for lane in lanes if not lane.done]
+    if running:
+        parts.append({
+            "type": "suggestion",
+            "content": [{
+                "key": lane.key,
+                "label": get_text(f"Stop {lane.label}", f"停止{lane.label}")
+            } for lane in running],
+            "copyable": False,
+            "editable": False
+        })
+    return parts
+
+
 class Gradio_Events:
 
     @staticmethod
-    def submit(state_value):
-
-        history = state_value["conversation_contexts"][
-            state_value["conversation_id"]]["history"]
-        enable_thinking = state_value["conversation_contexts"][
-            state_value["conversation_id"]]["enable_thinking"]
-        messages = format_history(history, state_value["oss_cache"])
-        model = THINKING_MODEL if enable_thinking else MODEL
+    def submit(state_value, session_id=None, span=NOOP_SPAN, request_id=None):
+        log = request_logger(logger, request_id or new_request_id())
+
+        context = state_value["conversation_contexts"][
+            state_value["conversation_id"]]
+        history = context["history"]
+        if context.get("compare"):
+            model = ", ".join(lane[1] for lane in COMPARE_LANES)
+        else:
+            model = select_model(context["enable_thinking"])
+        span.set(model=model, history_length=len(history))
+        missing = []
+        with span.child("prepare_messages") as prepare_span:
+            messages = format_history(history,
+                                      state_value["oss_cache"],
+                                      span=prepare_span,
+                                      missing=missing)
+        ATTACHMENT_PREPARE.observe(prepare_span.duration)
+        if missing:
+            names = ", ".join(dict.fromkeys(missing))
+            gr.Warning(
+                get_text(
+                    f"No longer available, the model cannot see: {names}",
+                    f"以下附件已失效，模型无法查看：{names}"))
         history.append({
             "role": "assistant",
             "content": [],
@@ -216,122 +529,130 @@ class Gradio_Events:
         })
 
         yield {
-            chatbot: gr.update(value=history),
+            chatbot: gr.update(value=chat_view(history)),
             state: gr.update(value=state_value),
         }
+        client = get_client()
+        if not client:
+            history[-1]["loading"] = False
+            history[-1]["status"] = "done"
+            history[-1]["content"] += [
+                error_part(
+                    "API not configured. Please set API_KEY environment variable."
+                )
+            ]
+            yield {
+                chatbot: gr.update(value=chat_view(history)),
+                state: gr.update(value=state_value)
+            }
+            return
+        if context.get("compare"):
+            yield from Gradio_Events.submit_compare(state_value, client,
+                                                    messages, session_id,
+                                                    span, log)
+            return
+
+        inflight = streams.start(state_value["conversation_id"], model)
+        completion = Completion(client, model, messages, session_id,
+                                state_value["conversation_id"],
+                                classify_turn(history), inflight, span, log,
+                                UPSTREAM_HEADERS)
         try:
-            if not client:
-                history[-1]["loading"] = False
-                history[-1]["status"] = "done"
-                history[-1]["content"] += [{
-                    "type":
-                    "text",
-                    "content":
-                    '<span style="color: var(--color-red-500)">API not configured. Please set API_KEY environment variable.</span>'
-                }]
-                yield {
-                    chatbot: gr.update(value=history),
-                    state: gr.update(value=state_value)
-                }
-                return
-
-            response = client.chat.completions.create(
-                model=model,
-                messages=messages,
-                stream=True,
-                extra_headers={
-                    "HTTP-Referer": "https://qwen3-vl-demo.com",
-                    "X-Title": "Qwen3-VL Demo",
-                }
-            )
-            start_time = time.time()
-            reasoning_content = ""
-            answer_content = ""
-            is_thinking = False
-            is_answering = False
-            contents = [None, None]
-            for chunk in response:
-                if not chunk or (
-                        not chunk.choices[0].delta.content and
-                    (not hasattr(chunk.choices[0].delta, "reasoning_content")
-                     or not chunk.choices[0].delta.reasoning_content)):
-                    pass
-                else:
-                    delta = chunk.choices[0].delta
-                    if hasattr(
-                            delta,
-                            'reasoning_content') and delta.reasoning_content:
-                        if not is_thinking:
-                            contents[0] = {
-                                "type": "tool",
-                                "content": "",
-                                "options": {
-                                    "title": get_text("Thinking...", "思考中..."),
-                                    "status": "pending"
-                                },
-                                "copyable": False,
-                                "editable": False
-                            }
-                            is_thinking = True
-                        reasoning_content += delta.reasoning_content
-                    if hasattr(delta, 'content') and delta.content:
-                        if not is_answering:
-                            thought_cost_time = "{:.2f}".format(time.time() -
-                                                                start_time)
-                            if contents[0]:
-                                contents[0]["options"]["title"] = get_text(
-                                    f"End of Thought ({thought_cost_time}s)",
-                                    f"已深度思考 (用时{thought_cost_time}s)")
-                                contents[0]["options"]["status"] = "done"
-                            contents[1] = {
-                                "type": "text",
-                                "content": "",
-                            }
-
-                            is_answering = True
-                        answer_content += delta.content
-
-                    if contents[0]:
-                        contents[0]["content"] = reasoning_content
-                    if contents[1]:
-                        contents[1]["content"] = answer_content
-                history[-1]["content"] = [
-                    content for content in contents if content
-                ]
-
+            for _ in completion:
+                history[-1]["content"] = answer_parts(completion)
                 history[-1]["loading"] = False
                 yield {
-                    chatbot: gr.update(value=history),
+                    chatbot: gr.update(value=chat_view(history)),
                     state: gr.update(value=state_value)
                 }
-            print("model: ", model, "-", "reasoning_content: ",
-                  reasoning_content, "\n", "content: ", answer_content)
-            history[-1]["status"] = "done"
-            cost_time = "{:.2f}".format(time.time() - start_time)
-            history[-1]["footer"] = get_text(f"{cost_time}s",
-                                             f"用时{cost_time}s")
-            yield {
-                chatbot: gr.update(value=history),
-                state: gr.update(value=state_value),
-            }
         except Exception as e:
-            print("model: ", model, "-", "Error: ", e)
             history[-1]["loading"] = False
             history[-1]["status"] = "done"
-            history[-1]["content"] += [{
-                "type":
-                "text",
-                "content":
-                f'<span style="color: var(--color-red-500)">{str(e)}</span>'
-            }]
+            history[-1]["content"] += [error_part(error_message(e))]
             yield {
-                chatbot: gr.update(value=history),
+                chatbot: gr.update(value=chat_view(history)),
                 state: gr.update(value=state_value)
             }
             raise e
+        if not completion.completed:
+            # Stopped, the cancel handler already marked the message paused
+            return
+        history[-1]["loading"] = False
+        history[-1]["status"] = "done"
+        cost_time = "{:.2f}".format(completion.duration)
+        history[-1]["footer"] = get_text(f"{cost_time}s", f"用时{cost_time}s")
+        yield {
+            chatbot: gr.update(value=chat_view(history)),
+            state: gr.update(value=state_value),
+        }
+
+    @staticmethod
+    def submit_compare(state_value, client, messages, session_id, span, log):
+        """
+        Streams the turn from every compare lane at once into the same
+        message, the prepared `messages` shared. Each lane can be stopped on
+        its own; later turns carry the thinking answer, else the fast one.
+        """
+        conversation_id = state_value["conversation_id"]
+        history = state_value["conversation_contexts"][conversation_id][
+            "history"]
+        turn_class = classify_turn(history)
+        updates = queue.Queue()
+        lanes = []
+        for key, model, label in COMPARE_LANES:
+            inflight = streams.start(lane_stream_key(conversation_id, key),
+                                     model)
+            lanes.append(
+                CompareLane(
+                    key, model, label,
+                    Completion(client, model, messages, session_id,
+                               conversation_id, turn_class, inflight,
+                               span.child(key, model=model), log,
+                               UPSTREAM_HEADERS)))
+        for lane in lanes:
+            threading.Thread(target=lane.run,
+                             args=(updates, ),
+                             name=f"compare-{lane.key}",
+                             daemon=True).start()
+        try:
+            while not all(lane.done for lane in lanes):
+                updates.get()
+                # Both lanes may have moved on, render them once
+                while not updates.empty():
+                    updates.get_nowait()
+                history[-1]["content"] = compare_view(lanes)
+                history[-1]["loading"] = False
+                yield {
+                    chatbot: gr.update(value=chat_view(history)),
+                    state: gr.update(value=state_value)
+                }
+        finally:
+            # The stop button or a closed page ended the turn
+            for lane in lanes:
+                if not lane.done:
+                    streams.cancel(lane_stream_key(conversation_id, lane.key))
+        history[-1]["content"] = compare_view(lanes)
+        history[-1]["loading"] = False
+        history[-1]["status"] = "done"
+        # The last lane that answered, edit_message keeps the same one
+        answers = [lane.completion.answer for lane in reversed(lanes)]
+        history[-1]["answer"] = next((answer for answer in answers if answer),
+                                     "")
+        if any(lane.completion.completed for lane in lanes):
+            cost_time = "{:.2f}".format(
+                max(lane.completion.duration or 0 for lane in lanes))
+            history[-1]["footer"] = get_text(f"{cost_time}s",
+                                             f"用时{cost_time}s")
+        yield {
+            chatbot: gr.update(value=chat_view(history)),
+            state: gr.update(value=state_value),
+        }
 
     @staticmethod
-    def add_message(input_value, thinking_btn_state_value, state_value):
+    def add_message(input_value, thinking_btn_state_value,
+                    compare_btn_state_value, state_value, request: gr.Request):
+        session_id = get_session_id(request)
+        check_admission(session_id)
         text = input_value["text"]
         files = input_value["files"]
         if not state_value["conversation_id"]:
@@ -353,9 +674,12 @@ class Gradio_Events:
         state_value["conversation_contexts"][
             state_value["conversation_id"]] = {
                 "history": history,
-                "enable_thinking": thinking_btn_state_value["enable_thinking"]
+                "enable_thinking": thinking_btn_state_value["enable_thinking"],
+                "compare": compare_btn_state_value["compare"]
             }
 
+        for file_path in files:
+            janitor.track(file_path)
         history.append({
             "key":
             str(uuid.uuid4()),
@@ -371,12 +695,25 @@ class Gradio_Events:
         })
         yield Gradio_Events.preprocess_submit(clear_input=True)(state_value)
 
+        request_id = new_request_id()
+        trace = start_trace("add_message",
+                            request_id=request_id,
+                            session=session_id,
+                            conversation=state_value["conversation_id"],
+                            files=len(files))
+        error = None
         try:
-            for chunk in Gradio_Events.submit(state_value):
+            generator = Gradio_Events.submit(state_value, session_id,
+                                             trace.root, request_id)
+            if should_profile(request):
+                generator = profile_generator(generator, "add_message")
+            for chunk in generator:
                 yield chunk
         except Exception as e:
+            error = e
             raise e
         finally:
+            trace.finish(error)
             yield Gradio_Events.postprocess_submit(state_value)
 
     @staticmethod
@@ -407,7 +744,7 @@ class Gradio_Events:
                 conversation_delete_menu_item:
                 gr.update(disabled=True),
                 chatbot:
-                gr.update(value=history,
+                gr.update(value=chat_view(history),
                           bot_config=bot_config(
                               disabled_actions=['edit', 'retry', 'delete']),
                           user_config=user_config(
@@ -434,7 +771,7 @@ class Gradio_Events:
             add_conversation_btn:
             gr.update(disabled=False),
             chatbot:
-            gr.update(value=history,
+            gr.update(value=chat_view(history),
                       bot_config=bot_config(),
                       user_config=user_config()),
             state:
@@ -443,6 +780,10 @@ class Gradio_Events:
 
     @staticmethod
     def cancel(state_value):
+        streams.cancel(state_value["conversation_id"])
+        for lane, _, _ in COMPARE_LANES:
+            streams.cancel(
+                lane_stream_key(state_value["conversation_id"], lane))
         history = state_value["conversation_contexts"][
             state_value["conversation_id"]]["history"]
         history[-1]["loading"] = False
@@ -450,6 +791,13 @@ class Gradio_Events:
         history[-1]["footer"] = get_text("Chat completion paused", "对话已暂停")
         return Gradio_Events.postprocess_submit(state_value)
 
+    @staticmethod
+    def stop_lane(state_value, e: gr.EventData):
+        """Stops one model of a compare turn, the other keeps streaming"""
+        lane = e._data["payload"][0]["value"]["key"]
+        streams.cancel(lane_stream_key(state_value["conversation_id"], lane))
+        return gr.skip()
+
     @staticmethod
     def delete_message(state_value, e: gr.EventData):
         index = e._data["payload"][0]["index"]
@@ -467,17 +815,32 @@ class Gradio_Events:
         index = e._data["payload"][0]["index"]
         history = state_value["conversation_contexts"][
             state_value["conversation_id"]]["history"]
-        history[index]["content"] = chatbot_value[index]["content"]
+        content = chatbot_value[index]["content"]
+        if history[index]["role"] == "user" and isinstance(content, list):
+            # The chatbot shows previews, keep the original attachments
+            content = history[index]["content"][:1] + content[1:]
+        if "answer" in history[index]:
+            # A compare turn keeps the answer of its last answering lane,
+            # the edit of that lane replaces it
+            answers = lane_answers(history[index]["content"])
+            kept = max((lane for lane, answer in enumerate(answers) if answer),
+                       default=None)
+            edited = lane_answers(content)
+            history[index]["answer"] = edited[kept] if kept is not None and \
+                kept < len(edited) else ""
+        history[index]["content"] = content
         if not history[index].get("edited"):
             history[index]["edited"] = True
             history[index]["footer"] = ((history[index]["footer"]) +
                                         " " if history[index].get("footer")
                                         else "") + get_text("Edited", "已编辑")
-        return gr.update(value=state_value), gr.update(value=history)
+        return gr.update(value=state_value), gr.update(value=chat_view(history))
 
     @staticmethod
-    def regenerate_message(thinking_btn_state_value, state_value,
-                           e: gr.EventData):
+    def regenerate_message(thinking_btn_state_value, compare_btn_state_value,
+                           state_value, e: gr.EventData, request: gr.Request):
+        session_id = get_session_id(request)
+        check_admission(session_id)
         index = e._data["payload"][0]["index"]
         history = state_value["conversation_contexts"][
             state_value["conversation_id"]]["history"]
@@ -486,16 +849,29 @@ class Gradio_Events:
         state_value["conversation_contexts"][
             state_value["conversation_id"]] = {
                 "history": history,
-                "enable_thinking": thinking_btn_state_value["enable_thinking"]
+                "enable_thinking": thinking_btn_state_value["enable_thinking"],
+                "compare": compare_btn_state_value["compare"]
             }
 
         yield Gradio_Events.preprocess_submit()(state_value)
+        request_id = new_request_id()
+        trace = start_trace("regenerate_message",
+                            request_id=request_id,
+                            session=session_id,
+                            conversation=state_value["conversation_id"])
+        error = None
         try:
-            for chunk in Gradio_Events.submit(state_value):
+            generator = Gradio_Events.submit(state_value, session_id,
+                                             trace.root, request_id)
+            if should_profile(request):
+                generator = profile_generator(generator, "regenerate_message")
+            for chunk in generator:
                 yield chunk
         except Exception as e:
+            error = e
             raise e
         finally:
+            trace.finish(error)
             yield Gradio_Events.postprocess_submit(state_value)
 
     @staticmethod
@@ -505,18 +881,19 @@ class Gradio_Events:
         return gr.update(value=input_value)
 
     @staticmethod
-    def new_chat(thinking_btn_state, state_value):
+    def new_chat(thinking_btn_state, compare_btn_state, state_value):
         if not state_value["conversation_id"]:
             return gr.skip()
         state_value["conversation_id"] = ""
         thinking_btn_state["enable_thinking"] = True
+        compare_btn_state["compare"] = False
         return gr.update(active_key=state_value["conversation_id"]), gr.update(
             value=None), gr.update(value=thinking_btn_state), gr.update(
-                value=state_value)
+                value=compare_btn_state), gr.update(value=state_value)
 
     @staticmethod
-    def select_conversation(thinking_btn_state_value, state_value,
-                            e: gr.EventData):
+    def select_conversation(thinking_btn_state_value, compare_btn_state_value,
+                            state_value, e: gr.EventData):
         active_key = e._data["payload"][0]
         if state_value["conversation_id"] == active_key or (
                 active_key not in state_value["conversation_contexts"]):
@@ -524,10 +901,13 @@ class Gradio_Events:
         state_value["conversation_id"] = active_key
         thinking_btn_state_value["enable_thinking"] = state_value[
             "conversation_contexts"][active_key]["enable_thinking"]
+        compare_btn_state_value["compare"] = state_value[
+            "conversation_contexts"][active_key].get("compare", False)
+        history = state_value["conversation_contexts"][active_key]["history"]
         return gr.update(active_key=active_key), gr.update(
-            value=state_value["conversation_contexts"][active_key]
-            ["history"]), gr.update(value=thinking_btn_state_value), gr.update(
-                value=state_value)
+            value=chat_view(history)), gr.update(
+                value=thinking_btn_state_value), gr.update(
+                    value=compare_btn_state_value), gr.update(value=state_value)
 
     @staticmethod
     def click_conversation_menu(state_value, e: gr.EventData):
@@ -878,6 +1258,7 @@ with gr.Blocks(css=css, fill_width=True) as demo:
                                     with ms.Slot("icon"):
                                         antd.Icon("ClearOutlined")
                                 thinking_btn_state = ThinkingButton()
+                                compare_btn_state = CompareButton()
                                    
                         # Voice Input Controls
                         with antd.Flex(gap=4, wrap=True, elem_classes="ms-voice-controls"):
@@ -909,54 +1290,88 @@ with gr.Blocks(css=css, fill_width=True) as demo:
             storage_key="qwen3_vl_demo_storage")
         state.change(fn=Gradio_Events.update_browser_state,
                      inputs=[state],
-                     outputs=[browser_state])
+                     outputs=[browser_state],
+                     concurrency_id=UI_CONCURRENCY_ID,
+                     concurrency_limit=UI_CONCURRENCY_LIMIT)
 
         demo.load(fn=Gradio_Events.apply_browser_state,
                   inputs=[browser_state, state],
-                  outputs=[conversations, state])
+                  outputs=[conversations, state],
+                  concurrency_id=UI_CONCURRENCY_ID,
+                  concurrency_limit=UI_CONCURRENCY_LIMIT)
 
     # Conversations Handler
+    # Lightweight handlers only touch the session state and return at once:
+    # they skip the queue so they never wait behind streaming generations
     add_conversation_btn.click(
         fn=Gradio_Events.new_chat,
-        inputs=[thinking_btn_state, state],
-        outputs=[conversations, chatbot, thinking_btn_state, state])
+        inputs=[thinking_btn_state, compare_btn_state, state],
+        outputs=[
+            conversations, chatbot, thinking_btn_state, compare_btn_state,
+            state
+        ],
+        queue=False)
     conversations.active_change(
         fn=Gradio_Events.select_conversation,
-        inputs=[thinking_btn_state, state],
-        outputs=[conversations, chatbot, thinking_btn_state, state])
+        inputs=[thinking_btn_state, compare_btn_state, state],
+        outputs=[
+            conversations, chatbot, thinking_btn_state, compare_btn_state,
+            state
+        ],
+        queue=False)
     conversations.menu_click(fn=Gradio_Events.click_conversation_menu,
                              inputs=[state],
-                             outputs=[conversations, chatbot, state])
+                             outputs=[conversations, chatbot, state],
+                             queue=False)
     # Chatbot Handler
     chatbot.welcome_prompt_select(fn=Gradio_Events.apply_prompt,
                                   inputs=[input],
-                                  outputs=[input])
+                                  outputs=[input],
+                                  queue=False)
+
+    # Stop chips of a compare turn
+    chatbot.suggestion_select(fn=Gradio_Events.stop_lane,
+                              inputs=[state],
+                              outputs=[state],
+                              queue=False)
 
     chatbot.delete(fn=Gradio_Events.delete_message,
                    inputs=[state],
-                   outputs=[state])
+                   outputs=[state],
+                   queue=False)
     chatbot.edit(fn=Gradio_Events.edit_message,
                  inputs=[state, chatbot],
-                 outputs=[state, chatbot])
+                 outputs=[state, chatbot],
+                 queue=False)
 
     regenerating_event = chatbot.retry(fn=Gradio_Events.regenerate_message,
-                                       inputs=[thinking_btn_state, state],
+                                       inputs=[
+                                           thinking_btn_state,
+                                           compare_btn_state, state
+                                       ],
                                        outputs=[
                                            input, clear_btn,
                                            conversation_delete_menu_item,
                                            add_conversation_btn, conversations,
                                            chatbot, state
-                                       ])
+                                       ],
+                                       concurrency_id=GENERATION_CONCURRENCY_ID,
+                                       concurrency_limit=GENERATION_CONCURRENCY_LIMIT)
 
     # Input Handler
     submit_event = input.submit(fn=Gradio_Events.add_message,
-                                inputs=[input, thinking_btn_state, state],
+                                inputs=[
+                                    input, thinking_btn_state,
+                                    compare_btn_state, state
+                                ],
                                 outputs=[
                                     input, clear_btn,
                                     conversation_delete_menu_item,
                                     add_conversation_btn, conversations,
                                     chatbot, state
-                                ])
+                                ],
+                                concurrency_id=GENERATION_CONCURRENCY_ID,
+                                concurrency_limit=GENERATION_CONCURRENCY_LIMIT)
     input.cancel(fn=Gradio_Events.cancel,
                  inputs=[state],
                  outputs=[
@@ -968,56 +1383,37 @@ with gr.Blocks(css=css, fill_width=True) as demo:
 
     clear_btn.click(fn=Gradio_Events.clear_conversation_history,
                     inputs=[state],
-                    outputs=[chatbot, state])
+                    outputs=[chatbot, state],
+                    queue=False)
     
     # Voice Input Event Handlers
     language_select.change(
         fn=Gradio_Events.update_voice_state,
         inputs=[voice_state, language_select],
-        outputs=[voice_state]
+        outputs=[voice_state],
+        queue=False
     )
 
     voice_btn.click(
         fn=Gradio_Events.update_voice_state,
         inputs=[voice_state, language_select],
-        outputs=[voice_state]
+        outputs=[voice_state],
+        queue=False
     )
 
 # Function for health check - will be added as a component
 def create_health_check():
     """Create a health check interface component"""
     def health_status():
-        import json
-        from datetime import datetime
-        
-        # Test de la connectivité réseau
-        try:
-            connectivity = test_network_connectivity()
-            status = {
-                "status": "healthy",
-                "timestamp": connectivity['timestamp'],
-                "connectivity": connectivity['tests'],
-                "service": "Qwen3-VL Demo",
-                "version": "1.0.0"
-            }
-            
-            if connectivity['status'] == 'degraded':
-                status["status"] = "degraded"
-            
-            return gr.JSON(status)
-        except Exception as e:
-            return gr.JSON({
-                "status": "unhealthy",
-                "error": str(e),
-                "timestamp": datetime.now().isoformat()
-            })
+        # Cached snapshot from the background prober, never blocks on network
+        return gr.JSON(prober.readiness())
     
     return health_status
 
 # Simple health check function for production
 def simple_health_check():
     """Simple health check that always returns OK"""
-    return {"status": "healthy", "service": "Qwen3-VL Demo", "version": "1.0.0"}
+    return prober.liveness()
 
 if __name__ == "__main__":
     print("🚀 Démarrage de Qwen3-VL Demo")
@@ -1025,32 +1421,32 @@ if __name__ == "__main__":
     # Configuration par défaut
     port = int(os.environ.get("PORT", 7860))
     host = "0.0.0.0"
-    share = False
     debug = os.environ.get("DEBUG", "false").lower() == "true"
     
     print(f"🌐 Host: {host}")
     print(f"🔌 Port: {port}")
     print(f"🐛 Debug: {debug}")
     
-    # Test de connectivité simple
-    try:
-        connectivity = test_network_connectivity()
-        print(f"✅ Connectivité: {connectivity['status']}")
-    except Exception as e:
-        print(f"⚠️ Erreur test connectivité: {e}")
+    # Client, bucket et test de connectivité en arrière-plan
+    start_warm_up()
     
     # Configuration queue
     demo.queue(
         default_concurrency_limit=50,
         max_size=100
-    ).launch(
-        server_name=host,
-        server_port=port,
-        share=share,
-        show_error=debug,
-        quiet=not debug,
-        ssr_mode=False,
-        max_threads=50
+    )
+    print(f"📈 Metrics: http://{host}:{port}/metrics")
+    serve(
+        demo,
+        host=host,
+        port=port,
+        # Turns waiting in the scheduler hold a thread, and queue-free UI
+        # events must never wait for one
+        max_threads=GENERATION_CONCURRENCY_LIMIT + UI_CONCURRENCY_LIMIT,
+        debug=debug,
+        favicon_path="./assets/qwen.png",
+        routers=[chat_api.router()],
+        css=css
     )
     
     print(f"✅ Application démarrée sur http://{host}:{port}")
@@ -5,31 +5,24 @@ Configuration spécifique pour déploiement cloud avec support complet des ports
 """
 
 import os
-import logging
 import argparse
-import json
-from datetime import datetime
-import socket
 import requests
 import urllib3
 from urllib3.util.retry import Retry
 from requests.adapters import HTTPAdapter
-import sys
 
-# Import de l'application principale
-from app import demo, test_network_connectivity
+from functools import partial
+import uvicorn
+from config import UI_CONCURRENCY_LIMIT, GENERATION_CONCURRENCY_LIMIT, LOG_FILE, WORKER_BASE_PORT, SCHEDULER_SLOTS, LIMITER_INITIAL, LIMITER_MAX
+from services.diagnostics import run_diagnostics
+from services.log import setup_logging, get_logger
+from services.workers import WorkerPool, create_proxy_app, split_capacity
 
-# Configuration du logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.StreamHandler(sys.stdout),
-        logging.FileHandler('/tmp/qwen3-vl.log') if os.path.exists('/tmp') else logging.NullHandler()
-    ]
-)
+# Configuration du logging (asynchrone, fichier avec rotation)
+LOG_PATH = LOG_FILE or ('/tmp/qwen3-vl.log' if os.path.exists('/tmp') else None)
+setup_logging(log_file=LOG_PATH)
 
-logger = logging.getLogger(__name__)
+logger = get_logger("app_prod")
 
 def setup_network_optimization():
     """Configuration réseau optimisée pour la production"""
@@ -73,75 +66,75 @@ def setup_network_optimization():
     return session
 
 def test_external_connectivity():
-    """Test de connectivité étendu vers les services externes"""
-    
-    services = {
-        'openrouter_api': 'https://openrouter.ai/api/v1/models',
-        'github_api': 'https://api.github.com',
-        'huggingface_api': 'https://huggingface.co/api/models',
-        'cloudflare_dns': 'https://1.1.1.1/dns-query',
-        'google_dns': 'https://8.8.8.8/resolve',
-        'oss_endpoint': 'https://oss-cn-hangzhou.aliyuncs.com',
-        'cdnjs': 'https://cdnjs.cloudflare.com/ajax/libs/axios/1.6.7/axios.min.js'
-    }
-    
-    results = {
-        'timestamp': datetime.now().isoformat(),
-        'external_services': {},
-        'dns_resolution': {},
-        'port_connectivity': {}
-    }
-    
-    # Test de connectivité HTTP/HTTPS
-    session = setup_network_optimization()
-    
-    for service_name, url in services.items():
-        try:
-            response = session.get(url, timeout=15)
-            results['external_services'][service_name] = {
-                'status': 'OK',
-                'status_code': response.status_code,
-                'response_time': f"{response.elapsed.total_seconds():.2f}s",
-                'url': url
-            }
-            logger.info(f"✅ {service_name}: HTTP {response.status_code} ({response.elapsed.total_seconds():.2f}s)")
-        except Exception as e:
-            results['external_services'][service_name] = {
-                'status': 'FAILED',
-                'error': str(e),
-                'url': url
-            }
-            logger.error(f"❌ {service_name}: {str(e)}")
-    
-    # Test de résolution DNS
-    dns_servers = ['1.1.1.1', '8.8.8.8', '208.67.222.222']
-    for dns in dns_servers:
-        try:
-            socket.gethostbyname('openrouter.ai')
-            results['dns_resolution'][dns] = 'OK'
-        except Exception as e:
-            results['dns_resolution'][dns] = f'FAILED: {e}'
-    
-    # Test de ports locaux
-    local_ports = [80, 443, 8080, 3000, 7860, 9000]
-    for port in local_ports:
-        try:
-            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            sock.settimeout(2)
-            result = sock.connect_ex(('127.0.0.1', port))
-            results['port_connectivity'][port] = 'OPEN' if result == 0 else 'CLOSED'
-            sock.close()
-        except Exception as e:
-            results['port_connectivity'][port] = f'ERROR: {e}'
-    
+    """Test de connectivité étendu vers les services externes (en parallèle)"""
+    results = run_diagnostics()
+    for service_name, result in results['external_services'].items():
+        if result['status'] == 'OK':
+            logger.info(f"✅ {service_name}: HTTP {result['status_code']} ({result['latency_ms']}ms)")
+        else:
+            logger.error(f"❌ {service_name}: {result.get('error', result['status'])}")
     return results
 
-def add_production_endpoints():
-    """Ajoute des endpoints spécifiques pour la production"""
-    print("📋 Endpoints de production configurés:")
-    print("  - Health check intégré")
-    print("  - Monitoring automatique")
-    print("  - Connectivité réseau testée")
+def load_app(config):
+    """Import différé de l'application: le proxy n'a besoin ni de gradio ni de l'UI"""
+    import app
+    from services.server import serve
+    # --timeout borne l'attente du modèle, avec ou sans workers
+    app.UPSTREAM_READ_TIMEOUT = config['timeout']
+    # Client OpenAI, bucket OSS et test de connectivité en arrière-plan
+    app.start_warm_up()
+    # API REST/SSE /api/chat servie à côté de l'UI
+    return app.demo, partial(serve, routers=[app.chat_api.router()], css=app.css)
+
+def configure_queue(demo, config, workers=1):
+    """Configuration queue optimisée, la capacité est répartie entre workers"""
+    demo.queue(
+        default_concurrency_limit=split_capacity(config['max_concurrency'], workers),
+        max_size=split_capacity(config['max_queue_size'], workers)
+    )
+
+def launch_config(config, host, port, workers=1):
+    """Configuration de lancement (FastAPI + Gradio monté sur "/")"""
+    return {
+        "host": host,
+        "port": port,
+        "debug": config['debug'],
+        # Les tours en attente dans le scheduler occupent chacun un thread
+        "max_threads": max(split_capacity(config['max_concurrency'], workers),
+                           GENERATION_CONCURRENCY_LIMIT) + UI_CONCURRENCY_LIMIT,
+        "favicon_path": "./assets/qwen.png",
+    }
+
+def run_worker(index, port, config):
+    """Processus worker: l'application complète sur un port local"""
+    workers = config['workers']
+    # Un fichier de log par worker, la rotation n'est pas multi-processus
+    setup_logging(log_file=f"{LOG_PATH}.worker{index}" if LOG_PATH else None)
+    demo, serve = load_app(config)
+    configure_queue(demo, config, workers)
+    serve(demo, **launch_config(config, "127.0.0.1", port, workers))
+
+def serve_workers(config):
+    """N processus derrière le port public, sessions collantes via le proxy"""
+    workers = config['workers']
+    base_port = WORKER_BASE_PORT or config['port'] + 1
+    ports = [base_port + index for index in range(workers)]
+    # Les workers lisent ces limites à l'import: l'ensemble garde les totaux
+    os.environ["SCHEDULER_SLOTS"] = str(split_capacity(SCHEDULER_SLOTS, workers))
+    os.environ["GENERATION_CONCURRENCY_LIMIT"] = str(
+        split_capacity(GENERATION_CONCURRENCY_LIMIT, workers))
+    os.environ["LIMITER_INITIAL"] = str(split_capacity(LIMITER_INITIAL, workers))
+    os.environ["LIMITER_MAX"] = str(split_capacity(LIMITER_MAX, workers))
+    pool = WorkerPool(partial(run_worker, config=config), ports)
+    pool.start()
+    print(f"👷 {workers} workers sur 127.0.0.1:{ports[0]}-{ports[-1]}")
+    try:
+        uvicorn.run(create_proxy_app(ports, timeout=config['timeout']),
+                    host=config['host'],
+                    port=config['port'],
+                    log_level="info" if config['debug'] else "warning")
+    finally:
+        pool.stop()
 
 def start_production_app():
     """Démarre l'application en mode production optimisé"""
@@ -150,8 +143,8 @@ def start_production_app():
     parser = argparse.ArgumentParser(description="Qwen3-VL Demo - Production Version")
     parser.add_argument("--port", type=int, default=8080, help="Port de l'application (défaut: 8080)")
     parser.add_argument("--host", type=str, default="0.0.0.0", help="Hôte de l'application (défaut: 0.0.0.0)")
-    parser.add_argument("--workers", type=int, default=4, help="Nombre de workers Gunicorn")
-    parser.add_argument("--timeout", type=int, default=300, help="Timeout des requêtes en secondes")
+    parser.add_argument("--workers", type=int, default=1, help="Nombre de processus workers (défaut: 1, >1 = proxy multi-processus)")
+    parser.add_argument("--timeout", type=int, default=300, help="Attente maximale de la réponse du modèle, en secondes")
     parser.add_argument("--max-concurrency", type=int, default=50, help="Concurrence maximale")
     parser.add_argument("--max-queue-size", type=int, default=200, help="Taille maximale de la queue")
     parser.add_argument("--debug", action="store_true", help="Mode debug")
@@ -186,15 +179,15 @@ def start_production_app():
         print("\n🔍 Test de connectivité réseau...")
         try:
             connectivity = test_external_connectivity()
-            print(f"✅ Statut global: {connectivity['timestamp']}")
+            print(f"✅ Statut global: {connectivity['status']} ({connectivity['duration_ms']}ms)")
             
             for service, result in connectivity['external_services'].items():
                 status_icon = "✅" if result.get('status') == 'OK' else "❌"
-                print(f"  {status_icon} {service}: {result.get('status', 'N/A')}")
+                print(f"  {status_icon} {service}: {result.get('status', 'N/A')} ({result['latency_ms']}ms)")
             
             for dns, result in connectivity['dns_resolution'].items():
-                status_icon = "✅" if result == 'OK' else "❌"
-                print(f"  {status_icon} DNS {dns}: {result}")
+                status_icon = "✅" if result['status'] == 'OK' else "❌"
+                print(f"  {status_icon} DNS {dns}: {result['status']} ({result['latency_ms']}ms)")
                 
         except Exception as e:
             print(f"⚠️ Erreur lors du test de connectivité: {e}")
@@ -205,52 +198,24 @@ def start_production_app():
     os.environ["DEBUG"] = str(config['debug'])
     os.environ["MODELSCOPE_ENVIRONMENT"] = "production"
     
-    # Ajout des endpoints de production
-    add_production_endpoints()
-    
-    # Configuration queue optimisée pour la production
-    demo.queue(
-        default_concurrency_limit=config['max_concurrency'],
-        max_size=config['max_queue_size'],
-        timeout=config['timeout'],
-        api_name="/api/predict"
-    )
-    
-    # Configuration de lancement
-    launch_config = {
-        "server_name": config['host'],
-        "server_port": config['port'],
-        "share": False,  # Toujours False en production
-        "show_error": config['debug'],
-        "quiet": not config['debug'],
-        "ssr_mode": False,
-        "max_threads": config['max_concurrency'],
-        "enable_queue": True,
-        "faster_api": True,
-        "height": 800,
-        "title": "Qwen3-VL Demo - Production",
-        "favicon_path": "./assets/qwen.png",
-        "ssl_verify": False,
-        "app_kwargs": {
-            "cors": "*",
-            "favicon": "./assets/qwen.png"
-        }
-    }
-    
     print(f"\n🎯 Démarrage de l'application sur http://{config['host']}:{config['port']}")
     print("📋 Endpoints disponibles:")
     print("  - /                    Interface principale")
-    print("  - /health              Health check simple")
-    print("  - /network-test        Test réseau détaillé") 
+    print("  - /health              Liveness (processus vivant)")
+    print("  - /ready, /api/status  Readiness en cache pour load balancer")
+    print("  - /network-test        Test réseau détaillé (X-Admin-Token)")
     print("  - /config              Configuration de l'app")
-    print("  - /api/status          Status pour load balancer")
-    print("  - /api/metrics         Métriques système")
-    print("  - /api/predict         API de prédiction")
+    print("  - /metrics             Métriques Prometheus")
     print("\n✅ Application prête!")
     
     try:
         # Lancement de l'application
-        demo.launch(**launch_config)
+        if config['workers'] > 1:
+            serve_workers(config)
+        else:
+            demo, serve = load_app(config)
+            configure_queue(demo, config)
+            serve(demo, **launch_config(config, config['host'], config['port']))
     except KeyboardInterrupt:
         print("\n🛑 Arrêt de l'application par l'utilisateur")
     except Exception as e:
@@ -0,0 +1,274 @@
+#!/usr/bin/env python3
+"""
+Offline batch inference over a JSONL of prompts.
+
+Each input line is `{"id": ..., "files": [...], "prompt": "...",
+"thinking": false}` (`id` defaults to the line number, relative file paths
+are resolved against the input file). Requests go through the same pipeline
+as the UI: `format_history` with `DEFAULT_SYS_PROMPT` and the media
+upload/encoding, the model selection of `submit`, and the `Completion`
+pipeline (scheduler, adaptive limiter, upstream breaker and retries, usage
+ledger).
+
+Results are appended to the output JSONL as they complete, which doubles as
+the checkpoint: a rerun skips the ids already answered and retries the ones
+that failed.
+
+    python batch.py jobs.jsonl --output results.jsonl --concurrency 8
+    python -m benchmarks.mock_upstream --port 8900 &
+    python batch.py jobs.jsonl --output results.jsonl --base-url http://127.0.0.1:8900/v1 --api-key mock
+"""
+
+import argparse
+import concurrent.futures
+import json
+import os
+import statistics
+import sys
+import time
+from datetime import datetime
+
+PROGRESS_INTERVAL = 10
+FSYNC_EVERY = 20
+
+
+def load_jobs(path):
+    """Yield the input records, with `id` and absolute file paths."""
+    base_dir = os.path.dirname(os.path.abspath(path))
+    with open(path) as jobs:
+        for line_number, line in enumerate(jobs, 1):
+            if not line.strip():
+                continue
+            job = json.loads(line)
+            job.setdefault("id", line_number)
+            job["files"] = [
+                file if file.startswith("http") or os.path.isabs(file) else
+                os.path.join(base_dir, file) for file in job.get("files", [])
+            ]
+            yield job
+
+
+def completed_ids(path):
+    """Ids answered successfully by a previous run of the same output."""
+    done = set()
+    if not os.path.exists(path):
+        return done
+    with open(path) as results:
+        for line in results:
+            try:
+                result = json.loads(line)
+            except json.JSONDecodeError:
+                # Last line of a run killed mid-write
+                continue
+            if result.get("status") == "ok":
+                done.add(str(result["id"]))
+    return done
+
+
+def _ends_with_newline(path):
+    with open(path, "rb") as results:
+        results.seek(-1, os.SEEK_END)
+        return results.read(1) == b"\n"
+
+
+def run_job(app, job):
+    """Send one job upstream and return its result record."""
+    from services.cancellation import streams
+    from services.completion import Completion
+    from services.scheduler import classify_turn
+
+    history = [{
+        "role": "user",
+        "content": [{
+            "type": "file",
+            "content": job["files"]
+        }, {
+            "type": "text",
+            "content": job.get("prompt", "")
+        }]
+    }]
+    for file in job["files"]:
+        # format_history skips unreadable files, a batch must not
+        if not file.startswith("http") and not os.path.isfile(file):
+            raise FileNotFoundError(f"No such file: {file}")
+    model = app.select_model(bool(job.get("thinking")))
+    started = time.monotonic()
+    # The inputs are the caller's files, not uploads the janitor manages
+    messages = app.format_history(history, {}, touch=False)
+    client = app.get_client()
+    if not client:
+        raise RuntimeError("API not configured, set API_KEY or --api-key")
+
+    conversation_id = f"batch:{job['id']}"
+    completion = Completion(client, model, messages, "batch", conversation_id,
+                            classify_turn(history),
+                            streams.start(conversation_id, model),
+                            headers=app.UPSTREAM_HEADERS)
+    for _ in completion:
+        pass
+    return {
+        "id": job["id"],
+        "status": "ok",
+        "model": model,
+        "reasoning": completion.reasoning,
+        "answer": completion.answer,
+        "usage": completion.usage._asdict(),
+        "ttft_s": round(completion.ttft or 0, 3),
+        "latency_s": round(time.monotonic() - started, 3),
+        "finished_at": datetime.now().isoformat(),
+    }
+
+
+class BatchStats:
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.ok = 0
+        self.errors = {}
+        self.skipped = 0
+        self.latencies = []
+        self.ttfts = []
+        self.tokens = 0
+
+    def record(self, result):
+        if result["status"] == "ok":
+            self.ok += 1
+            self.latencies.append(result["latency_s"])
+            self.ttfts.append(result["ttft_s"])
+            self.tokens += result["usage"]["completion"]
+        else:
+            self.errors[result["error_type"]] = self.errors.get(
+                result["error_type"], 0) + 1
+
+    def summary(self):
+        elapsed = time.monotonic() - self.started
+        done = self.ok + sum(self.errors.values())
+
+        def percentile(values, q):
+            if len(values) < 2:
+                return values[0] if values else None
+            return round(statistics.quantiles(values, n=100)[q - 1], 3)
+
+        return {
+            "completed": done,
+            "ok": self.ok,
+            "errors": dict(self.errors),
+            "skipped": self.skipped,
+            "elapsed_s": round(elapsed, 2),
+            "requests_per_s": round(done / elapsed, 3) if elapsed else 0,
+            "completion_tokens_per_s": round(self.tokens / elapsed, 1)
+            if elapsed else 0,
+            "latency_p50_s": percentile(self.latencies, 50),
+            "latency_p95_s": percentile(self.latencies, 95),
+            "ttft_p50_s": percentile(self.ttfts, 50),
+            "ttft_p95_s": percentile(self.ttfts, 95),
+        }
+
+
+def run_batch(app, jobs, output_path, concurrency, stats):
+    """Run `jobs` with at most `concurrency` in flight, appending results."""
+    written = 0
+    last_progress = time.monotonic()
+    with open(output_path, "a") as output, \
+            concurrent.futures.ThreadPoolExecutor(concurrency) as executor:
+        pending = {}
+        if output.tell() and not _ends_with_newline(output_path):
+            # Terminate the partial line of a killed run
+            output.write("\n")
+
+        def write(result):
+            nonlocal written
+            output.write(json.dumps(result, ensure_ascii=False) + "\n")
+            output.flush()
+            written += 1
+            if written % FSYNC_EVERY == 0:
+                os.fsync(output.fileno())
+
+        def drain(block):
+            nonlocal last_progress
+            done, _ = concurrent.futures.wait(
+                pending,
+                timeout=None if block else 0,
+                return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                job = pending.pop(future)
+                try:
+                    result = future.result()
+                except Exception as e:
+                    result = {
+                        "id": job["id"],
+                        "status": "error",
+                        "error_type": type(e).__name__,
+                        "error": str(e),
+                        "finished_at": datetime.now().isoformat(),
+                    }
+                stats.record(result)
+                write(result)
+            if time.monotonic() - last_progress >= PROGRESS_INTERVAL:
+                last_progress = time.monotonic()
+                summary = stats.summary()
+                print(f"⏳ {summary['completed']} done ({summary['ok']} ok), "
+                      f"{summary['requests_per_s']} req/s, "
+                      f"{len(pending)} in flight")
+
+        # Jobs are read lazily, only `concurrency` of them are queued ahead
+        for job in jobs:
+            while len(pending) >= concurrency * 2:
+                drain(block=True)
+            pending[executor.submit(run_job, app, job)] = job
+            drain(block=False)
+        while pending:
+            drain(block=True)
+        os.fsync(output.fileno())
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Run a JSONL of prompts through the Qwen3-VL pipeline")
+    parser.add_argument("input", help="JSONL of {id, files, prompt, thinking}")
+    parser.add_argument("--output", required=True,
+                        help="Results JSONL, also the resume checkpoint")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--base-url", help="Overrides BASE_URL")
+    parser.add_argument("--api-key", help="Overrides API_KEY")
+    parser.add_argument("--stats", help="Write the final stats JSON here")
+    args = parser.parse_args()
+
+    # Read by config when app is imported
+    if args.base_url:
+        os.environ["BASE_URL"] = args.base_url
+    if args.api_key:
+        os.environ["API_KEY"] = args.api_key
+    import app
+
+    done = completed_ids(args.output)
+    stats = BatchStats()
+
+    def pending_jobs():
+        for job in load_jobs(args.input):
+            if str(job["id"]) in done:
+                stats.skipped += 1
+                continue
+            yield job
+
+    print(f"📦 Batch {args.input} -> {args.output} "
+          f"(concurrency {args.concurrency}, {len(done)} already done)")
+    try:
+        run_batch(app, pending_jobs(), args.output, args.concurrency, stats)
+    except KeyboardInterrupt:
+        print("\n🛑 Interrupted, rerun the same command to resume")
+    summary = stats.summary()
+    print(f"✅ {summary['ok']} ok, {sum(summary['errors'].values())} errors, "
+          f"{summary['skipped']} skipped in {summary['elapsed_s']}s "
+          f"({summary['requests_per_s']} req/s, "
+          f"{summary['completion_tokens_per_s']} tokens/s)")
+    for error_type, count in summary["errors"].items():
+        print(f"  ❌ {error_type}: {count}")
+    if args.stats:
+        with open(args.stats, "w") as output:
+            json.dump(summary, output, indent=2)
+    sys.exit(1 if summary["errors"] else 0)
+
+
+if __name__ == "__main__":
+    main()
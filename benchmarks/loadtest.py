@@ -0,0 +1,230 @@
+"""
+Load test of the chat pipeline against the local mock upstream.
+
+Starts `MockUpstream`, points `BASE_URL` at it, then drives
+`Gradio_Events.add_message` turns at rising concurrency. Gradio's queue is
+emulated with the `demo.queue` settings of `app.py` or `app_prod.py`
+(concurrency limit + max size), so the numbers reflect what one instance
+can serve with that configuration.
+
+    python -m benchmarks.loadtest --profile app --levels 1,10,25,50
+"""
+
+import argparse
+import json
+import os
+import resource
+import statistics
+import threading
+import time
+import types
+import uuid
+
+# demo.queue settings used by the launchers: (default_concurrency_limit, max_size)
+QUEUE_PROFILES = {
+    "app": (50, 100),
+    "app_prod": (50, 200),
+}
+
+
+class FakeRequest:
+    """Enough of gr.Request for get_session_id(), one per virtual user."""
+
+    username = None
+
+    def __init__(self, index):
+        # config reads the environment main() sets up
+        from config import CLIENT_COOKIE
+        self.session_hash = uuid.uuid4().hex
+        self.cookies = {CLIENT_COOKIE: self.session_hash}
+        self.client = types.SimpleNamespace(
+            host=f"10.0.{index // 256}.{index % 256}", port=50000)
+
+
+class EmulatedQueue:
+    """Gradio queue stand-in: N workers, bounded number of waiting events."""
+
+    def __init__(self, concurrency_limit, max_size):
+        self.max_size = max_size
+        self._slots = threading.Semaphore(concurrency_limit)
+        self._lock = threading.Lock()
+        self._waiting = 0
+
+    def enter(self):
+        """Return the time spent waiting, or None when the queue is full."""
+        with self._lock:
+            if self._waiting >= self.max_size:
+                return None
+            self._waiting += 1
+        started = time.monotonic()
+        self._slots.acquire()
+        with self._lock:
+            self._waiting -= 1
+        return time.monotonic() - started
+
+    def leave(self):
+        self._slots.release()
+
+
+def rss_mb():
+    try:
+        with open("/proc/self/status") as status:
+            for line in status:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    # ru_maxrss is the peak, in KiB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def percentile(values, p):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100.0 *
+                                                 (len(values) - 1))))]
+
+
+def run_turn(app, gradio_queue, thinking, compare, request, result):
+    state_value = {
+        "conversation_contexts": {},
+        "conversations": [],
+        "conversation_id": "",
+        "oss_cache": {}
+    }
+    queue_wait = gradio_queue.enter()
+    if queue_wait is None:
+        result["outcome"] = "rejected"
+        return
+    started = time.monotonic()
+    try:
+        for _ in app.Gradio_Events.add_message(
+            {"text": "Describe the image.", "files": []},
+            {"enable_thinking": thinking}, {"compare": compare}, state_value, request):
+            history = state_value["conversation_contexts"][
+                state_value["conversation_id"]]["history"]
+            if "ttft" not in result and history[-1]["role"] == "assistant" \
+                    and history[-1]["content"]:
+                result["ttft"] = time.monotonic() - started
+        result["outcome"] = "success"
+    except Exception as e:
+        result["outcome"] = "error"
+        result["error"] = str(e)
+    finally:
+        gradio_queue.leave()
+        result["queue_wait"] = queue_wait
+        result["duration"] = time.monotonic() - started
+
+
+def run_level(app, concurrency, turns_per_user, profile, thinking,
+              compare=False):
+    gradio_queue = EmulatedQueue(*QUEUE_PROFILES[profile])
+    results = [{} for _ in range(concurrency * turns_per_user)]
+
+    def user(offset):
+        request = FakeRequest(offset)
+        for index in range(offset, len(results), concurrency):
+            run_turn(app, gradio_queue, thinking, compare, request,
+                     results[index])
+
+    rss_before = rss_mb()
+    started = time.monotonic()
+    threads = [
+        threading.Thread(target=user, args=(offset, ))
+        for offset in range(concurrency)
+    ]
+    for thread in threads:
+        thread.start()
+    peak_rss = rss_before
+    while any(thread.is_alive() for thread in threads):
+        peak_rss = max(peak_rss, rss_mb())
+        time.sleep(0.1)
+    elapsed = time.monotonic() - started
+
+    succeeded = [r for r in results if r.get("outcome") == "success"]
+    ttfts = [r["ttft"] for r in succeeded if "ttft" in r]
+    waits = [r["queue_wait"] for r in results if r.get("queue_wait") is not None]
+    durations = [r["duration"] for r in succeeded]
+    return {
+        "concurrency": concurrency,
+        "turns": len(results),
+        "succeeded": len(succeeded),
+        "errors": sum(r.get("outcome") == "error" for r in results),
+        "rejected": sum(r.get("outcome") == "rejected" for r in results),
+        "elapsed_s": round(elapsed, 3),
+        "throughput_turns_s": round(len(succeeded) / elapsed, 3),
+        "ttft_p50_s": percentile(ttfts, 50),
+        "ttft_p95_s": percentile(ttfts, 95),
+        "queue_wait_p50_s": percentile(waits, 50),
+        "queue_wait_p95_s": percentile(waits, 95),
+        "turn_p50_s": statistics.median(durations) if durations else None,
+        "rss_mb_before": round(rss_before, 1),
+        "rss_mb_peak": round(peak_rss, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Qwen3-VL Demo load test")
+    parser.add_argument("--profile", choices=sorted(QUEUE_PROFILES),
+                        default="app")
+    parser.add_argument("--levels", default="1,5,10,25,50",
+                        help="Comma separated concurrency levels")
+    parser.add_argument("--turns-per-user", type=int, default=2)
+    parser.add_argument("--thinking", action="store_true")
+    parser.add_argument("--compare", action="store_true",
+                        help="Stream both models in every turn")
+    parser.add_argument("--ttft", type=float, default=0.3)
+    parser.add_argument("--tps", type=float, default=50)
+    parser.add_argument("--answer-tokens", type=int, default=60)
+    parser.add_argument("--reasoning-tokens", type=int, default=0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--output", help="Write the JSON report here")
+    args = parser.parse_args()
+
+    from benchmarks.mock_upstream import MockUpstream
+
+    with MockUpstream(ttft=args.ttft,
+                      tokens_per_sec=args.tps,
+                      answer_tokens=args.answer_tokens,
+                      reasoning_tokens=args.reasoning_tokens,
+                      error_rate=args.error_rate) as upstream:
+        # config reads these at import time, set them before importing app
+        os.environ["BASE_URL"] = upstream.base_url
+        os.environ.setdefault("API_KEY", "mock")
+        # Every virtual user has its own client id, but keep the test about
+        # capacity rather than per-user rate limits
+        os.environ.setdefault("RATE_LIMIT_PER_MINUTE", "0")
+        import app
+
+        report = {
+            "profile": args.profile,
+            "compare": args.compare,
+            "queue": dict(zip(("concurrency_limit", "max_size"),
+                              QUEUE_PROFILES[args.profile])),
+            "upstream": {
+                "ttft": args.ttft,
+                "tokens_per_sec": args.tps,
+                "answer_tokens": args.answer_tokens,
+                "reasoning_tokens": args.reasoning_tokens,
+                "error_rate": args.error_rate,
+            },
+            "levels": [],
+        }
+        for level in [int(level) for level in args.levels.split(",")]:
+            result = run_level(app, level, args.turns_per_user, args.profile,
+                               args.thinking, args.compare)
+            report["levels"].append(result)
+            print(f"👥 {level:>4} users: {result['throughput_turns_s']:>7} turns/s, "
+                  f"TTFT p95 {result['ttft_p95_s']}, queue p95 "
+                  f"{result['queue_wait_p95_s']}, errors {result['errors']}, "
+                  f"rejected {result['rejected']}, RSS {result['rss_mb_peak']}MB")
+
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(report, output, indent=2)
+        print(f"📄 Report written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
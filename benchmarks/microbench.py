@@ -0,0 +1,231 @@
+"""
+Microbenchmarks of the request-building hot path.
+
+Covers `format_history`, `encode_file_to_base64`, the chunk-processing loop
+of `Gradio_Events.submit` (fed from a synthetic in-memory stream) and
+`update_browser_state` serialisation. Results are written as JSON; with
+`--baseline` the run is compared against a previous result file and exits
+non-zero when a benchmark got slower than the threshold.
+
+    python -m benchmarks.microbench --output bench.json
+    python -m benchmarks.microbench --baseline bench.json --threshold 0.15
+"""
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+from types import SimpleNamespace
+
+from benchmarks.replay import ReplayClient, load_fixtures
+
+
+def measure(fn, repeat=7, min_time=0.05):
+    """Median/min seconds per call; calls are batched to last `min_time`."""
+    fn()
+    number = 1
+    while True:
+        started = time.perf_counter()
+        for _ in range(number):
+            fn()
+        if time.perf_counter() - started >= min_time or number >= 1 << 20:
+            break
+        number *= 2
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for _ in range(number):
+            fn()
+        timings.append((time.perf_counter() - started) / number)
+    return {
+        "median_s": statistics.median(timings),
+        "min_s": min(timings),
+        "calls": number * repeat,
+    }
+
+
+def make_file(directory, name, size):
+    path = os.path.join(directory, name)
+    with open(path, "wb") as file:
+        file.write(os.urandom(size))
+    return path
+
+
+def make_history(turns, files_per_turn, image_path):
+    history = []
+    for index in range(turns):
+        history.append({
+            "key": f"u{index}",
+            "role": "user",
+            "content": [{
+                "type": "file",
+                "content": [image_path] * files_per_turn
+            }, {
+                "type": "text",
+                "content": f"Question {index} about the picture " * 4
+            }]
+        })
+        history.append({
+            "key": f"a{index}",
+            "role": "assistant",
+            "content": [{
+                "type": "text",
+                "content": f"Answer {index} " * 80
+            }],
+            "status": "done"
+        })
+    return history
+
+
+def synthetic_stream(reasoning_tokens, answer_tokens):
+    chunks = []
+    for index in range(reasoning_tokens + answer_tokens):
+        reasoning = index < reasoning_tokens
+        delta = SimpleNamespace(
+            content=None if reasoning else f"word{index} ",
+            reasoning_content=f"thought{index} " if reasoning else None)
+        chunks.append(SimpleNamespace(choices=[SimpleNamespace(delta=delta)]))
+    return chunks
+
+
+class SyntheticClient:
+    """Replays prebuilt chunks in place of the OpenAI client."""
+
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.chat = SimpleNamespace(completions=self)
+
+    def create(self, **kwargs):
+        return iter(self.chunks)
+
+
+def run_benchmarks(app, workdir, fixtures=()):
+    results = {}
+    image_path = make_file(workdir, "image.png", 200 * 1024)
+
+    for turns in (1, 10, 50):
+        for files_per_turn in (0, 1, 4):
+            history = make_history(turns, files_per_turn, image_path)
+            results[f"format_history[turns={turns},files={files_per_turn}]"] = \
+                measure(lambda: app.format_history(history, {}))
+
+    for size_kb in (10, 1024, 10 * 1024):
+        path = make_file(workdir, f"blob_{size_kb}k.png", size_kb * 1024)
+        results[f"encode_file_to_base64[{size_kb}KB]"] = measure(
+            lambda: app.encode_file_to_base64(path), repeat=5)
+
+    for reasoning_tokens, answer_tokens in ((0, 200), (300, 200)):
+        app.client = SyntheticClient(
+            synthetic_stream(reasoning_tokens, answer_tokens))
+
+        def submit():
+            state_value = {
+                "conversation_contexts": {
+                    "bench": {
+                        "history": make_history(1, 0, image_path)[:1],
+                        "enable_thinking": bool(reasoning_tokens)
+                    }
+                },
+                "conversations": [],
+                "conversation_id": "bench",
+                "oss_cache": {}
+            }
+            for _ in app.Gradio_Events.submit(state_value, "bench"):
+                pass
+
+        results[f"submit_chunk_loop[reasoning={reasoning_tokens},answer={answer_tokens}]"] = \
+            measure(submit, repeat=5)
+
+    # Recorded upstream streams, replayed without delays
+    for name, _, records in fixtures:
+        app.client = ReplayClient(records)
+        results[f"submit_replay[{name}]"] = measure(submit, repeat=5)
+
+    for conversations in (1, 20, 100):
+        state_value = {
+            "conversations": [{
+                "label": f"chat {index}",
+                "key": f"c{index}"
+            } for index in range(conversations)],
+            "conversation_contexts": {
+                f"c{index}": {
+                    "history": make_history(5, 1, image_path),
+                    "enable_thinking": False
+                }
+                for index in range(conversations)
+            },
+            "conversation_id": "c0",
+            "oss_cache": {}
+        }
+        results[f"update_browser_state[conversations={conversations}]"] = \
+            measure(lambda: json.dumps(
+                app.Gradio_Events.update_browser_state(state_value)["value"]))
+    return results
+
+
+def compare(results, baseline, threshold):
+    """Print the comparison, return the names that regressed."""
+    regressions = []
+    for name, result in results.items():
+        previous = baseline.get("results", {}).get(name)
+        if not previous:
+            print(f"  🆕 {name}: {result['median_s'] * 1e6:.1f}µs")
+            continue
+        change = result["median_s"] / previous["median_s"] - 1
+        regressed = change > threshold
+        if regressed:
+            regressions.append(name)
+        icon = "❌" if regressed else "✅"
+        print(f"  {icon} {name}: {previous['median_s'] * 1e6:.1f}µs -> "
+              f"{result['median_s'] * 1e6:.1f}µs ({change:+.1%})")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Hot path microbenchmarks")
+    parser.add_argument("--output", default="bench.json")
+    parser.add_argument("--baseline", help="Previous result file to compare to")
+    parser.add_argument("--threshold", type=float, default=0.10,
+                        help="Allowed slowdown before failing (0.10 = 10%%)")
+    parser.add_argument("--fixtures",
+                        help="Recorded stream fixtures to replay through submit")
+    args = parser.parse_args()
+
+    # The benchmarks never reach the network
+    os.environ.pop("API_KEY", None)
+    os.environ.setdefault("RATE_LIMIT_PER_MINUTE", "0")
+    import app
+
+    fixtures = load_fixtures(args.fixtures) if args.fixtures else ()
+    with tempfile.TemporaryDirectory() as workdir:
+        results = run_benchmarks(app, workdir, fixtures)
+
+    report = {
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "timestamp": time.time(),
+        "results": results,
+    }
+    with open(args.output, "w") as output:
+        json.dump(report, output, indent=2)
+    print(f"📄 Results written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"❌ {len(regressions)} regression(s) above {args.threshold:.0%}")
+            sys.exit(1)
+        print("✅ No regression")
+    else:
+        for name, result in results.items():
+            print(f"  {name}: {result['median_s'] * 1e6:.1f}µs")
+
+
+if __name__ == "__main__":
+    main()
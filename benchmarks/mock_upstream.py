@@ -0,0 +1,247 @@
+"""
+Local mock of an OpenAI-compatible chat-completions upstream.
+
+Streams `chat.completion.chunk` SSE events with configurable time-to-first
+token, tokens/s, `reasoning_content` and error injection, so load tests and
+benchmarks can run without spending API credit.
+
+    python -m benchmarks.mock_upstream --port 8900 --ttft 0.5 --tps 40
+    BASE_URL=http://127.0.0.1:8900/v1 API_KEY=mock python app.py
+"""
+
+import argparse
+import json
+import random
+import sys
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # Clients dropping keep-alive connections are expected, not errors
+        if isinstance(sys.exc_info()[1], ConnectionError):
+            return
+        super().handle_error(request, client_address)
+
+
+class MockUpstream:
+    """Threaded mock server, usable as a context manager."""
+
+    def __init__(self, host="127.0.0.1", port=0, ttft=0.3, tokens_per_sec=50,
+                 answer_tokens=60, reasoning_tokens=0, error_rate=0.0,
+                 error_status=429, mid_stream_error_rate=0.0, seed=None):
+        self.ttft = ttft
+        self.tokens_per_sec = tokens_per_sec
+        self.answer_tokens = answer_tokens
+        self.reasoning_tokens = reasoning_tokens
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.mid_stream_error_rate = mid_stream_error_rate
+        self.random = random.Random(seed)
+        self.requests = 0
+        self._lock = threading.Lock()
+        self._server = _Server((host, port), self._handler())
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever,
+                                        name="mock-upstream",
+                                        daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def _roll(self, rate):
+        with self._lock:
+            return self.random.random() < rate
+
+    def script(self, request):
+        """
+        Events of one streamed response: dicts with a `delay` (seconds to
+        sleep first) and either a `delta`, a `finish_reason` or `drop`.
+        """
+        interval = 1.0 / self.tokens_per_sec
+        fail = self._roll(self.mid_stream_error_rate)
+        total = self.reasoning_tokens + self.answer_tokens
+        for index in range(total):
+            delay = self.ttft if index == 0 else interval
+            if fail and index == total // 2:
+                yield {"delay": delay, "drop": True}
+                return
+            if index < self.reasoning_tokens:
+                delta = {
+                    "content": None,
+                    "reasoning_content": f"thought{index} "
+                }
+            else:
+                delta = {"content": f"word{index} "}
+            yield {"delay": delay, "delta": delta}
+        yield {"delay": interval, "finish_reason": "stop"}
+
+    def usage(self, request, completion_tokens):
+        return {
+            "prompt_tokens": 100,
+            "completion_tokens": completion_tokens,
+            "total_tokens": 100 + completion_tokens,
+            "completion_tokens_details": {
+                "reasoning_tokens": min(self.reasoning_tokens,
+                                        completion_tokens)
+            },
+        }
+
+    def _handler(self):
+        upstream = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass
+
+            def _json(self, status, body):
+                payload = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def do_GET(self):
+                if self.path.rstrip("/").endswith("/models"):
+                    self._json(200, {"data": [{"id": "mock-model"}]})
+                else:
+                    self._json(404, {"error": {"message": "not found"}})
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                request = json.loads(self.rfile.read(length) or b"{}")
+                if not self.path.rstrip("/").endswith("/chat/completions"):
+                    self._json(404, {"error": {"message": "not found"}})
+                    return
+                with upstream._lock:
+                    upstream.requests += 1
+                if upstream._roll(upstream.error_rate):
+                    self._json(upstream.error_status, {
+                        "error": {
+                            "message": "injected error",
+                            "code": upstream.error_status
+                        }
+                    })
+                    return
+                self.stream(request)
+
+            def _event(self, data):
+                payload = f"data: {data}\n\n".encode()
+                self.wfile.write(f"{len(payload):x}\r\n".encode() + payload +
+                                 b"\r\n")
+                self.wfile.flush()
+
+            def _chunk(self, model, completion_id, delta, finish_reason=None,
+                       usage=None):
+                body = {
+                    "id": completion_id,
+                    "object": "chat.completion.chunk",
+                    "created": int(time.time()),
+                    "model": model,
+                    "choices": [] if usage else [{
+                        "index": 0,
+                        "delta": delta,
+                        "finish_reason": finish_reason
+                    }],
+                }
+                if usage:
+                    body["usage"] = usage
+                self._event(json.dumps(body))
+
+            def stream(self, request):
+                model = request.get("model", "mock-model")
+                completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Cache-Control", "no-cache")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+                try:
+                    self._chunk(model, completion_id, {
+                        "role": "assistant",
+                        "content": ""
+                    })
+                    tokens = 0
+                    for event in upstream.script(request):
+                        time.sleep(event.get("delay", 0))
+                        if event.get("drop"):
+                            # Drop the connection without ending the stream
+                            self.close_connection = True
+                            return
+                        if "delta" in event:
+                            tokens += 1
+                        self._chunk(model, completion_id,
+                                    event.get("delta", {}),
+                                    finish_reason=event.get("finish_reason"))
+                    if (request.get("stream_options") or {}).get(
+                            "include_usage"):
+                        self._chunk(model, completion_id, {},
+                                    usage=upstream.usage(request, tokens))
+                    self._event("[DONE]")
+                    self.wfile.write(b"0\r\n\r\n")
+                    self.wfile.flush()
+                except (BrokenPipeError, ConnectionResetError):
+                    # Client cancelled the stream
+                    self.close_connection = True
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Mock OpenAI-compatible streaming upstream")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument("--ttft", type=float, default=0.3,
+                        help="Seconds before the first token")
+    parser.add_argument("--tps", type=float, default=50,
+                        help="Tokens per second after the first token")
+    parser.add_argument("--answer-tokens", type=int, default=60)
+    parser.add_argument("--reasoning-tokens", type=int, default=0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--error-status", type=int, default=429)
+    parser.add_argument("--mid-stream-error-rate", type=float, default=0.0)
+    args = parser.parse_args()
+
+    upstream = MockUpstream(host=args.host,
+                            port=args.port,
+                            ttft=args.ttft,
+                            tokens_per_sec=args.tps,
+                            answer_tokens=args.answer_tokens,
+                            reasoning_tokens=args.reasoning_tokens,
+                            error_rate=args.error_rate,
+                            error_status=args.error_status,
+                            mid_stream_error_rate=args.mid_stream_error_rate)
+    print(f"🧪 Mock upstream on {upstream.base_url}")
+    try:
+        upstream._server.serve_forever()
+    except KeyboardInterrupt:
+        upstream.stop()
+
+
+if __name__ == "__main__":
+    main()
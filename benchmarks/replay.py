@@ -0,0 +1,131 @@
+"""
+Replay of recorded upstream streams (see `services/stream_recorder.py`).
+
+`ReplayUpstream` serves fixtures over HTTP like the real upstream, at the
+recorded pace divided by `speed` (`speed=0` sends as fast as possible).
+`ReplayClient` does the same in-process in place of the OpenAI client.
+
+    RECORD_STREAMS_DIR=fixtures/streams python app.py      # record
+    python -m benchmarks.replay --fixtures fixtures/streams --speed 2
+"""
+
+import argparse
+import glob
+import itertools
+import json
+import os
+import threading
+import time
+from types import SimpleNamespace
+
+from benchmarks.mock_upstream import MockUpstream
+
+
+def load_fixture(path):
+    """Return `(header, records)` of a JSONL fixture."""
+    with open(path) as fixture:
+        header = json.loads(fixture.readline())
+        records = [json.loads(line) for line in fixture if line.strip()]
+    return header, records
+
+
+def load_fixtures(path):
+    """Load a single fixture file or every `*.jsonl` of a directory."""
+    paths = sorted(glob.glob(os.path.join(path, "*.jsonl"))) \
+        if os.path.isdir(path) else [path]
+    if not paths:
+        raise FileNotFoundError(f"No fixture found in {path}")
+    return [(os.path.basename(p), *load_fixture(p)) for p in paths]
+
+
+def replay_events(records, speed=1.0):
+    """Turn fixture records into `MockUpstream.script()` events."""
+    emitted_at = 0.0
+    for record in records:
+        delay = (record["t"] - emitted_at) / speed if speed else 0
+        # Role-only and empty chunks are not replayed, their time is kept
+        delta = {k: v for k, v in record.get("delta", {}).items() if v}
+        if delta:
+            event = {"delay": delay, "delta": delta}
+        elif record.get("finish_reason"):
+            event = {"delay": delay, "finish_reason": record["finish_reason"]}
+        else:
+            continue
+        emitted_at = record["t"]
+        yield event
+
+
+class ReplayUpstream(MockUpstream):
+    """Mock upstream serving recorded fixtures round-robin."""
+
+    def __init__(self, fixtures, speed=1.0, **kwargs):
+        super().__init__(**kwargs)
+        self.fixtures = fixtures
+        self.speed = speed
+        self._cycle = itertools.cycle(fixtures)
+        self._cycle_lock = threading.Lock()
+        self._usage = threading.local()
+
+    def script(self, request):
+        with self._cycle_lock:
+            _, _, records = next(self._cycle)
+        self._usage.value = next(
+            (record["usage"] for record in records if record.get("usage")),
+            None)
+        return replay_events(records, self.speed)
+
+    def usage(self, request, completion_tokens):
+        return getattr(self._usage, "value", None) or super().usage(
+            request, completion_tokens)
+
+
+class ReplayClient:
+    """In-process stand-in for the OpenAI client replaying one fixture."""
+
+    def __init__(self, records, speed=0):
+        self.records = records
+        self.speed = speed
+        self.chat = SimpleNamespace(completions=self)
+
+    def create(self, **kwargs):
+        return self._stream()
+
+    def _stream(self):
+        for event in replay_events(self.records, self.speed):
+            if event["delay"]:
+                time.sleep(event["delay"])
+            delta = event.get("delta", {})
+            yield SimpleNamespace(choices=[
+                SimpleNamespace(delta=SimpleNamespace(
+                    content=delta.get("content"),
+                    reasoning_content=delta.get("reasoning_content")),
+                                finish_reason=event.get("finish_reason"))
+            ], usage=None)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Serve recorded chat-completion streams")
+    parser.add_argument("--fixtures", required=True,
+                        help="Fixture file or directory of *.jsonl fixtures")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument("--speed", type=float, default=1.0,
+                        help="Pace multiplier, 0 sends without delays")
+    args = parser.parse_args()
+
+    fixtures = load_fixtures(args.fixtures)
+    upstream = ReplayUpstream(fixtures,
+                              speed=args.speed,
+                              host=args.host,
+                              port=args.port)
+    print(f"🎞️ Replaying {len(fixtures)} fixture(s) on {upstream.base_url} "
+          f"at x{args.speed}")
+    try:
+        upstream._server.serve_forever()
+    except KeyboardInterrupt:
+        upstream.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+"""
+Cold-start report: wall time and import-time breakdown of the entry modules.
+
+Each module is imported in a fresh interpreter with `-X importtime`; the
+self time of every imported module is summed per top-level package, so the
+table shows where startup goes (gradio, modelscope_studio, building the UI
+in `app`, ...).
+
+    python -m benchmarks.startup
+    python -m benchmarks.startup --modules app --top 25 --output startup.json
+"""
+
+import argparse
+import collections
+import json
+import re
+import subprocess
+import sys
+import time
+
+IMPORT_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|\s*(\S+)")
+
+
+def import_profile(module):
+    """Import `module` in a new interpreter, return wall time and breakdown."""
+    started = time.perf_counter()
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        text=True)
+    wall = time.perf_counter() - started
+    if completed.returncode:
+        raise RuntimeError(f"import {module} failed:\n{completed.stderr[-2000:]}")
+    packages = collections.Counter()
+    for line in completed.stderr.splitlines():
+        match = IMPORT_LINE.match(line)
+        if match:
+            self_us, _, name = match.groups()
+            packages[name.split(".")[0]] += int(self_us)
+    return {
+        "wall_s": wall,
+        "import_s": sum(packages.values()) / 1e6,
+        "packages": {
+            name: microseconds / 1e6
+            for name, microseconds in packages.most_common()
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Startup import-time report")
+    parser.add_argument("--modules", default="config,app_prod,app",
+                        help="Comma separated modules to import")
+    parser.add_argument("--top", type=int, default=15,
+                        help="Packages listed per module")
+    parser.add_argument("--output", help="Write the JSON report here")
+    args = parser.parse_args()
+
+    report = {}
+    for module in args.modules.split(","):
+        profile = report[module] = import_profile(module)
+        print(f"⏱️ import {module}: {profile['wall_s']:.2f}s wall, "
+              f"{profile['import_s']:.2f}s in imports")
+        for name, seconds in list(profile["packages"].items())[:args.top]:
+            print(f"  {seconds * 1000:8.1f}ms  {name}")
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(report, output, indent=2)
+        print(f"📄 Report written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,6 @@
 import os
-from modelscope_studio.components.pro.chatbot import ChatbotActionConfig, ChatbotBotConfig, ChatbotUserConfig, ChatbotWelcomeConfig, ChatbotMarkdownConfig
-from modelscope_studio.components.pro.multimodal_input import MultimodalInputUploadConfig
-import oss2
-from oss2.credentials import EnvironmentVariableCredentialsProvider
+import tempfile
+import threading
 
 # Oss - Optional configuration
 endpoint = os.getenv("OSS_ENDPOINT")
@@ -10,24 +8,194 @@ region = os.getenv("OSS_REGION")
 bucket_name = os.getenv("OSS_BUCKET_NAME")
 
 # Only create bucket if all required OSS variables are present
-bucket = None
-if endpoint and region and bucket_name:
-    try:
-        auth = oss2.ProviderAuthV4(EnvironmentVariableCredentialsProvider())
-        bucket = oss2.Bucket(auth, endpoint, bucket_name, region=region)
-    except Exception as e:
-        print(f"Warning: Could not initialize OSS bucket: {e}")
-        bucket = None
+oss_configured = bool(endpoint and region and bucket_name)
+_bucket = None
+_bucket_lock = threading.Lock()
+
+
+def get_bucket():
+    """OSS bucket, built on first use (oss2 is slow to import)"""
+    global _bucket
+    if _bucket is None and oss_configured:
+        with _bucket_lock:
+            if _bucket is None:
+                try:
+                    import oss2
+                    from oss2.credentials import EnvironmentVariableCredentialsProvider
+                    auth = oss2.ProviderAuthV4(
+                        EnvironmentVariableCredentialsProvider())
+                    _bucket = oss2.Bucket(auth,
+                                          endpoint,
+                                          bucket_name,
+                                          region=region)
+                except Exception as e:
+                    print(f"Warning: Could not initialize OSS bucket: {e}")
+    return _bucket
 
 # Env
 is_cn = os.getenv('MODELSCOPE_ENVIRONMENT') == 'studio'
 api_key = os.getenv('API_KEY')
-base_url = "https://openrouter.ai/api/v1"
+base_url = os.getenv("BASE_URL", "https://openrouter.ai/api/v1")
 
 # OpenRouter models
 MODEL = "nvidia/nemotron-nano-12b-v2-vl:free"
 THINKING_MODEL = "nvidia/nemotron-nano-12b-v2-vl:free"
 
+# Upstream resilience
+# Longest wait for the next bytes of a model response (app_prod --timeout)
+UPSTREAM_READ_TIMEOUT = float(os.getenv("TIMEOUT", 300))
+UPSTREAM_MAX_RETRIES = int(os.getenv("UPSTREAM_MAX_RETRIES", 2))
+UPSTREAM_BACKOFF_BASE = float(os.getenv("UPSTREAM_BACKOFF_BASE", 0.5))
+UPSTREAM_BACKOFF_MAX = float(os.getenv("UPSTREAM_BACKOFF_MAX", 8))
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("BREAKER_FAILURE_THRESHOLD", 5))
+BREAKER_RESET_TIMEOUT = float(os.getenv("BREAKER_RESET_TIMEOUT", 30))
+# Hedging: fire a second request when the first token is later than the
+# given percentile of recent time-to-first-token samples
+HEDGE_ENABLED = os.getenv("HEDGE_ENABLED", "false").lower() == "true"
+HEDGE_PERCENTILE = float(os.getenv("HEDGE_PERCENTILE", 95))
+HEDGE_MIN_DELAY = float(os.getenv("HEDGE_MIN_DELAY", 1.0))
+HEDGE_MIN_SAMPLES = int(os.getenv("HEDGE_MIN_SAMPLES", 20))
+
+# Adaptive (AIMD) upstream concurrency limiter
+LIMITER_INITIAL = int(os.getenv("LIMITER_INITIAL", 10))
+LIMITER_MIN = int(os.getenv("LIMITER_MIN", 1))
+LIMITER_MAX = int(os.getenv("LIMITER_MAX", 50))
+LIMITER_DECREASE_FACTOR = float(os.getenv("LIMITER_DECREASE_FACTOR", 0.5))
+# A time-to-first-token above this multiple of the baseline counts as overload
+LIMITER_LATENCY_SPIKE = float(os.getenv("LIMITER_LATENCY_SPIKE", 3.0))
+LIMITER_QUEUE_TIMEOUT = float(os.getenv("LIMITER_QUEUE_TIMEOUT", 300))
+
+# Per-user fair-share scheduling of generation turns
+SCHEDULER_SLOTS = int(os.getenv("SCHEDULER_SLOTS", 50))
+# Seconds after which a waiting turn is served regardless of its class
+SCHEDULER_AGING = float(os.getenv("SCHEDULER_AGING", 30))
+# Token bucket per session, 0 disables rate limiting
+RATE_LIMIT_PER_MINUTE = float(os.getenv("RATE_LIMIT_PER_MINUTE", 10))
+RATE_LIMIT_BURST = int(os.getenv("RATE_LIMIT_BURST", 5))
+# Browser cookie keying anonymous users, many of them can share one IP
+CLIENT_COOKIE = "qwen_client"
+CLIENT_COOKIE_MAX_AGE = 365 * 24 * 3600
+
+# Gradio concurrency lanes: streaming generations share one lane, cheap
+# queued UI events (browser state sync) get their own. The generation lane
+# admits more turns than SCHEDULER_SLOTS, so that waiting turns queue in the
+# fair scheduler, which orders them per session, not in Gradio's FIFO
+GENERATION_CONCURRENCY_ID = "generation"
+GENERATION_CONCURRENCY_LIMIT = int(
+    os.getenv("GENERATION_CONCURRENCY_LIMIT", SCHEDULER_SLOTS * 4))
+UI_CONCURRENCY_ID = "ui"
+UI_CONCURRENCY_LIMIT = int(os.getenv("UI_CONCURRENCY_LIMIT", 100))
+
+# Background health prober behind /health and /api/status
+HEALTH_PROBE_INTERVAL = float(os.getenv("HEALTH_PROBE_INTERVAL", 15))
+HEALTH_PROBE_TIMEOUT = float(os.getenv("HEALTH_PROBE_TIMEOUT", 5))
+# Report not-ready (HTTP 503) when the upstream is unreachable
+HEALTH_REQUIRE_UPSTREAM = os.getenv("HEALTH_REQUIRE_UPSTREAM",
+                                    "false").lower() == "true"
+
+# Connectivity diagnostics (all probes run concurrently)
+DIAGNOSTICS_DEADLINE = float(os.getenv("DIAGNOSTICS_DEADLINE", 10))
+DIAGNOSTICS_PROBE_TIMEOUT = float(os.getenv("DIAGNOSTICS_PROBE_TIMEOUT", 5))
+
+# Record every upstream stream as a replayable fixture into this directory
+RECORD_STREAMS_DIR = os.getenv("RECORD_STREAMS_DIR")
+
+# Request tracing: OTLP/JSON lines file, and threshold (s) above which the
+# span tree of a request is logged at INFO (0, the default, disables the
+# slow-request log: reasoning turns routinely take minutes)
+TRACE_EXPORT_PATH = os.getenv("TRACE_EXPORT_PATH")
+TRACE_SLOW_THRESHOLD = float(os.getenv("TRACE_SLOW_THRESHOLD", 0))
+
+# Profiling: admin routes are disabled while ADMIN_TOKEN is unset
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+PROFILE_SUBMIT = os.getenv("PROFILE_SUBMIT", "false").lower() == "true"
+PROFILE_SAMPLE_INTERVAL = float(os.getenv("PROFILE_SAMPLE_INTERVAL", 0.005))
+PROFILE_MAX_SECONDS = float(os.getenv("PROFILE_MAX_SECONDS", 120))
+
+# Token accounting: per-session quota per TOKEN_QUOTA_WINDOW seconds (0
+# disables), prices in USD per million tokens, and the token estimates used
+# when the upstream does not report usage
+TOKEN_QUOTA_PER_USER = int(os.getenv("TOKEN_QUOTA_PER_USER", 0))
+TOKEN_QUOTA_WINDOW = float(os.getenv("TOKEN_QUOTA_WINDOW", 24 * 3600))
+MODEL_PRICE_PROMPT = float(os.getenv("MODEL_PRICE_PROMPT", 0))
+MODEL_PRICE_COMPLETION = float(os.getenv("MODEL_PRICE_COMPLETION", 0))
+ESTIMATE_IMAGE_TOKENS = int(os.getenv("ESTIMATE_IMAGE_TOKENS", 1000))
+ESTIMATE_VIDEO_TOKENS = int(os.getenv("ESTIMATE_VIDEO_TOKENS", 8000))
+
+# Multi-process serving (app_prod.py --workers N): workers listen on
+# loopback ports from WORKER_BASE_PORT (default: public port + 1) and share
+# caches through a local SQLite file
+WORKER_BASE_PORT = int(os.getenv("WORKER_BASE_PORT", 0))
+WORKER_COOKIE = "qwen_worker"
+SHARED_STATE_PATH = os.getenv(
+    "SHARED_STATE_PATH",
+    os.path.join(tempfile.gettempdir(), "qwen3-vl-shared.sqlite3"))
+# Uploads are named by content hash and their signed URLs, valid
+# MEDIA_URL_TTL seconds, are reused for MEDIA_CACHE_TTL: the same file keeps
+# the same URL that long, so the upstream's prompt cache stays valid
+MEDIA_URL_TTL = int(os.getenv("MEDIA_URL_TTL", 24 * 3600))
+MEDIA_CACHE_TTL = float(os.getenv("MEDIA_CACHE_TTL", MEDIA_URL_TTL * 5 / 6))
+
+# Local media the app created (Gradio uploads, previews, /api/chat media)
+# is reclaimed every JANITOR_INTERVAL seconds (0 disables) once no turn
+# referenced it for MEDIA_RETENTION seconds. Above MEDIA_DISK_QUOTA bytes
+# (0 for no quota) local files are evicted least recently used first. OSS
+# objects it uploaded under OSS_UPLOAD_PREFIX are reclaimed once their last
+# signed URL expired
+OSS_UPLOAD_PREFIX = "studio-temp/Qwen3-VL-Demo/"
+JANITOR_INTERVAL = float(os.getenv("JANITOR_INTERVAL", 600))
+MEDIA_RETENTION = float(os.getenv("MEDIA_RETENTION", 24 * 3600))
+MEDIA_DISK_QUOTA = int(os.getenv("MEDIA_DISK_QUOTA", 5 * 1024**3))
+
+# Explicit prompt cache breakpoints (`cache_control`) after the system prompt
+# and the earlier turns, for providers that need them (Anthropic, Gemini)
+PROMPT_CACHE_MARKERS = os.getenv("PROMPT_CACHE_MARKERS",
+                                 "false").lower() == "true"
+
+# Repeated attachments within a conversation are sent once, later exact
+# copies become a text reference. With IMAGE_DEDUP_DISTANCE >= 0 images also
+# match when their perceptual hashes differ by at most that many of 64 bits
+# and their pixels agree (-1, the default, matches exact copies only)
+ATTACHMENT_DEDUP = os.getenv("ATTACHMENT_DEDUP", "true").lower() == "true"
+IMAGE_DEDUP_DISTANCE = int(os.getenv("IMAGE_DEDUP_DISTANCE", -1))
+
+# Images in the chat view are shown as previews of at most this many pixels
+# per side, rendered once per content hash (0 shows the originals)
+MEDIA_PREVIEW_SIZE = int(os.getenv("MEDIA_PREVIEW_SIZE", 1024))
+
+# Brotli/gzip compression of text, JSON and event-stream responses; complete
+# bodies smaller than COMPRESSION_MIN_BYTES are sent as they are
+COMPRESSION_ENABLED = os.getenv("COMPRESSION_ENABLED", "true").lower() == "true"
+COMPRESSION_MIN_BYTES = int(os.getenv("COMPRESSION_MIN_BYTES", 1024))
+
+# Headless chat API (POST /api/chat): only served when CHAT_API_TOKEN holds
+# one or more comma-separated tokens, each client sends `Authorization:
+# Bearer <token>` and its quota is kept per token. Inline data: media is
+# capped per part and, with OSS configured, written to CHAT_API_MEDIA_DIR
+# for upload
+CHAT_API_TOKENS = [
+    token.strip() for token in os.getenv("CHAT_API_TOKEN", "").split(",")
+    if token.strip()
+]
+CHAT_API_MAX_MEDIA_BYTES = int(
+    os.getenv("CHAT_API_MAX_MEDIA_BYTES", 50 * 1024 * 1024))
+CHAT_API_MEDIA_DIR = os.getenv(
+    "CHAT_API_MEDIA_DIR",
+    os.path.join(tempfile.gettempdir(), "qwen3-vl-api-media"))
+
+# Logging (queue-backed, see services/log.py)
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_LIBRARY_LEVEL = os.getenv("LOG_LIBRARY_LEVEL", "WARNING").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text")  # text | json
+LOG_FILE = os.getenv("LOG_FILE")
+LOG_MAX_BYTES = int(os.getenv("LOG_MAX_BYTES", 10 * 1024 * 1024))
+LOG_BACKUP_COUNT = int(os.getenv("LOG_BACKUP_COUNT", 5))
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", 10000))
+# Response bodies are logged at DEBUG for this fraction of turns, truncated
+LOG_BODY_SAMPLE_RATE = float(os.getenv("LOG_BODY_SAMPLE_RATE", 0.01))
+LOG_BODY_MAX_CHARS = int(os.getenv("LOG_BODY_MAX_CHARS", 500))
+
 
 def get_text(text: str, cn_text: str):
     if is_cn:
@@ -40,11 +208,15 @@ save_history = True
 
 
 # Chatbot Config
+# modelscope_studio is imported by the builders only, so that importing config
+# (app_prod's proxy process, services) does not pull in gradio
 def markdown_config():
+    from modelscope_studio.components.pro.chatbot import ChatbotMarkdownConfig
     return ChatbotMarkdownConfig()
 
 
 def user_config(disabled_actions=None):
+    from modelscope_studio.components.pro.chatbot import ChatbotActionConfig, ChatbotUserConfig
     return ChatbotUserConfig(
         class_names=dict(content="user-message-content"),
         actions=[
@@ -61,6 +233,7 @@ def user_config(disabled_actions=None):
 
 
 def bot_config(disabled_actions=None):
+    from modelscope_studio.components.pro.chatbot import ChatbotActionConfig, ChatbotBotConfig
     return ChatbotBotConfig(actions=[
         "copy", "edit",
         ChatbotActionConfig(
@@ -84,6 +257,7 @@ def bot_config(disabled_actions=None):
 
 
 def welcome_config():
+    from modelscope_studio.components.pro.chatbot import ChatbotWelcomeConfig
     return ChatbotWelcomeConfig(
         variant="borderless",
         icon="./assets/qwen.png",
@@ -167,6 +341,7 @@ def welcome_config():
 
 
 def upload_config():
+    from modelscope_studio.components.pro.multimodal_input import MultimodalInputUploadConfig
     return MultimodalInputUploadConfig(
         accept="image/*,video/*",
         placeholder={
@@ -0,0 +1,95 @@
+"""
+Registry of in-flight upstream streams so that the stop button can close the
+HTTP response (and give its pooled connection back) instead of only marking
+the message as paused.
+"""
+
+import collections
+import threading
+
+from services.metrics import registry
+from services.resilience import close_stream
+from services.usage import CHARS_PER_TOKEN
+
+
+class InflightStream:
+    """Bookkeeping for one streaming completion."""
+
+    def __init__(self, key, model):
+        self.key = key
+        self.model = model
+        self.stream = None
+        self.chunks = 0
+        # Reasoning and answer characters received so far
+        self.chars = 0
+        self.cancelled = threading.Event()
+
+    def on_delta(self, text):
+        self.chunks += 1
+        self.chars += len(text)
+
+    def attach(self, stream):
+        self.stream = stream
+        # Cancelled before the first token arrived
+        if self.cancelled.is_set():
+            close_stream(stream)
+
+
+class StreamRegistry:
+
+    def __init__(self, window=100):
+        self._lock = threading.Lock()
+        self._streams = {}
+        # Length in characters of recent finished answers, per model, used
+        # to estimate how many tokens a cancellation saved
+        self._completed = collections.defaultdict(
+            lambda: collections.deque(maxlen=window))
+
+    def start(self, key, model):
+        inflight = InflightStream(key, model)
+        with self._lock:
+            self._streams[key] = inflight
+        return inflight
+
+    def finish(self, inflight, completed=False):
+        with self._lock:
+            if self._streams.get(inflight.key) is inflight:
+                del self._streams[inflight.key]
+            if completed and not inflight.cancelled.is_set():
+                self._completed[inflight.model].append(inflight.chars)
+        if inflight.stream is not None:
+            close_stream(inflight.stream)
+
+    def cancel(self, key):
+        """Close the upstream stream registered under `key`, if any."""
+        with self._lock:
+            inflight = self._streams.pop(key, None)
+            if inflight is None or inflight.cancelled.is_set():
+                return False
+            inflight.cancelled.set()
+            recent = self._completed[inflight.model]
+            expected = sum(recent) / len(recent) if recent else 0
+        CANCELLED.inc()
+        TOKENS_SAVED.inc(
+            int(max(0, expected - inflight.chars) // CHARS_PER_TOKEN))
+        if inflight.stream is not None:
+            close_stream(inflight.stream)
+        return True
+
+    def stats(self):
+        with self._lock:
+            inflight = len(self._streams)
+        return {
+            "inflight": inflight,
+            "cancelled_streams": CANCELLED.value(),
+            "tokens_saved": TOKENS_SAVED.value(),
+        }
+
+
+streams = StreamRegistry()
+
+CANCELLED = registry.counter("qwen_cancelled_streams_total",
+                             "Streams closed by the stop button")
+TOKENS_SAVED = registry.counter(
+    "qwen_cancellation_tokens_saved_total",
+    "Estimated output tokens not generated thanks to early cancellation")
@@ -0,0 +1,315 @@
+"""
+Headless chat API for programmatic clients, served next to the Gradio UI.
+
+`POST /api/chat` takes OpenAI-style messages (text, `image_url` and
+`video_url` parts with http(s) or base64 `data:` URLs) and streams the
+reasoning and answer deltas as server-sent events:
+
+    data: {"type": "reasoning", "delta": "..."}
+    data: {"type": "answer", "delta": "..."}
+    data: {"type": "done", "model": "...", "usage": {...}, "duration_s": 1.2}
+    data: [DONE]
+
+A failure after the stream started is sent as `{"type": "error"}`. With
+`"stream": false` the whole answer is returned as one JSON object.
+
+The route is only mounted when CHAT_API_TOKEN is set, and requires one of
+its tokens as a bearer token. Rate limit, fair scheduling and quota are
+keyed on that token. Turns skip the Gradio queue, session state and
+chatbot rendering but run the same `Completion` pipeline as the UI.
+Inline media is stored once per content hash before being uploaded, so
+repeated images hit the shared OSS URL cache.
+"""
+
+import asyncio
+import base64
+import binascii
+import hashlib
+import hmac
+import json
+import mimetypes
+import os
+import threading
+
+from fastapi import APIRouter, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+from starlette.concurrency import run_in_threadpool
+
+from config import (DEFAULT_SYS_PROMPT, oss_configured, CHAT_API_TOKENS,
+                    CHAT_API_MAX_MEDIA_BYTES, CHAT_API_MEDIA_DIR,
+                    PROMPT_CACHE_MARKERS)
+from services.cancellation import streams
+from services.completion import Completion
+from services.janitor import janitor
+from services.log import get_logger, new_request_id, request_logger
+from services.metrics import registry
+from services.prompt_cache import mark_cache_breakpoints
+from services.resilience import CircuitOpenError
+from services.scheduler import scheduler, RateLimited
+from services.tracing import start_trace, NOOP_SPAN
+from services.usage import ledger, QuotaExceeded
+
+logger = get_logger("chat_api")
+
+ROLES = {"system", "user", "assistant"}
+MEDIA_PARTS = ("image_url", "video_url")
+CIRCUIT_OPEN_MESSAGE = "The model service is temporarily unavailable, please try again shortly."
+# How often a non-streaming request checks that its client is still there
+DISCONNECT_POLL_INTERVAL = 0.5
+
+
+def save_data_url(mime_type, payload):
+    """Write base64 media under its content hash, return the file path."""
+    try:
+        data = base64.b64decode(payload, validate=True)
+    except binascii.Error:
+        raise ValueError("invalid base64 in data: URL")
+    extension = mimetypes.guess_extension(mime_type) or ""
+    os.makedirs(CHAT_API_MEDIA_DIR, exist_ok=True)
+    path = os.path.join(CHAT_API_MEDIA_DIR,
+                        hashlib.sha256(data).hexdigest() + extension)
+    if not os.path.exists(path):
+        # Same content, same path and mtime: the media cache key is stable
+        temp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(temp_path, "wb") as file:
+            file.write(data)
+        os.replace(temp_path, path)
+    else:
+        janitor.touch(path, os.stat(path))
+    return path
+
+
+def token_identity(authorization):
+    """
+    Identity of the API token in an `Authorization: Bearer` header, which
+    fairness, rate limit and quota are keyed on; None when it is not valid.
+    """
+    scheme, _, token = (authorization or "").partition(" ")
+    if scheme.lower() != "bearer" or not token:
+        return None
+    for allowed in CHAT_API_TOKENS:
+        if hmac.compare_digest(token.encode(), allowed.encode()):
+            return "api:" + hashlib.sha256(allowed.encode()).hexdigest()[:12]
+    return None
+
+
+class ChatAPI:
+    """
+    `get_client`, `select_model` and `media_url(file_path, span)` come from
+    the UI module, so both paths build identical upstream requests.
+    """
+
+    def __init__(self, get_client, select_model, media_url,
+                 upstream_headers=None):
+        self.get_client = get_client
+        self.select_model = select_model
+        self.media_url = media_url
+        self.upstream_headers = upstream_headers or {}
+
+    def _media(self, url, span):
+        if url.startswith(("http://", "https://")):
+            return url
+        header, _, payload = url.partition(",")
+        if not header.startswith("data:") or not header.endswith(";base64"):
+            raise ValueError("media URLs must be http(s) or base64 data: URLs")
+        if len(payload) * 3 // 4 > CHAT_API_MAX_MEDIA_BYTES:
+            raise ValueError(
+                f"inline media larger than {CHAT_API_MAX_MEDIA_BYTES} bytes")
+        if not oss_configured:
+            # Would be sent inline anyway
+            return url
+        return self.media_url(save_data_url(header[5:-7], payload), span)
+
+    def prepare(self, messages, span=NOOP_SPAN):
+        """
+        Validate client messages and resolve their media, returns the
+        upstream messages and the scheduler class of the last user turn.
+        """
+        if not isinstance(messages, list) or not messages:
+            raise ValueError("messages must be a non-empty list")
+        prepared = []
+        turn_class = "text"
+        for message in messages:
+            role = message.get("role") if isinstance(message, dict) else None
+            if role not in ROLES:
+                raise ValueError(f"unsupported message role {role!r}")
+            content = message.get("content")
+            if isinstance(content, str):
+                prepared.append({"role": role, "content": content})
+                if role == "user":
+                    turn_class = "text"
+                continue
+            if not isinstance(content, list):
+                raise ValueError("content must be a string or a list of parts")
+            parts = []
+            kinds = set()
+            for part in content:
+                kind = part.get("type") if isinstance(part, dict) else None
+                if kind == "text":
+                    parts.append({"type": "text", "text": str(part.get("text", ""))})
+                elif kind in MEDIA_PARTS:
+                    url = (part.get(kind) or {}).get("url")
+                    if not isinstance(url, str):
+                        raise ValueError(f"{kind} part without a url")
+                    parts.append({"type": kind, kind: {"url": self._media(url, span)}})
+                    kinds.add(kind)
+                else:
+                    raise ValueError(f"unsupported content part {kind!r}")
+            prepared.append({"role": role, "content": parts})
+            if role == "user":
+                turn_class = "video" if "video_url" in kinds else \
+                    "image" if kinds else "text"
+        if prepared[0]["role"] != "system":
+            prepared.insert(0, {"role": "system", "content": DEFAULT_SYS_PROMPT})
+        if PROMPT_CACHE_MARKERS:
+            prepared = mark_cache_breakpoints(prepared)
+        return prepared, turn_class
+
+    def run_turn(self, completion, trace, emit):
+        """Stream one turn upstream, calling `emit(event)` for each event."""
+        trace.root.set(model=completion.model,
+                       turn_class=completion.turn_class)
+        error = None
+        try:
+            for reasoning, answer in completion:
+                if reasoning:
+                    emit({"type": "reasoning", "delta": reasoning})
+                if answer:
+                    emit({"type": "answer", "delta": answer})
+        except Exception as e:
+            error = e
+            emit({
+                "type": "error",
+                "error": CIRCUIT_OPEN_MESSAGE
+                if isinstance(e, CircuitOpenError) else str(e)
+            })
+        finally:
+            if completion.completed:
+                emit({
+                    "type": "done",
+                    "model": completion.model,
+                    "usage": completion.usage._asdict(),
+                    "duration_s": round(completion.duration, 3),
+                })
+            API_REQUESTS.inc(outcome="success" if completion.completed else
+                             "error" if error else "cancelled")
+            trace.finish(error)
+            emit(None)
+
+    def router(self):
+        router = APIRouter()
+        if not CHAT_API_TOKENS:
+            # Not mounted without a token, it would be open to anyone
+            return router
+
+        @router.post("/api/chat")
+        async def chat(request: Request):
+            """OpenAI-style messages in, reasoning/answer deltas out (SSE)."""
+            session_id = token_identity(request.headers.get("authorization"))
+            if session_id is None:
+                return JSONResponse({"error": "unauthorized"}, status_code=401)
+            try:
+                body = await request.json()
+            except ValueError:
+                body = None
+            if not isinstance(body, dict):
+                API_REQUESTS.inc(outcome="invalid")
+                return JSONResponse({"error": "expected a JSON object"},
+                                    status_code=400)
+
+            request_id = new_request_id()
+            conversation_id = request.headers.get(
+                "x-conversation-id") or request_id
+            try:
+                scheduler.check_rate(session_id)
+                ledger.check_quota(session_id)
+            except (RateLimited, QuotaExceeded) as e:
+                API_REQUESTS.inc(outcome="rejected")
+                return JSONResponse(
+                    {"error": str(e)},
+                    status_code=429,
+                    headers={"Retry-After": str(max(1, round(e.retry_in)))})
+            client = self.get_client()
+            if client is None:
+                return JSONResponse({"error": "API not configured"},
+                                    status_code=503)
+
+            model = self.select_model(bool(body.get("thinking")))
+            log = request_logger(logger, request_id)
+            trace = start_trace("api_chat",
+                                request_id=request_id,
+                                session_id=session_id)
+            try:
+                with trace.root.child("prepare_messages") as span:
+                    messages, turn_class = await run_in_threadpool(
+                        self.prepare, body.get("messages"), span)
+            except ValueError as e:
+                trace.finish(e)
+                API_REQUESTS.inc(outcome="invalid")
+                return JSONResponse({"error": str(e)}, status_code=400)
+
+            loop = asyncio.get_running_loop()
+            events = asyncio.Queue()
+
+            def emit(event):
+                try:
+                    loop.call_soon_threadsafe(events.put_nowait, event)
+                except RuntimeError:
+                    # Loop closed by a shutdown mid-stream
+                    pass
+
+            inflight = streams.start(f"api:{request_id}", model)
+            completion = Completion(client, model, messages, session_id,
+                                    conversation_id, turn_class, inflight,
+                                    trace.root, log, self.upstream_headers)
+            threading.Thread(target=self.run_turn,
+                             args=(completion, trace, emit),
+                             name=f"api-chat-{request_id}",
+                             daemon=True).start()
+
+            if not body.get("stream", True):
+
+                async def cancel_on_disconnect():
+                    while not await request.is_disconnected():
+                        await asyncio.sleep(DISCONNECT_POLL_INTERVAL)
+                    streams.cancel(inflight.key)
+
+                watcher = asyncio.create_task(cancel_on_disconnect())
+                result = {"reasoning": "", "answer": ""}
+                try:
+                    while (event := await events.get()) is not None:
+                        if event["type"] in ("reasoning", "answer"):
+                            result[event["type"]] += event["delta"]
+                        else:
+                            result.update(event)
+                finally:
+                    watcher.cancel()
+                result.pop("type", None)
+                status_code = 502 if "error" in result else 200
+                return JSONResponse(result,
+                                    status_code=status_code,
+                                    headers={"X-Request-Id": request_id})
+
+            async def sse():
+                try:
+                    while (event := await events.get()) is not None:
+                        yield f"data: {json.dumps(event, ensure_ascii=False)}\n\n"
+                    yield "data: [DONE]\n\n"
+                finally:
+                    # No-op once finished, else the client disconnected
+                    streams.cancel(inflight.key)
+
+            return StreamingResponse(sse(),
+                                     media_type="text/event-stream",
+                                     headers={
+                                         "Cache-Control": "no-cache",
+                                         "X-Accel-Buffering": "no",
+                                         "X-Request-Id": request_id,
+                                     })
+
+        return router
+
+
+API_REQUESTS = registry.counter("qwen_api_requests_total",
+                                "Headless chat API requests by outcome",
+                                ("outcome",))
@@ -0,0 +1,169 @@
+"""
+The generation pipeline shared by the chat UI, `/api/chat` and batch.py.
+
+A turn waits for a fair scheduler slot, then for an adaptive limiter slot,
+opens the upstream stream through the breaker, retries and hedging, and is
+timed, traced, optionally recorded and accounted in the usage ledger. The
+callers only turn the deltas into chatbot updates, SSE events or a result
+record.
+"""
+
+import logging
+import time
+
+from config import base_url, RECORD_STREAMS_DIR
+from services.cancellation import streams
+from services.limiter import get_limiter
+from services.log import get_logger, sample_body, truncate
+from services.metrics import StreamTimer
+from services.resilience import resilient_stream, StreamCancelled
+from services.scheduler import scheduler
+from services.stream_recorder import record_stream
+from services.tracing import NOOP_SPAN
+from services.usage import ledger, usage_from_stream
+
+logger = get_logger("completion")
+
+
+class Completion:
+    """
+    One streamed completion of `messages`, from the scheduler queue to the
+    usage ledger. Iterating it yields the `(reasoning, answer)` delta of
+    every chunk, with the text so far in `reasoning` and `answer`; it stops
+    early, without error, once `inflight` is cancelled.
+    """
+
+    def __init__(self, client, model, messages, session_id, conversation_id,
+                 turn_class, inflight, span=NOOP_SPAN, log=logger,
+                 headers=None):
+        self.client = client
+        self.model = model
+        self.messages = messages
+        self.session_id = session_id
+        self.conversation_id = conversation_id
+        self.turn_class = turn_class
+        self.inflight = inflight
+        self.span = span
+        self.log = log
+        self.headers = headers or {}
+        self.reasoning = ""
+        self.answer = ""
+        self.started_at = None
+        self.ttft = None
+        self.thought_seconds = None
+        self.duration = None
+        self.usage = None
+        self.completed = False
+
+    def __iter__(self):
+        inflight = self.inflight
+        span = self.span
+        limiter = get_limiter(base_url)
+        turn_scheduled = False
+        slot_acquired = False
+        timer = None
+        streamed = False
+        reported_usage = None
+        try:
+            with span.child("scheduler_wait", turn_class=self.turn_class):
+                scheduler.acquire(self.session_id,
+                                  self.turn_class,
+                                  cancelled=inflight.cancelled)
+            turn_scheduled = True
+            with span.child("limiter_wait"):
+                limiter.acquire(cancelled=inflight.cancelled)
+            slot_acquired = True
+            self.started_at = time.time()
+            timer = StreamTimer(self.model, base_url)
+            ttft_span = span.child("upstream_ttft", upstream=base_url)
+            stream_span = None
+            stream, response = resilient_stream(
+                lambda: self.client.chat.completions.create(
+                    model=self.model,
+                    messages=self.messages,
+                    stream=True,
+                    stream_options={"include_usage": True},
+                    extra_headers=self.headers),
+                upstream=base_url,
+                cancelled=inflight.cancelled,
+                on_error=limiter.on_error,
+                on_success=limiter.on_success)
+            streamed = True
+            inflight.attach(stream)
+            if RECORD_STREAMS_DIR:
+                response = record_stream(response, self.model,
+                                         RECORD_STREAMS_DIR, timer.started_at)
+            for chunk in response:
+                if inflight.cancelled.is_set():
+                    # The stop button already closed the stream
+                    return
+                if stream_span is None:
+                    self.ttft = time.time() - self.started_at
+                    ttft_span.end()
+                    stream_span = span.child("stream")
+                if getattr(chunk, "usage", None):
+                    # Final chunk of include_usage, it carries no choices
+                    reported_usage = chunk.usage
+                if not chunk or not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta
+                reasoning = getattr(delta, "reasoning_content", None)
+                if not delta.content and not reasoning:
+                    continue
+                inflight.on_delta((reasoning or "") + (delta.content or ""))
+                timer.on_chunk(reasoning=bool(reasoning),
+                               answer=bool(delta.content))
+                if reasoning:
+                    self.reasoning += reasoning
+                if delta.content:
+                    if not self.answer:
+                        self.thought_seconds = time.time() - self.started_at
+                    self.answer += delta.content
+                yield reasoning, delta.content
+            self.completed = True
+            self.duration = time.time() - self.started_at
+            timer.finish("success",
+                         completion_tokens=getattr(reported_usage,
+                                                   "completion_tokens", None))
+            if stream_span:
+                stream_span.set(chunks=inflight.chunks).end()
+            self.log.info("Stream completed",
+                          extra={
+                              "model": self.model,
+                              "chunks": inflight.chunks,
+                              "duration_s": round(self.duration, 3),
+                              "reasoning_chars": len(self.reasoning),
+                              "answer_chars": len(self.answer),
+                          })
+            if self.log.isEnabledFor(logging.DEBUG) and sample_body():
+                self.log.debug("Response body",
+                               extra={
+                                   "reasoning": truncate(self.reasoning),
+                                   "answer": truncate(self.answer),
+                               })
+        except StreamCancelled:
+            return
+        except Exception as e:
+            if inflight.cancelled.is_set():
+                # Reading from a stream closed by cancel() raises
+                return
+            self.log.error("Stream failed",
+                           extra={
+                               "model": self.model,
+                               "error": truncate(str(e))
+                           })
+            raise
+        finally:
+            if timer and not self.completed:
+                timer.finish("cancelled"
+                             if inflight.cancelled.is_set() else "error")
+            if slot_acquired:
+                limiter.release()
+            if turn_scheduled:
+                scheduler.release()
+            if streamed:
+                self.usage = usage_from_stream(reported_usage, self.messages,
+                                               self.reasoning, self.answer)
+                ledger.record(self.session_id, self.conversation_id,
+                              self.model, self.usage)
+            streams.finish(inflight, completed=self.completed)
@@ -0,0 +1,343 @@
+"""
+Response compression and static asset caching.
+
+`CompressionMiddleware` compresses HTML, JS, CSS, JSON and event-stream
+responses with brotli when the client accepts it, else gzip. Complete
+bodies below COMPRESSION_MIN_BYTES are sent as they are. Event streams
+(Gradio's queue, /api/chat) are flushed after every event so compression
+never delays a token. Fingerprinted assets are compressed once at the
+highest level and kept in memory.
+
+`AssetCacheMiddleware` marks as immutable Gradio's build assets, whose file
+names carry a content hash (`index-D88pgWqG.js`), and the routes registered
+in `versioned_assets` when requested with their current `?v=<hash>`.
+
+Bytes before and after compression are counted per encoding and content
+kind, so `qwen_compression_output_bytes_total / qwen_compression_input_bytes_total`
+is the compression ratio.
+"""
+
+import collections
+import hashlib
+import re
+import threading
+import zlib
+from urllib.parse import parse_qs
+
+import anyio.to_thread
+from starlette.datastructures import Headers, MutableHeaders
+
+from config import COMPRESSION_MIN_BYTES
+from services.metrics import registry
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+CONTENT_KINDS = {
+    "text/html": "html",
+    "application/javascript": "js",
+    "text/javascript": "js",
+    "text/css": "css",
+    "application/json": "json",
+    "application/manifest+json": "json",
+    "text/event-stream": "sse",
+    "text/plain": "text",
+    "image/svg+xml": "svg",
+}
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 4
+# Immutable assets are compressed once, as small as possible
+STATIC_GZIP_LEVEL = 9
+STATIC_BROTLI_QUALITY = 11
+# Whole bodies of a known length up to this size are compressed at once
+MAX_BUFFERED_BYTES = 8 * 1024 * 1024
+# Larger bodies are compressed in a worker thread, off the event loop
+THREAD_MIN_BYTES = 128 * 1024
+MAX_CACHED_ASSETS = 256
+
+IMMUTABLE = "public, max-age=31536000, immutable"
+# Vite build output: name-<8 character hash>.ext
+FINGERPRINTED_ASSET = re.compile(
+    r"^/assets/.+-(?=[\w-]*[A-Z0-9])[\w-]{8}\.[a-z0-9]+$")
+
+
+class VersionedAssets:
+    """
+    Routes linked with a `?v=<content hash>` query. A request for the
+    current version is immutable, a stale or missing one keeps the route's
+    own caching.
+    """
+
+    def __init__(self):
+        self._versions = {}
+
+    def register(self, path, version):
+        """Serve `path` as `version` from now on, return its versioned URL."""
+        self._versions[path] = version
+        return f"{path}?v={version}"
+
+    def add_file(self, path, file_path):
+        """Register `path` serving `file_path`, versioned by its content."""
+        with open(file_path, "rb") as file:
+            version = hashlib.sha256(file.read()).hexdigest()[:16]
+        return self.register(path, version)
+
+    def is_current(self, path, query_string):
+        version = self._versions.get(path)
+        return version is not None and \
+            parse_qs(query_string.decode("latin-1")).get("v") == [version]
+
+
+versioned_assets = VersionedAssets()
+
+
+def negotiate(accept_encoding):
+    """Preferred encoding among those accepted by the client, or None."""
+    accepted = {}
+    for item in accept_encoding.lower().split(","):
+        name, _, params = item.strip().partition(";")
+        quality = 1.0
+        if params.strip().startswith("q="):
+            try:
+                quality = float(params.strip()[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[name.strip()] = quality
+    for encoding in ("br", "gzip"):
+        if encoding == "br" and brotli is None:
+            continue
+        if accepted.get(encoding, accepted.get("*", 0)) > 0:
+            return encoding
+    return None
+
+
+def compress(body, encoding, static=False):
+    if encoding == "br":
+        return brotli.compress(
+            body, quality=STATIC_BROTLI_QUALITY if static else BROTLI_QUALITY)
+    compressor = zlib.compressobj(STATIC_GZIP_LEVEL if static else GZIP_LEVEL,
+                                  zlib.DEFLATED, 31)
+    return compressor.compress(body) + compressor.flush()
+
+
+class _StreamCompressor:
+
+    def __init__(self, encoding):
+        if encoding == "br":
+            self._brotli = brotli.Compressor(quality=BROTLI_QUALITY)
+        else:
+            self._brotli = None
+            self._gzip = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+
+    def compress(self, data, flush=False):
+        if self._brotli is not None:
+            output = self._brotli.process(data)
+            return output + self._brotli.flush() if flush else output
+        output = self._gzip.compress(data)
+        return output + self._gzip.flush(zlib.Z_SYNC_FLUSH) if flush else output
+
+    def finish(self):
+        if self._brotli is not None:
+            return self._brotli.finish()
+        return self._gzip.flush(zlib.Z_FINISH)
+
+
+class _AssetCache:
+    """Compressed bodies of immutable assets, by path, ETag and encoding."""
+
+    def __init__(self, size=MAX_CACHED_ASSETS):
+        self.size = size
+        self._items = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            body = self._items.get(key)
+            if body is not None:
+                self._items.move_to_end(key)
+            return body
+
+    def set(self, key, body):
+        with self._lock:
+            self._items[key] = body
+            while len(self._items) > self.size:
+                self._items.popitem(last=False)
+
+
+_assets = _AssetCache()
+
+
+class _Responder:
+    """Compresses one response on its way to `send`."""
+
+    def __init__(self, send, encoding, minimum_size, path):
+        self.send = send
+        self.encoding = encoding
+        self.minimum_size = minimum_size
+        self.path = path
+        self.start = None
+        self.mode = None
+        self.kind = None
+        self.buffer = []
+        self.compressor = None
+
+    def _compressible(self, message):
+        headers = Headers(raw=message["headers"])
+        self.kind = CONTENT_KINDS.get(
+            headers.get("content-type", "").split(";")[0].strip().lower())
+        return (self.kind is not None and
+                message["status"] not in (204, 206, 304) and
+                "content-encoding" not in headers and
+                "no-transform" not in headers.get("cache-control", ""))
+
+    def _set_encoding_headers(self, length=None):
+        headers = MutableHeaders(raw=self.start["headers"])
+        headers["Content-Encoding"] = self.encoding
+        headers.add_vary_header("Accept-Encoding")
+        if length is None:
+            del headers["Content-Length"]
+        else:
+            headers["Content-Length"] = str(length)
+
+    async def _send_whole(self, body):
+        if len(body) < self.minimum_size:
+            await self.send(self.start)
+            await self.send({"type": "http.response.body", "body": body})
+            return
+        headers = Headers(raw=self.start["headers"])
+        static = headers.get("cache-control", "").endswith("immutable")
+        key = (self.path, headers.get("etag"), self.encoding)
+        compressed = _assets.get(key) if static else None
+        if compressed is None:
+            if len(body) >= THREAD_MIN_BYTES or static:
+                compressed = await anyio.to_thread.run_sync(
+                    compress, body, self.encoding, static)
+            else:
+                compressed = compress(body, self.encoding)
+            if static:
+                _assets.set(key, compressed)
+        _record(self.encoding, self.kind, len(body), len(compressed))
+        self._set_encoding_headers(len(compressed))
+        await self.send(self.start)
+        await self.send({"type": "http.response.body", "body": compressed})
+
+    async def __call__(self, message):
+        if message["type"] == "http.response.start":
+            message = {**message, "headers": list(message.get("headers", []))}
+            if self._compressible(message):
+                self.start = message
+                self.mode = "pending"
+            else:
+                self.mode = "identity"
+                await self.send(message)
+            return
+        if message["type"] != "http.response.body" or self.mode == "identity":
+            await self.send(message)
+            return
+
+        body = message.get("body", b"")
+        more_body = message.get("more_body", False)
+        if self.mode == "pending":
+            length = Headers(raw=self.start["headers"]).get("content-length")
+            if not more_body:
+                self.mode = "identity"
+                await self._send_whole(body)
+                return
+            if self.kind != "sse" and length and \
+                    int(length) <= MAX_BUFFERED_BYTES:
+                self.mode = "buffer"
+            else:
+                self.mode = "stream"
+                self.compressor = _StreamCompressor(self.encoding)
+                self._set_encoding_headers()
+                await self.send(self.start)
+
+        if self.mode == "buffer":
+            self.buffer.append(body)
+            if not more_body:
+                self.mode = "identity"
+                await self._send_whole(b"".join(self.buffer))
+            return
+
+        # Every event of a stream reaches the client as soon as it is sent
+        output = self.compressor.compress(body, flush=self.kind == "sse")
+        if not more_body:
+            output += self.compressor.finish()
+        _record(self.encoding, self.kind, len(body), len(output))
+        await self.send({
+            "type": "http.response.body",
+            "body": output,
+            "more_body": more_body
+        })
+
+
+class CompressionMiddleware:
+
+    def __init__(self, app, minimum_size=COMPRESSION_MIN_BYTES):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] == "HEAD":
+            await self.app(scope, receive, send)
+            return
+        encoding = negotiate(
+            Headers(scope=scope).get("accept-encoding", ""))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+        # Gradio compresses its own files at a low level, chunk by chunk;
+        # leaving encoding to this middleware lets assets be cached compressed
+        scope = {
+            **scope, "headers": [(name, value)
+                                 for name, value in scope["headers"]
+                                 if name != b"accept-encoding"]
+        }
+        await self.app(
+            scope, receive,
+            _Responder(send, encoding, self.minimum_size, scope["path"]))
+
+
+class AssetCacheMiddleware:
+    """Long-lived caching of content-hashed and versioned assets."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        path = scope.get("path", "")
+        if scope["type"] != "http" or scope["method"] not in ("GET", "HEAD"):
+            await self.app(scope, receive, send)
+            return
+        if FINGERPRINTED_ASSET.match(path) or versioned_assets.is_current(
+                path, scope.get("query_string", b"")):
+            cache_control = IMMUTABLE
+        elif path == "/favicon.ico":
+            cache_control = "public, max-age=86400"
+        else:
+            await self.app(scope, receive, send)
+            return
+
+        async def send_with_cache_control(message):
+            if message["type"] == "http.response.start" and \
+                    message["status"] == 200:
+                MutableHeaders(raw=message["headers"])["Cache-Control"] = \
+                    cache_control
+            await send(message)
+
+        await self.app(scope, receive, send_with_cache_control)
+
+
+def _record(encoding, kind, input_bytes, output_bytes):
+    INPUT_BYTES.inc(input_bytes, encoding=encoding, kind=kind)
+    OUTPUT_BYTES.inc(output_bytes, encoding=encoding, kind=kind)
+
+
+INPUT_BYTES = registry.counter("qwen_compression_input_bytes_total",
+                               "Response bytes before compression",
+                               ("encoding", "kind"))
+OUTPUT_BYTES = registry.counter("qwen_compression_output_bytes_total",
+                                "Response bytes after compression",
+                                ("encoding", "kind"))
@@ -0,0 +1,157 @@
+"""
+Repeated attachments within a conversation.
+
+Users re-upload the same screenshot across turns, and `format_history`
+resends the whole conversation on every turn. Each local attachment is
+fingerprinted by its SHA-256; the first copy is sent, later exact copies
+are replaced by a short text reference to it, without being uploaded or
+encoded again. Keeping the first copy leaves earlier messages unchanged as
+the conversation grows.
+
+With IMAGE_DEDUP_DISTANCE >= 0, images whose 64-bit difference hashes
+(dHash) are that close are candidates too. A 9x8 hash cannot tell two
+screenshots that differ in a few characters apart, so a candidate is only a
+copy when its pixels, scaled to the first copy's size, all stay within
+PIXEL_TOLERANCE of it.
+
+Fingerprints are cached per path, size and mtime, so a file is read once.
+"""
+
+import collections
+import threading
+
+from config import IMAGE_DEDUP_DISTANCE
+from services.log import get_logger
+from services.media import file_digest
+from services.metrics import registry
+from services.tracing import NOOP_SPAN
+
+logger = get_logger("dedup")
+
+MAX_CACHED_FINGERPRINTS = 4096
+# Largest per-channel difference of a pixel in a perceptual copy
+PIXEL_TOLERANCE = 48
+
+
+class Fingerprint(
+        collections.namedtuple("Fingerprint", "digest phash size path")):
+
+    def matches(self, other, distance):
+        if self.digest == other.digest:
+            return True
+        if distance < 0 or self.phash is None or other.phash is None:
+            return False
+        return (self.phash ^ other.phash).bit_count() <= distance and \
+            same_pixels(other.path, self.path)
+
+
+def same_pixels(first_path, path):
+    """Whether the image at `path`, scaled to the first one, looks the same."""
+    from PIL import Image, ImageChops
+    try:
+        with Image.open(first_path) as first, Image.open(path) as image:
+            first = first.convert("RGB")
+            image = image.convert("RGB")
+            if image.size != first.size:
+                image = image.resize(first.size, Image.Resampling.LANCZOS)
+            extrema = ImageChops.difference(first, image).getextrema()
+    except Exception as e:
+        logger.debug("Could not compare %s with %s: %s", path, first_path, e)
+        return False
+    return all(high <= PIXEL_TOLERANCE for _, high in extrema)
+
+
+def dhash(file_path):
+    """64-bit difference hash of an image, None when it cannot be decoded."""
+    from PIL import Image
+    try:
+        with Image.open(file_path) as image:
+            small = image.convert("L").resize((9, 8),
+                                              Image.Resampling.LANCZOS)
+    except Exception as e:
+        logger.debug("No perceptual hash for %s: %s", file_path, e)
+        return None
+    pixels = small.tobytes()
+    bits = 0
+    for row in range(8):
+        for column in range(8):
+            left = pixels[row * 9 + column]
+            bits = bits << 1 | (left > pixels[row * 9 + column + 1])
+    return bits
+
+
+_cache = collections.OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def fingerprint(file_path, stat, image=True):
+    """SHA-256 of a file, plus its dHash when `image` is set."""
+    key = (file_path, stat.st_size, stat.st_mtime_ns, image)
+    with _cache_lock:
+        cached = _cache.get(key)
+        if cached is not None:
+            _cache.move_to_end(key)
+            return cached
+    result = Fingerprint(file_digest(file_path, stat),
+                         dhash(file_path) if image else None, stat.st_size,
+                         file_path)
+    with _cache_lock:
+        _cache[key] = result
+        while len(_cache) > MAX_CACHED_FINGERPRINTS:
+            _cache.popitem(last=False)
+    return result
+
+
+class AttachmentDeduplicator:
+    """Attachments already sent in one request, in the order they appear."""
+
+    def __init__(self, distance=IMAGE_DEDUP_DISTANCE):
+        self.distance = distance
+        self._sent = {"image": [], "video": []}
+        self.parts_saved = 0
+        self.bytes_saved = 0
+
+    def _check(self, kind, fingerprint):
+        for number, sent in enumerate(self._sent[kind], 1):
+            if fingerprint.matches(sent, self.distance):
+                self.parts_saved += 1
+                self.bytes_saved += fingerprint.size
+                DEDUP_PARTS.inc(kind=kind)
+                DEDUP_BYTES.inc(fingerprint.size, kind=kind)
+                return f"[Same {kind} as {kind} #{number} above]"
+        self._sent[kind].append(fingerprint)
+        return None
+
+    def check_file(self, file_path, stat, kind):
+        """
+        Reference text replacing `file_path` when it repeats an attachment
+        already sent, else None and the file counts as sent.
+        """
+        # The perceptual hash decodes the whole image, only when used
+        return self._check(
+            kind,
+            fingerprint(file_path, stat,
+                        image=kind == "image" and self.distance >= 0))
+
+    def check_url(self, url, kind):
+        return self._check(kind, Fingerprint(url, None, 0, None))
+
+    def report(self, span=NOOP_SPAN):
+        if not self.parts_saved:
+            return
+        span.set(dedup_parts=self.parts_saved, dedup_bytes=self.bytes_saved)
+        logger.info("Repeated attachments sent as references",
+                    extra={
+                        "parts_saved": self.parts_saved,
+                        "bytes_saved": self.bytes_saved,
+                    })
+
+
+DEDUP_PARTS = registry.counter(
+    "qwen_dedup_parts_total",
+    "Repeated attachments replaced by a reference to an earlier copy",
+    ("kind",))
+DEDUP_BYTES = registry.counter(
+    "qwen_dedup_bytes_total",
+    "Attachment bytes not uploaded or encoded thanks to deduplication",
+    ("kind",))
@@ -0,0 +1,146 @@
+"""
+Concurrent connectivity diagnostics.
+
+All HTTP, DNS and TCP port probes run in parallel under one overall deadline
+and report structured per-probe results with their latency. Used at startup
+by `app_prod --test-connectivity`, by `app.test_network_connectivity()` and
+by the `/network-test` route. Targets are plain arguments, so a run can be
+pointed at local stand-in servers.
+"""
+
+import concurrent.futures
+import socket
+import time
+from datetime import datetime
+
+import requests
+
+from config import DIAGNOSTICS_DEADLINE, DIAGNOSTICS_PROBE_TIMEOUT
+
+HTTP_SERVICES = {
+    'openrouter_api': 'https://openrouter.ai/api/v1/models',
+    'github_api': 'https://api.github.com',
+    'huggingface_api': 'https://huggingface.co/api/models',
+    'cloudflare_dns': 'https://1.1.1.1/dns-query',
+    'google_dns': 'https://8.8.8.8/resolve',
+    'oss_endpoint': 'https://oss-cn-hangzhou.aliyuncs.com',
+    'cdnjs': 'https://cdnjs.cloudflare.com/ajax/libs/axios/1.6.7/axios.min.js'
+}
+DNS_HOSTS = ['openrouter.ai', 'api.github.com', 'huggingface.co']
+LOCAL_PORTS = [80, 443, 8080, 3000, 7860, 9000]
+
+
+def _elapsed_ms(started):
+    return round((time.monotonic() - started) * 1000, 1)
+
+
+def probe_http(url, timeout):
+    started = time.monotonic()
+    try:
+        # No retries here: a diagnostic must report the first failure fast
+        response = requests.get(url, timeout=timeout, stream=True)
+        response.close()
+        return {
+            'status': 'OK',
+            'status_code': response.status_code,
+            'latency_ms': _elapsed_ms(started),
+            'url': url
+        }
+    except Exception as e:
+        return {
+            'status': 'FAILED',
+            'error': str(e),
+            'latency_ms': _elapsed_ms(started),
+            'url': url
+        }
+
+
+def probe_dns(host, timeout=None):
+    started = time.monotonic()
+    try:
+        addresses = sorted({
+            info[4][0]
+            for info in socket.getaddrinfo(host, None, proto=socket.IPPROTO_TCP)
+        })
+        return {
+            'status': 'OK',
+            'addresses': addresses,
+            'latency_ms': _elapsed_ms(started)
+        }
+    except Exception as e:
+        return {
+            'status': 'FAILED',
+            'error': str(e),
+            'latency_ms': _elapsed_ms(started)
+        }
+
+
+def probe_port(port, timeout, host='127.0.0.1'):
+    started = time.monotonic()
+    try:
+        with socket.create_connection((host, port), timeout=timeout):
+            status = 'OPEN'
+    except (ConnectionRefusedError, socket.timeout):
+        status = 'CLOSED'
+    except Exception as e:
+        return {
+            'status': 'ERROR',
+            'error': str(e),
+            'latency_ms': _elapsed_ms(started)
+        }
+    return {'status': status, 'latency_ms': _elapsed_ms(started)}
+
+
+def run_diagnostics(http_services=None, dns_hosts=None, ports=None,
+                    deadline=DIAGNOSTICS_DEADLINE,
+                    probe_timeout=DIAGNOSTICS_PROBE_TIMEOUT):
+    """
+    Run every probe concurrently and return the results grouped by kind.
+    Probes still running at the deadline are reported as TIMEOUT.
+    """
+    http_services = HTTP_SERVICES if http_services is None else http_services
+    dns_hosts = DNS_HOSTS if dns_hosts is None else dns_hosts
+    ports = LOCAL_PORTS if ports is None else ports
+
+    started = time.monotonic()
+    results = {
+        'timestamp': datetime.now().isoformat(),
+        'external_services': {},
+        'dns_resolution': {},
+        'port_connectivity': {}
+    }
+    probes = [('external_services', name, probe_http, url)
+              for name, url in http_services.items()]
+    probes += [('dns_resolution', host, probe_dns, host) for host in dns_hosts]
+    probes += [('port_connectivity', port, probe_port, port)
+               for port in ports]
+    if not probes:
+        results['status'] = 'OK'
+        results['duration_ms'] = 0.0
+        return results
+
+    executor = concurrent.futures.ThreadPoolExecutor(
+        max_workers=len(probes), thread_name_prefix='diagnostics')
+    futures = {
+        executor.submit(probe, target, probe_timeout): (group, key)
+        for group, key, probe, target in probes
+    }
+    done, _ = concurrent.futures.wait(futures, timeout=deadline)
+    # Stragglers (e.g. a DNS lookup ignoring timeouts) are abandoned
+    executor.shutdown(wait=False, cancel_futures=True)
+
+    for future, (group, key) in futures.items():
+        if future in done:
+            results[group][key] = future.result()
+        else:
+            results[group][key] = {
+                'status': 'TIMEOUT',
+                'latency_ms': round(deadline * 1000, 1)
+            }
+
+    external = list(results['external_services'].values()) + list(
+        results['dns_resolution'].values())
+    results['status'] = 'OK' if all(
+        result['status'] == 'OK' for result in external) else 'DEGRADED'
+    results['duration_ms'] = _elapsed_ms(started)
+    return results
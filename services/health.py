@@ -0,0 +1,122 @@
+"""
+Cached health state for the liveness/readiness routes.
+
+A daemon thread probes the upstream every `HEALTH_PROBE_INTERVAL` seconds and
+publishes an immutable snapshot; request handlers only read the latest
+snapshot, so `/health` and `/api/status` never touch the network.
+"""
+
+import threading
+import time
+from datetime import datetime
+
+import requests
+
+from config import (base_url, api_key, oss_configured, HEALTH_PROBE_INTERVAL,
+                    HEALTH_PROBE_TIMEOUT, HEALTH_REQUIRE_UPSTREAM)
+from services.resilience import get_breaker
+from services.log import get_logger
+
+SERVICE = "Qwen3-VL Demo"
+VERSION = "1.0.0"
+
+logger = get_logger("health")
+
+
+class HealthProber:
+
+    def __init__(self, interval=HEALTH_PROBE_INTERVAL,
+                 timeout=HEALTH_PROBE_TIMEOUT,
+                 require_upstream=HEALTH_REQUIRE_UPSTREAM):
+        self.interval = interval
+        self.timeout = timeout
+        self.require_upstream = require_upstream
+        self.started_at = time.time()
+        self._session = requests.Session()
+        self._stop = threading.Event()
+        self._thread = None
+        self._snapshot = {
+            "status": "starting",
+            "ready": False,
+            "checks": {},
+            "checked_at": None,
+        }
+
+    @property
+    def snapshot(self):
+        # Replaced atomically by the prober thread, safe to read without a lock
+        return self._snapshot
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run,
+                                        name="health-prober",
+                                        daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.refresh()
+            except Exception as e:
+                logger.warning("Health probe failed: %s", e)
+            self._stop.wait(self.interval)
+
+    def _probe_upstream(self):
+        started = time.monotonic()
+        try:
+            response = self._session.get(f"{base_url}/models",
+                                         timeout=self.timeout)
+            ok = response.status_code < 500
+            return {
+                "status": "OK" if ok else "FAILED",
+                "status_code": response.status_code,
+                "latency_ms": round((time.monotonic() - started) * 1000, 1),
+            }
+        except Exception as e:
+            return {
+                "status": "FAILED",
+                "error": str(e),
+                "latency_ms": round((time.monotonic() - started) * 1000, 1),
+            }
+
+    def refresh(self):
+        upstream = self._probe_upstream()
+        upstream["breaker"] = get_breaker(base_url).state
+        checks = {
+            "upstream": upstream,
+            "api_key": "OK" if api_key else "MISSING",
+            "oss": "OK" if oss_configured else "NOT_CONFIGURED",
+        }
+        upstream_ok = upstream["status"] == "OK" and \
+            upstream["breaker"] != "open"
+        # By default a broken upstream only degrades the instance: taking every
+        # instance out of the load balancer would not help anyone
+        ready = upstream_ok or not self.require_upstream
+        self._snapshot = {
+            "status": "healthy" if ready and upstream_ok and api_key else
+            "degraded" if ready else "unhealthy",
+            "ready": ready,
+            "checks": checks,
+            "checked_at": datetime.now().isoformat(),
+        }
+        return self._snapshot
+
+    def liveness(self):
+        return {
+            "status": "healthy",
+            "service": SERVICE,
+            "version": VERSION,
+            "uptime_s": round(time.time() - self.started_at, 1),
+        }
+
+    def readiness(self):
+        return {"service": SERVICE, "version": VERSION, **self.snapshot}
+
+
+prober = HealthProber()
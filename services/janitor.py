@@ -0,0 +1,258 @@
+"""
+Reclaims the media the app created.
+
+Gradio uploads, chat view previews and `/api/chat` media stay on local disk,
+uploads to OSS stay under OSS_UPLOAD_PREFIX, and nothing removed them. A
+daemon thread sweeps them every JANITOR_INTERVAL seconds.
+
+A local file is live while conversations use it: every turn marks the files
+it sends (`touch` sets their access time), so the mark is shared by the
+workers and survives restarts. Files no turn used for MEDIA_RETENTION
+seconds are deleted. Above MEDIA_DISK_QUOTA, the least recently used files
+go first, sparing those used in the last QUOTA_MIN_IDLE seconds. Gradio's
+cache also holds Gradio's own static files, so only uploads received by
+`add_message` (`track`) are reclaimed there. A preview is rendered again
+when a deleted one is needed.
+
+OSS objects are uploaded under a prefix of this host's own
+(`OSS_UPLOAD_PREFIX/<instance id>/`), and `signing` records each one with the
+time its URL was last signed. Only recorded objects are reclaimed, once the
+last URL signed for them has expired (MEDIA_URL_TTL), so another deployment
+sharing the bucket keeps its objects. Signing holds a shared lock that the
+delete takes exclusively: an object is never deleted between the check that
+it exists and the URL handed out for it.
+
+With several workers, a lock file lets one of them sweep per interval.
+"""
+
+import contextlib
+import fcntl
+import logging
+import os
+import threading
+import time
+
+from config import (CHAT_API_MEDIA_DIR, JANITOR_INTERVAL, MEDIA_DISK_QUOTA,
+                    MEDIA_RETENTION, MEDIA_URL_TTL, SHARED_STATE_PATH,
+                    get_bucket)
+from services.log import get_logger
+from services.media import preview_dir
+from services.metrics import registry
+from services.shared_state import (SharedCache, media_cache, oss_registry,
+                                   upload_registry)
+
+logger = get_logger("janitor")
+
+# Recently used files are never evicted for the disk quota
+QUOTA_MIN_IDLE = 15 * 60
+# Access times are refreshed at most this often per file
+TOUCH_INTERVAL = 60
+# Objects per OSS batch delete request
+OSS_DELETE_BATCH = 1000
+# Kept past the expiry of their last URL, for clock skew with the upstream
+OSS_EXPIRY_MARGIN = 5 * 60
+
+_last_sweep = SharedCache("janitor")
+
+
+def last_used(stat):
+    return max(stat.st_atime, stat.st_mtime)
+
+
+class MediaJanitor:
+
+    def __init__(self, interval=JANITOR_INTERVAL, retention=MEDIA_RETENTION,
+                 quota=MEDIA_DISK_QUOTA, clock=time.time):
+        self.interval = interval
+        self.retention = retention
+        self.quota = quota
+        self._clock = clock
+        self._stop = threading.Event()
+        self._thread = None
+        self._lock_path = SHARED_STATE_PATH + ".janitor.lock"
+        self._oss_lock_path = SHARED_STATE_PATH + ".oss.lock"
+
+    def track(self, file_path):
+        """Register a Gradio upload, reclaimed once no longer used."""
+        if file_path and not file_path.startswith("http"):
+            upload_registry.set(file_path, True)
+
+    def touch(self, file_path, stat):
+        """Mark a local file as used by a conversation now."""
+        now = self._clock()
+        if now - stat.st_atime < TOUCH_INTERVAL:
+            return
+        try:
+            # The modification time keys the digest caches, keep it
+            os.utime(file_path, ns=(int(now * 1e9), stat.st_mtime_ns))
+        except OSError as e:
+            logger.debug("Could not touch %s: %s", file_path, e)
+
+    @contextlib.contextmanager
+    def signing(self, object_name, size):
+        """
+        Around the upload check and URL signing of an OSS object: records it
+        as signed now, and holds off its deletion until the URL is out.
+        """
+        with open(self._oss_lock_path, "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_SH)
+            oss_registry.set(object_name, {
+                "signed_at": self._clock(),
+                "size": size
+            })
+            yield
+
+    def start(self):
+        if self.interval <= 0 or (self._thread and self._thread.is_alive()):
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run,
+                                        name="media-janitor",
+                                        daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.sweep()
+            except Exception as e:
+                logger.warning("Media sweep failed: %s", e)
+
+    def sweep(self, force=False):
+        """
+        Reclaim unused media, returns the files and bytes reclaimed, or
+        None when another worker swept within the interval.
+        """
+        with open(self._lock_path, "a") as lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return None
+            now = self._clock()
+            swept_at = _last_sweep.get("swept_at", 0)
+            if not force and now - swept_at < self.interval * 0.9:
+                return None
+            started = time.monotonic()
+            result = {
+                "local": self.reclaim_local(now),
+                "oss": self.reclaim_oss(now),
+                "cache_entries": media_cache.purge_expired(),
+            }
+            _last_sweep.set("swept_at", now)
+        level = logging.INFO if result["local"]["files"] or \
+            result["oss"]["files"] else logging.DEBUG
+        logger.log(level, "Media sweep done",
+                   extra={
+                       "local_files": result["local"]["files"],
+                       "local_bytes": result["local"]["bytes"],
+                       "oss_objects": result["oss"]["files"],
+                       "oss_bytes": result["oss"]["bytes"],
+                       "duration_s": round(time.monotonic() - started, 3),
+                   })
+        return result
+
+    def _local_files(self):
+        """(path, stat, tracked) of every local file the app created."""
+        for root in (preview_dir(), CHAT_API_MEDIA_DIR):
+            if not os.path.isdir(root):
+                continue
+            for entry in os.scandir(root):
+                if entry.is_file(follow_symlinks=False):
+                    yield entry.path, entry.stat(follow_symlinks=False), False
+        for file_path, _ in upload_registry.items():
+            try:
+                yield file_path, os.stat(file_path), True
+            except FileNotFoundError:
+                upload_registry.delete(file_path)
+
+    def _delete_local(self, file_path, tracked):
+        try:
+            os.remove(file_path)
+        except FileNotFoundError:
+            pass
+        if tracked:
+            upload_registry.delete(file_path)
+            # Gradio keeps each upload in a directory of its own
+            try:
+                os.rmdir(os.path.dirname(file_path))
+            except OSError:
+                pass
+
+    def reclaim_local(self, now):
+        reclaimed = {"files": 0, "bytes": 0}
+        kept = []
+        for file_path, stat, tracked in self._local_files():
+            if now - last_used(stat) < self.retention:
+                kept.append((file_path, stat, tracked))
+                continue
+            self._delete_local(file_path, tracked)
+            reclaimed["files"] += 1
+            reclaimed["bytes"] += stat.st_size
+        used = sum(stat.st_size for _, stat, _ in kept)
+        if self.quota > 0 and used > self.quota:
+            kept.sort(key=lambda item: last_used(item[1]))
+            for file_path, stat, tracked in kept:
+                if used <= self.quota or \
+                        now - last_used(stat) < QUOTA_MIN_IDLE:
+                    break
+                self._delete_local(file_path, tracked)
+                used -= stat.st_size
+                reclaimed["files"] += 1
+                reclaimed["bytes"] += stat.st_size
+                QUOTA_EVICTIONS.inc()
+        DISK_BYTES.set(used)
+        RECLAIMED_FILES.inc(reclaimed["files"], target="local")
+        RECLAIMED_BYTES.inc(reclaimed["bytes"], target="local")
+        return reclaimed
+
+    def _expired_objects(self, now):
+        return [
+            object_name for object_name, entry in oss_registry.items()
+            if now - entry["signed_at"] >= MEDIA_URL_TTL + OSS_EXPIRY_MARGIN
+        ]
+
+    def reclaim_oss(self, now):
+        reclaimed = {"files": 0, "bytes": 0}
+        bucket = get_bucket()
+        if not bucket:
+            return reclaimed
+        expired = self._expired_objects(now)
+        for start in range(0, len(expired), OSS_DELETE_BATCH):
+            with open(self._oss_lock_path, "a") as lock:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+                batch = []
+                for object_name in expired[start:start + OSS_DELETE_BATCH]:
+                    entry = oss_registry.get(object_name)
+                    # Signed again since the scan
+                    if entry is None or now - entry["signed_at"] < \
+                            MEDIA_URL_TTL + OSS_EXPIRY_MARGIN:
+                        continue
+                    batch.append((object_name, entry.get("size", 0)))
+                if not batch:
+                    continue
+                bucket.batch_delete_objects([name for name, _ in batch])
+                for object_name, _ in batch:
+                    oss_registry.delete(object_name)
+            reclaimed["files"] += len(batch)
+            reclaimed["bytes"] += sum(size for _, size in batch)
+        RECLAIMED_FILES.inc(reclaimed["files"], target="oss")
+        RECLAIMED_BYTES.inc(reclaimed["bytes"], target="oss")
+        return reclaimed
+
+
+janitor = MediaJanitor()
+
+RECLAIMED_BYTES = registry.counter("qwen_media_reclaimed_bytes_total",
+                                   "Bytes of unused media deleted",
+                                   ("target", ))
+RECLAIMED_FILES = registry.counter("qwen_media_reclaimed_files_total",
+                                   "Unused media files and objects deleted",
+                                   ("target", ))
+QUOTA_EVICTIONS = registry.counter(
+    "qwen_media_quota_evictions_total",
+    "Local media files deleted early to stay under MEDIA_DISK_QUOTA")
+DISK_BYTES = registry.gauge("qwen_media_disk_bytes",
+                            "Local media kept after the last sweep")
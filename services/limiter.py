@@ -0,0 +1,161 @@
+"""
+Adaptive (AIMD) concurrency limiter for upstream model calls.
+
+The limit grows additively while time-to-first-token stays close to its
+healthy baseline and is cut multiplicatively on 429/5xx responses or latency
+spikes. Requests above the limit wait in a FIFO queue instead of failing.
+"""
+
+import collections
+import threading
+import time
+
+from config import (LIMITER_INITIAL, LIMITER_MIN, LIMITER_MAX,
+                    LIMITER_DECREASE_FACTOR, LIMITER_LATENCY_SPIKE,
+                    LIMITER_QUEUE_TIMEOUT)
+from services.metrics import registry
+from services.resilience import StreamCancelled, CANCEL_POLL_INTERVAL
+
+OVERLOAD_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+class LimiterTimeout(Exception):
+    """Raised when a request waited longer than the queue timeout."""
+
+
+class AdaptiveLimiter:
+
+    def __init__(self, name, initial=LIMITER_INITIAL, min_limit=LIMITER_MIN,
+                 max_limit=LIMITER_MAX,
+                 decrease_factor=LIMITER_DECREASE_FACTOR,
+                 latency_spike=LIMITER_LATENCY_SPIKE, cooldown=1.0,
+                 clock=time.monotonic):
+        self.name = name
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.decrease_factor = decrease_factor
+        self.latency_spike = latency_spike
+        self.cooldown = cooldown
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._limit = float(min(max(initial, min_limit), max_limit))
+        self._inflight = 0
+        self._waiters = collections.deque()
+        self._baseline = None
+        self._last_decrease = float("-inf")
+        self.decreases = 0
+
+    @property
+    def limit(self):
+        return int(self._limit)
+
+    def acquire(self, timeout=LIMITER_QUEUE_TIMEOUT, cancelled=None):
+        """Take a slot, waiting in line while the limit is reached."""
+        with self._lock:
+            if self._inflight < self.limit and not self._waiters:
+                self._inflight += 1
+                return
+            waiter = threading.Event()
+            self._waiters.append(waiter)
+
+        deadline = None if timeout is None else self._clock() + timeout
+        while not waiter.wait(CANCEL_POLL_INTERVAL):
+            is_cancelled = cancelled is not None and cancelled.is_set()
+            timed_out = deadline is not None and self._clock() >= deadline
+            if not (is_cancelled or timed_out):
+                continue
+            with self._lock:
+                if waiter.is_set():
+                    # Granted while we were giving up, keep the slot
+                    break
+                self._waiters.remove(waiter)
+            if is_cancelled:
+                raise StreamCancelled()
+            raise LimiterTimeout(
+                f"Upstream {self.name} is saturated, waited {timeout}s")
+
+    def release(self):
+        with self._lock:
+            self._inflight -= 1
+            self._grant()
+
+    def _grant(self):
+        # Slots are handed over directly so the queue stays FIFO
+        while self._waiters and self._inflight < self.limit:
+            self._inflight += 1
+            self._waiters.popleft().set()
+
+    def on_success(self, latency):
+        """Feed the time-to-first-token of a successful call."""
+        with self._lock:
+            if self._baseline is not None and \
+                    latency > self._baseline * self.latency_spike:
+                self._decrease()
+                return
+            # The baseline follows healthy latencies slowly
+            self._baseline = latency if self._baseline is None else (
+                0.95 * self._baseline + 0.05 * latency)
+            self._limit = min(self.max_limit, self._limit + 1.0 / self._limit)
+            self._grant()
+
+    def on_error(self, exc):
+        """Cut the limit when the upstream signals overload."""
+        if getattr(exc, "status_code", None) not in OVERLOAD_STATUS_CODES:
+            return
+        with self._lock:
+            self._decrease()
+
+    def _decrease(self):
+        now = self._clock()
+        # One cut per cooldown, a burst of 429s is a single signal
+        if now - self._last_decrease < self.cooldown:
+            return
+        self._last_decrease = now
+        self._limit = max(self.min_limit,
+                          self._limit * self.decrease_factor)
+        self.decreases += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                "limit": self.limit,
+                "inflight": self._inflight,
+                "queue_depth": len(self._waiters),
+                "decreases": self.decreases,
+            }
+
+
+_limiters = {}
+_registry_lock = threading.Lock()
+
+
+def get_limiter(upstream):
+    with _registry_lock:
+        if upstream not in _limiters:
+            _limiters[upstream] = AdaptiveLimiter(upstream)
+        return _limiters[upstream]
+
+
+def limiter_stats():
+    with _registry_lock:
+        limiters = dict(_limiters)
+    return {name: limiter.stats() for name, limiter in limiters.items()}
+
+
+LIMIT = registry.gauge("qwen_upstream_concurrency_limit",
+                       "Current adaptive concurrency limit", ("upstream",))
+INFLIGHT = registry.gauge("qwen_upstream_inflight",
+                          "Upstream calls holding a limiter slot",
+                          ("upstream",))
+QUEUE_DEPTH = registry.gauge("qwen_upstream_queue_depth",
+                             "Calls waiting for a limiter slot", ("upstream",))
+
+
+def _collect():
+    for upstream, stats in limiter_stats().items():
+        LIMIT.set(stats["limit"], upstream=upstream)
+        INFLIGHT.set(stats["inflight"], upstream=upstream)
+        QUEUE_DEPTH.set(stats["queue_depth"], upstream=upstream)
+
+
+registry.add_collector(_collect)
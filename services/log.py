@@ -0,0 +1,163 @@
+"""
+Non-blocking structured logging.
+
+Records are put on a bounded in-memory queue by a `QueueHandler` and written
+by a `QueueListener` thread, so streaming threads never wait on stdout or
+disk. When the queue is full records are dropped and counted rather than
+blocking. Output is either text or JSON lines (`LOG_FORMAT`), the optional
+`LOG_FILE` is size-rotated, and fields passed through `extra=` (such as the
+per-turn `request_id`) are kept on every record.
+
+Response bodies are only logged at DEBUG, for a `LOG_BODY_SAMPLE_RATE`
+fraction of turns, truncated to `LOG_BODY_MAX_CHARS`.
+"""
+
+import atexit
+import json
+import logging
+import queue
+import random
+import sys
+import uuid
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+from config import LOG_LEVEL, LOG_FORMAT, LOG_FILE, LOG_MAX_BYTES, LOG_BACKUP_COUNT, LOG_QUEUE_SIZE, LOG_BODY_MAX_CHARS, LOG_BODY_SAMPLE_RATE, LOG_LIBRARY_LEVEL
+from services.metrics import registry
+
+TEXT_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - [%(request_id)s] %(message)s"
+
+# Attributes every LogRecord has, anything else came from `extra=`
+_RECORD_ATTRIBUTES = set(
+    logging.LogRecord("", 0, "", 0, "", (), None).__dict__) | {
+        "message", "asctime", "taskName"
+    }
+
+DROPPED = registry.counter("qwen_log_records_dropped_total",
+                           "Log records dropped because the queue was full")
+
+
+def _extra_fields(record):
+    return {
+        key: value
+        for key, value in record.__dict__.items()
+        if key not in _RECORD_ATTRIBUTES and key != "request_id"
+    }
+
+
+class TextFormatter(logging.Formatter):
+    """Classic text lines, `extra` fields appended as key=value."""
+
+    def __init__(self):
+        super().__init__(TEXT_FORMAT, defaults={"request_id": "-"})
+
+    def format(self, record):
+        line = super().format(record)
+        fields = _extra_fields(record)
+        if fields:
+            line += " " + " ".join(f"{key}={value}"
+                                   for key, value in fields.items())
+        return line
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line."""
+
+    def format(self, record):
+        entry = {
+            "ts": datetime.fromtimestamp(record.created,
+                                         timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "request_id": getattr(record, "request_id", None),
+            "msg": record.getMessage(),
+            **_extra_fields(record),
+        }
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class DroppingQueueHandler(QueueHandler):
+    """Never blocks the caller: records are dropped when the queue is full."""
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            DROPPED.inc()
+
+
+_listener = None
+
+
+def setup_logging(log_file=LOG_FILE, level=LOG_LEVEL, fmt=LOG_FORMAT):
+    """
+    Route the root logger through the queue. `level` applies to the app's
+    `qwen3vl.*` loggers, third-party ones stay at `LOG_LIBRARY_LEVEL` (httpx
+    logs every upstream request at INFO). Calling it again replaces the
+    previous configuration, e.g. when `app_prod` adds its log file.
+    """
+    global _listener
+    if _listener:
+        _listener.stop()
+    formatter = JsonFormatter() if fmt == "json" else TextFormatter()
+    handlers = [logging.StreamHandler(sys.stdout)]
+    if log_file:
+        handlers.append(
+            RotatingFileHandler(log_file,
+                                maxBytes=LOG_MAX_BYTES,
+                                backupCount=LOG_BACKUP_COUNT,
+                                encoding="utf-8"))
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    log_queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(DroppingQueueHandler(log_queue))
+    root.setLevel(LOG_LIBRARY_LEVEL)
+    logging.getLogger("qwen3vl").setLevel(level)
+    _listener = QueueListener(log_queue,
+                              *handlers,
+                              respect_handler_level=True)
+    _listener.start()
+
+
+def _flush():
+    if _listener:
+        _listener.stop()
+
+
+atexit.register(_flush)
+
+
+def get_logger(name):
+    return logging.getLogger(f"qwen3vl.{name}")
+
+
+def new_request_id():
+    return uuid.uuid4().hex[:12]
+
+
+class RequestLogger(logging.LoggerAdapter):
+    """Adds `request_id` to every record, keeping per-call `extra` fields."""
+
+    def process(self, msg, kwargs):
+        kwargs["extra"] = {**self.extra, **kwargs.get("extra", {})}
+        return msg, kwargs
+
+
+def request_logger(logger, request_id):
+    return RequestLogger(logger, {"request_id": request_id})
+
+
+def sample_body():
+    return LOG_BODY_SAMPLE_RATE > 0 and random.random() < LOG_BODY_SAMPLE_RATE
+
+
+def truncate(text, limit=LOG_BODY_MAX_CHARS):
+    if text is None or len(text) <= limit:
+        return text
+    return f"{text[:limit]}… (+{len(text) - limit} chars)"
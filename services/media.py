@@ -0,0 +1,217 @@
+"""
+Media in the chat view.
+
+The chatbot is re-rendered with the whole conversation on every update, so
+attachments are shown as previews: a WebP copy of each image at most
+MEDIA_PREVIEW_SIZE pixels wide or high, rendered once per content hash into
+Gradio's cache directory. The conversation state keeps the original files,
+which are what the model receives.
+
+`MediaFileMiddleware` adds caching headers to what Gradio's `/file=` route
+serves from its cache directory, images and videos whose paths never change
+content: an immutable Cache-Control, and a 304 when the browser already
+holds the ETag. Gradio still serves the file, with its login check, its
+allowed and blocked paths and its byte ranges.
+"""
+
+import collections
+import hashlib
+import mimetypes
+import os
+import threading
+
+from gradio.route_utils import XSS_SAFE_MIMETYPES
+from gradio.utils import get_upload_folder
+from starlette.datastructures import Headers, MutableHeaders
+
+from config import MEDIA_PREVIEW_SIZE
+from services.log import get_logger
+from services.metrics import registry
+
+logger = get_logger("media")
+
+FILE_ROUTE = "/gradio_api/file="
+IMMUTABLE = "private, max-age=31536000, immutable"
+HASH_CHUNK = 1024 * 1024
+# Smaller images are shown as they are
+PREVIEW_MIN_BYTES = 200 * 1024
+PREVIEW_QUALITY = 80
+MAX_CACHED_PATHS = 4096
+SERVED_MIMETYPES = {
+    mime_type for mime_type in XSS_SAFE_MIMETYPES
+    if mime_type.startswith(("image/", "video/"))
+}
+
+
+class _LRU:
+
+    def __init__(self, size=MAX_CACHED_PATHS):
+        self.size = size
+        self._items = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._items.get(key)
+            if value is not None:
+                self._items.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._items[key] = value
+            while len(self._items) > self.size:
+                self._items.popitem(last=False)
+
+
+_digests = _LRU()
+_previews = _LRU()
+
+
+def file_digest(file_path, stat):
+    """SHA-256 of a file, cached per path, size and mtime."""
+    key = (file_path, stat.st_size, stat.st_mtime_ns)
+    digest = _digests.get(key)
+    if digest is None:
+        sha = hashlib.sha256()
+        with open(file_path, "rb") as file:
+            while chunk := file.read(HASH_CHUNK):
+                sha.update(chunk)
+        digest = sha.hexdigest()
+        _digests.set(key, digest)
+    return digest
+
+
+def preview_dir():
+    # Inside Gradio's cache, which Gradio serves without copying
+    return os.path.join(get_upload_folder(), "qwen3-vl-previews")
+
+
+def _render_preview(file_path, target, size):
+    from PIL import Image, ImageOps
+    with Image.open(file_path) as image:
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail((size, size), Image.Resampling.LANCZOS)
+        if image.mode not in ("RGB", "RGBA"):
+            image = image.convert("RGBA" if "A" in image.getbands() else "RGB")
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        temp_path = f"{target}.{threading.get_ident()}.tmp"
+        image.save(temp_path, "WEBP", quality=PREVIEW_QUALITY)
+    os.replace(temp_path, target)
+
+
+def preview_path(file_path, size=MEDIA_PREVIEW_SIZE):
+    """
+    Path of the preview shown for `file_path`, the file itself when it is
+    not a still image, already small, or cannot be decoded.
+    """
+    cached = _previews.get((file_path, size))
+    # The janitor may have deleted the preview since
+    if cached is not None and (cached == file_path or os.path.exists(cached)):
+        return cached
+    result = file_path
+    mime_type = mimetypes.guess_type(file_path)[0] or ""
+    try:
+        stat = os.stat(file_path)
+        # Animated GIFs would lose their animation
+        if size > 0 and mime_type.startswith("image/") and \
+                mime_type not in ("image/gif", "image/svg+xml") and \
+                stat.st_size > PREVIEW_MIN_BYTES:
+            target = os.path.join(preview_dir(),
+                                  f"{file_digest(file_path, stat)}-{size}.webp")
+            if not os.path.exists(target):
+                _render_preview(file_path, target, size)
+                PREVIEWS.inc()
+            if os.path.getsize(target) < stat.st_size:
+                result = target
+    except Exception as e:
+        logger.warning("No preview for %s: %s", file_path, e)
+    _previews.set((file_path, size), result)
+    return result
+
+
+def chat_view(history):
+    """`history` as rendered by the chatbot, with images shown as previews"""
+    view = []
+    for item in history:
+        content = item.get("content")
+        if item.get("role") == "user" and isinstance(content, list) and \
+                content and content[0].get("type") == "file":
+            files = content[0]["content"]
+            previews = [
+                file if file.startswith("http") else preview_path(file)
+                for file in files
+            ]
+            if previews != files:
+                item = {
+                    **item, "content": [{
+                        **content[0], "content": previews
+                    }, *content[1:]]
+                }
+        view.append(item)
+    return view
+
+
+class MediaFileMiddleware:
+    """
+    Marks Gradio's `/gradio_api/file=` responses for images and videos
+    inside its cache directory as immutable, and turns them into a 304 when
+    the browser sends their ETag. Other requests pass through untouched.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.cache_dir = os.path.realpath(get_upload_folder())
+
+    def _cached_media(self, path):
+        real_path = os.path.realpath(path)
+        if os.path.commonpath([real_path, self.cache_dir]) != self.cache_dir:
+            return None
+        if mimetypes.guess_type(real_path)[0] not in SERVED_MIMETYPES:
+            return None
+        return real_path
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] not in ("GET", "HEAD") \
+                or not scope["path"].startswith(FILE_ROUTE) or \
+                self._cached_media(scope["path"][len(FILE_ROUTE):]) is None:
+            await self.app(scope, receive, send)
+            return
+        if_none_match = Headers(scope=scope).get("if-none-match", "")
+        cached_tags = {tag.strip() for tag in if_none_match.split(",")} - {""}
+        not_modified = False
+
+        async def send_with_cache_headers(message):
+            nonlocal not_modified
+            if message["type"] == "http.response.start":
+                if message["status"] not in (200, 206):
+                    # Refused by Gradio (login, blocked path) or missing
+                    await send(message)
+                    return
+                headers = MutableHeaders(scope=message)
+                headers["Cache-Control"] = IMMUTABLE
+                etag = headers.get("etag")
+                if message["status"] == 200 and etag in cached_tags:
+                    not_modified = True
+                    NOT_MODIFIED.inc()
+                    await send({
+                        "type": "http.response.start",
+                        "status": 304,
+                        "headers": [(b"etag", etag.encode()),
+                                    (b"cache-control", IMMUTABLE.encode())],
+                    })
+                    await send({"type": "http.response.body", "body": b""})
+                    return
+            elif not_modified:
+                # The browser keeps its copy, drop Gradio's body
+                return
+            await send(message)
+
+        await self.app(scope, receive, send_with_cache_headers)
+
+
+PREVIEWS = registry.counter("qwen_media_previews_total",
+                            "Image previews rendered for the chat view")
+NOT_MODIFIED = registry.counter(
+    "qwen_media_not_modified_total",
+    "Media requests answered 304 from the browser's cached copy")
@@ -0,0 +1,273 @@
+"""
+Minimal Prometheus-compatible metrics: counters, gauges and histograms with
+labels, rendered in the text exposition format served at `/metrics`.
+
+Kept dependency-free on purpose; components that already keep their own
+counters (limiter, scheduler, cancellation) are read through collectors at
+scrape time instead of being updated on the hot path.
+"""
+
+import bisect
+import logging
+import threading
+import time
+
+# Buckets tuned for streaming chat latencies (seconds)
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2, 3, 5, 8, 13, 21, 34, 55, 89,
+                   144, 300)
+GAP_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10)
+RATE_BUCKETS = (1, 2, 5, 10, 20, 35, 50, 75, 100, 150, 200, 300)
+RATIO_BUCKETS = (0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 1.0)
+BYTES_BUCKETS = (1e3, 1e4, 1e5, 5e5, 1e6, 5e6, 1e7, 5e7, 1e8)
+
+# services.log registers its own metrics here, so no get_logger() import
+logger = logging.getLogger("qwen3vl.metrics")
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace(
+        '"', '\\"')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"'
+                          for name, value in pairs) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(
+                f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def header(self):
+        return [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.kind}",
+        ]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def render(self):
+        with self._lock:
+            values = dict(self._values)
+        return self.header() + [
+            f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+            for key, value in sorted(values.items())
+        ]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(),
+                 buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            series = self._values.get(key)
+            if series is None:
+                series = self._values[key] = {
+                    "counts": [0] * (len(self.buckets) + 1),
+                    "sum": 0.0,
+                    "count": 0,
+                }
+            series["counts"][bisect.bisect_left(self.buckets, value)] += 1
+            series["sum"] += value
+            series["count"] += 1
+
+    def snapshot(self, **labels):
+        with self._lock:
+            series = self._values.get(self._key(labels))
+            return None if series is None else {
+                "counts": list(series["counts"]),
+                "sum": series["sum"],
+                "count": series["count"],
+            }
+
+    def render(self):
+        with self._lock:
+            values = {
+                key: (list(series["counts"]), series["sum"], series["count"])
+                for key, series in self._values.items()
+            }
+        lines = self.header()
+        for key, (counts, total, count) in sorted(values.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),),
+                                           counts):
+                cumulative += bucket_count
+                labels = _format_labels(self.labelnames, key,
+                                        [("le", _format_value(bound))])
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class Registry:
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics = {}
+        self._collectors = []
+
+    def _register(self, metric):
+        with self._lock:
+            if metric.name in self._metrics:
+                return self._metrics[metric.name]
+            self._metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self._register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(),
+                  buckets=LATENCY_BUCKETS):
+        return self._register(
+            Histogram(name, documentation, labelnames, buckets))
+
+    def add_collector(self, collect):
+        """`collect()` is called at scrape time to refresh gauges."""
+        with self._lock:
+            self._collectors.append(collect)
+
+    def render(self):
+        with self._lock:
+            collectors = list(self._collectors)
+            metrics = list(self._metrics.values())
+        for collect in collectors:
+            try:
+                collect()
+            except Exception as e:
+                logger.warning("Metrics collector failed: %s", e)
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+TTFT = registry.histogram("qwen_ttft_seconds",
+                          "Time from request to first streamed token",
+                          ("model", "upstream"))
+REASONING_TIME = registry.histogram(
+    "qwen_reasoning_seconds", "Time spent streaming reasoning_content",
+    ("model", "upstream"))
+ANSWER_TIME = registry.histogram("qwen_answer_seconds",
+                                 "Time spent streaming the answer",
+                                 ("model", "upstream"))
+INTER_TOKEN_GAP = registry.histogram("qwen_inter_token_gap_seconds",
+                                     "Gap between consecutive stream chunks",
+                                     ("model", "upstream"),
+                                     buckets=GAP_BUCKETS)
+TOKENS_PER_SECOND = registry.histogram(
+    "qwen_output_tokens_per_second",
+    "Completion tokens reported by the upstream per second after the first "
+    "token", ("model", "upstream"),
+    buckets=RATE_BUCKETS)
+QUEUE_WAIT = registry.histogram("qwen_queue_wait_seconds",
+                                "Time a turn waited for a generation slot",
+                                ("turn_class",))
+ATTACHMENT_PREPARE = registry.histogram(
+    "qwen_attachment_prepare_seconds",
+    "Time to upload/encode attachments and build the request messages")
+REQUESTS = registry.counter("qwen_generation_requests_total",
+                            "Generation requests by outcome",
+                            ("model", "upstream", "outcome"))
+
+
+class StreamTimer:
+    """Collects the timings of one streamed completion."""
+
+    def __init__(self, model, upstream, clock=time.monotonic):
+        self.labels = dict(model=model, upstream=upstream)
+        self._clock = clock
+        self.started_at = clock()
+        self.first_token_at = None
+        self.answer_started_at = None
+        self.reasoning_started_at = None
+        self.last_chunk_at = None
+        self.chunks = 0
+
+    def on_chunk(self, reasoning=False, answer=False):
+        now = self._clock()
+        if self.first_token_at is None:
+            self.first_token_at = now
+            TTFT.observe(now - self.started_at, **self.labels)
+        else:
+            INTER_TOKEN_GAP.observe(now - self.last_chunk_at, **self.labels)
+        if reasoning and self.reasoning_started_at is None:
+            self.reasoning_started_at = now
+        if answer and self.answer_started_at is None:
+            self.answer_started_at = now
+            if self.reasoning_started_at is not None:
+                REASONING_TIME.observe(now - self.reasoning_started_at,
+                                       **self.labels)
+        self.last_chunk_at = now
+        self.chunks += 1
+
+    def finish(self, outcome, completion_tokens=None):
+        """
+        Record the outcome. The output rate needs the upstream's
+        `completion_tokens`, a chunk can carry any number of tokens.
+        """
+        REQUESTS.inc(outcome=outcome, **self.labels)
+        if outcome != "success" or self.first_token_at is None:
+            return
+        if self.answer_started_at is not None:
+            ANSWER_TIME.observe(self.last_chunk_at - self.answer_started_at,
+                                **self.labels)
+        streaming_time = self.last_chunk_at - self.first_token_at
+        if completion_tokens and streaming_time > 0:
+            TOKENS_PER_SECOND.observe(completion_tokens / streaming_time,
+                                      **self.labels)
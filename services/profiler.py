@@ -0,0 +1,139 @@
+"""
+In-situ profiling of the live app.
+
+`SamplingProfiler` samples the stacks of every thread for a few seconds and
+returns them in the folded format read by flamegraph.pl, speedscope and
+inferno (`frame;frame;frame count` per line). It is started on demand from
+the admin-only `/admin/profile` route and costs nothing otherwise.
+
+`profile_generator` wraps one `Gradio_Events.submit` execution in cProfile
+and writes a `.prof` file (pstats, snakeviz). It is opt-in per request with
+the `X-Profile-Request: <ADMIN_TOKEN>` header, or for every request with
+`PROFILE_SUBMIT=true`.
+"""
+
+import cProfile
+import hmac
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from datetime import datetime
+
+from config import ADMIN_TOKEN, PROFILE_DIR, PROFILE_SUBMIT, PROFILE_SAMPLE_INTERVAL
+from services.log import get_logger
+
+PROFILE_HEADER = "x-profile-request"
+
+logger = get_logger("profiler")
+
+
+class ProfilerBusy(Exception):
+    """A sampling run is already in progress."""
+
+
+def is_admin(token):
+    """Admin routes are disabled while `ADMIN_TOKEN` is unset."""
+    return bool(ADMIN_TOKEN and token) and hmac.compare_digest(
+        token.encode(), ADMIN_TOKEN.encode())
+
+
+def _frame_label(frame):
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def _folded_stack(frame):
+    labels = []
+    while frame is not None:
+        labels.append(_frame_label(frame))
+        frame = frame.f_back
+    return ";".join(reversed(labels))
+
+
+class SamplingProfiler:
+    """Wall-clock stack sampler, one run at a time."""
+
+    def __init__(self, interval=PROFILE_SAMPLE_INTERVAL):
+        self.interval = interval
+        self._lock = threading.Lock()
+
+    def sample(self, seconds):
+        """Sample all threads for `seconds`, return `(folded, samples)`."""
+        if not self._lock.acquire(blocking=False):
+            raise ProfilerBusy()
+        try:
+            stacks = Counter()
+            samples = 0
+            own_thread = threading.get_ident()
+            names = {}
+            deadline = time.monotonic() + seconds
+            while time.monotonic() < deadline:
+                for thread in threading.enumerate():
+                    names.setdefault(thread.ident, thread.name)
+                for ident, frame in sys._current_frames().items():
+                    if ident == own_thread:
+                        continue
+                    thread_name = names.get(ident, str(ident))
+                    stacks[f"{thread_name};{_folded_stack(frame)}"] += 1
+                samples += 1
+                time.sleep(self.interval)
+            folded = "\n".join(f"{stack} {count}"
+                               for stack, count in stacks.most_common())
+            return folded, samples
+        finally:
+            self._lock.release()
+
+    def sample_to_file(self, seconds, directory=PROFILE_DIR):
+        folded, samples = self.sample(seconds)
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(
+            directory,
+            f"sampling-{datetime.now().strftime('%Y%m%d-%H%M%S')}.folded")
+        with open(path, "w") as output:
+            output.write(folded + "\n")
+        logger.info("Sampling profile of %.1fs (%d samples) written to %s",
+                    seconds, samples, path)
+        return folded, path
+
+
+sampler = SamplingProfiler()
+
+
+def should_profile(request):
+    if PROFILE_SUBMIT:
+        return True
+    if request is None or not ADMIN_TOKEN:
+        return False
+    return is_admin(request.headers.get(PROFILE_HEADER))
+
+
+def profile_generator(generator, name, directory=PROFILE_DIR):
+    """
+    Yield from `generator` under cProfile. The profiler is enabled around
+    each step only, as Gradio may resume the generator on another thread.
+    """
+    profile = cProfile.Profile()
+    try:
+        while True:
+            profile.enable()
+            try:
+                item = next(generator)
+            except StopIteration:
+                return
+            finally:
+                profile.disable()
+            yield item
+    finally:
+        generator.close()
+        try:
+            os.makedirs(directory, exist_ok=True)
+            path = os.path.join(
+                directory, f"{name}-{datetime.now().strftime('%Y%m%d-%H%M%S')}"
+                f"-{uuid.uuid4().hex[:8]}.prof")
+            profile.dump_stats(path)
+            logger.info("Request profile written to %s", path)
+        except Exception as e:
+            logger.warning("Could not write request profile: %s", e)
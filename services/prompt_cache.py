@@ -0,0 +1,45 @@
+"""
+Provider-side prompt caching.
+
+Upstreams cache the longest request prefix they have recently seen, byte
+for byte, so a turn only pays in full for what is new when the earlier
+turns are sent exactly as before. Uploads are named and their URLs cached
+by content hash (`file_path_to_oss_url`), which keeps the media of earlier
+turns stable. Some providers also need explicit breakpoints:
+`mark_cache_breakpoints` adds `cache_control` to the system prompt and to
+the last message before the new turn.
+
+Cached prompt tokens reported by the upstream are recorded by the usage
+ledger, see `qwen_prompt_cache_hit_ratio`.
+"""
+
+EPHEMERAL = {"type": "ephemeral"}
+
+
+def _parts(content):
+    if isinstance(content, str):
+        return [{"type": "text", "text": content}]
+    return list(content)
+
+
+def mark_cache_breakpoints(messages):
+    """Copy of `messages` with a cache breakpoint after each stable prefix."""
+    marked = list(messages)
+    breakpoints = []
+    if marked and marked[0]["role"] == "system":
+        breakpoints.append(0)
+    last_user = max(
+        (index for index, message in enumerate(marked)
+         if message["role"] == "user"),
+        default=None)
+    if last_user is not None and last_user - 1 not in breakpoints and \
+            last_user > 0:
+        breakpoints.append(last_user - 1)
+    for index in breakpoints:
+        parts = _parts(marked[index]["content"])
+        # Empty text blocks are rejected
+        if not parts or parts[-1].get("text") == "":
+            continue
+        parts[-1] = {**parts[-1], "cache_control": EPHEMERAL}
+        marked[index] = {**marked[index], "content": parts}
+    return marked
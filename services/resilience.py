@@ -0,0 +1,295 @@
+"""
+Upstream resilience helpers: per-upstream circuit breakers, jittered retries
+before the first token, and hedged first-token requests.
+"""
+
+import collections
+import queue
+import random
+import threading
+import time
+
+from config import (UPSTREAM_MAX_RETRIES, UPSTREAM_BACKOFF_BASE,
+                    UPSTREAM_BACKOFF_MAX, BREAKER_FAILURE_THRESHOLD,
+                    BREAKER_RESET_TIMEOUT, HEDGE_ENABLED, HEDGE_PERCENTILE,
+                    HEDGE_MIN_DELAY, HEDGE_MIN_SAMPLES)
+
+RETRYABLE_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504}
+# How often a pending first-token wait checks for cancellation
+CANCEL_POLL_INTERVAL = 0.1
+
+
+class StreamCancelled(Exception):
+    """Raised when the request is cancelled before the first token."""
+
+
+class CircuitOpenError(Exception):
+    """Raised when the breaker of an upstream refuses new calls."""
+
+    def __init__(self, upstream, retry_in):
+        self.upstream = upstream
+        self.retry_in = retry_in
+        super().__init__(
+            f"Upstream {upstream} is temporarily unavailable, retry in {retry_in:.0f}s")
+
+
+class CircuitBreaker:
+    """Classic closed / open / half-open breaker keyed by upstream."""
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, name, failure_threshold=BREAKER_FAILURE_THRESHOLD,
+                 reset_timeout=BREAKER_RESET_TIMEOUT, clock=time.monotonic):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+
+    @property
+    def state(self):
+        with self._lock:
+            self._maybe_half_open()
+            return self._state
+
+    def _maybe_half_open(self):
+        if self._state == self.OPEN and \
+                self._clock() - self._opened_at >= self.reset_timeout:
+            self._state = self.HALF_OPEN
+            self._probe_in_flight = False
+
+    def before_call(self):
+        """Raise CircuitOpenError unless a call may go through."""
+        with self._lock:
+            self._maybe_half_open()
+            if self._state == self.OPEN:
+                retry_in = self.reset_timeout - (self._clock() -
+                                                 self._opened_at)
+                raise CircuitOpenError(self.name, max(retry_in, 0))
+            if self._state == self.HALF_OPEN:
+                # Only one probe at a time while half-open
+                if self._probe_in_flight:
+                    raise CircuitOpenError(self.name, 0)
+                self._probe_in_flight = True
+
+    def record_success(self):
+        with self._lock:
+            self._state = self.CLOSED
+            self._failures = 0
+            self._probe_in_flight = False
+
+    def release_probe(self):
+        """Give up a half-open probe without judging the upstream."""
+        with self._lock:
+            self._probe_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._state == self.HALF_OPEN or \
+                    self._failures >= self.failure_threshold:
+                self._state = self.OPEN
+                self._opened_at = self._clock()
+            self._probe_in_flight = False
+
+
+class LatencyTracker:
+    """Sliding window of time-to-first-token samples for one upstream."""
+
+    def __init__(self, window=200):
+        self._samples = collections.deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def observe(self, seconds):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def percentile(self, p):
+        with self._lock:
+            samples = sorted(self._samples)
+        if not samples:
+            return None
+        index = min(len(samples) - 1, int(round(p / 100.0 *
+                                                (len(samples) - 1))))
+        return samples[index]
+
+    def __len__(self):
+        return len(self._samples)
+
+
+_breakers = {}
+_latencies = {}
+_registry_lock = threading.Lock()
+
+
+def get_breaker(upstream):
+    with _registry_lock:
+        if upstream not in _breakers:
+            _breakers[upstream] = CircuitBreaker(upstream)
+        return _breakers[upstream]
+
+
+def get_latency_tracker(upstream):
+    with _registry_lock:
+        if upstream not in _latencies:
+            _latencies[upstream] = LatencyTracker()
+        return _latencies[upstream]
+
+
+def is_retryable(exc):
+    """Connect errors, timeouts, 429 and 5xx are worth another attempt."""
+    # Imported here, the client is only loaded on first use (see app.get_client)
+    import openai
+    if isinstance(exc, (openai.APIConnectionError, openai.APITimeoutError)):
+        return True
+    status_code = getattr(exc, "status_code", None)
+    return status_code in RETRYABLE_STATUS_CODES or (
+        status_code is not None and status_code >= 500)
+
+
+def backoff_delay(attempt, base=UPSTREAM_BACKOFF_BASE,
+                  cap=UPSTREAM_BACKOFF_MAX):
+    """Full-jitter exponential backoff (attempt starts at 0)."""
+    return random.uniform(0, min(cap, base * (2**attempt)))
+
+
+def close_stream(stream):
+    close = getattr(stream, "close", None)
+    if close:
+        try:
+            close()
+        except Exception:
+            pass
+
+
+def _start_attempt(create_stream, results, winner):
+    """Open a stream in a thread and report its first chunk to `results`."""
+
+    def run():
+        started = time.monotonic()
+        stream = None
+        try:
+            stream = create_stream()
+            iterator = iter(stream)
+            first_chunk = next(iterator, None)
+        except Exception as e:
+            results.put((None, None, None, e, 0.0))
+            return
+        with winner["lock"]:
+            if winner["done"]:
+                # A faster attempt already won, drop this one
+                close_stream(stream)
+                return
+            winner["done"] = True
+            results.put((stream, iterator, first_chunk, None,
+                         time.monotonic() - started))
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+
+
+def resilient_stream(create_stream, upstream,
+                     max_retries=UPSTREAM_MAX_RETRIES, hedge=HEDGE_ENABLED,
+                     sleep=time.sleep, cancelled=None, on_error=None,
+                     on_success=None):
+    """
+    Open an upstream stream through the breaker, retrying retryable errors
+    with jittered backoff until the first token arrives, optionally hedging
+    a second request when the first token is late.
+
+    Returns `(stream, chunks)`: the winning stream object (for cancellation)
+    and an iterator replaying the first chunk followed by the rest. Errors
+    after the first token are not retried. When the `cancelled` event is
+    set while waiting, pending attempts are dropped and StreamCancelled is
+    raised. `on_error` is called with every failed attempt, `on_success`
+    with the time-to-first-token of the winning attempt alone, without the
+    backoff and hedge delays before it.
+    """
+    breaker = get_breaker(upstream)
+    latency = get_latency_tracker(upstream)
+    breaker.before_call()
+
+    hedge_delay = None
+    if hedge and len(latency) >= HEDGE_MIN_SAMPLES:
+        hedge_delay = max(HEDGE_MIN_DELAY, latency.percentile(HEDGE_PERCENTILE))
+
+    attempt = 0
+    last_error = None
+    while True:
+        results = queue.Queue()
+        winner = {"lock": threading.Lock(), "done": False}
+        _start_attempt(create_stream, results, winner)
+        in_flight = 1
+        hedge_at = None if hedge_delay is None else time.monotonic(
+        ) + hedge_delay
+        while in_flight:
+            timeout = None
+            if hedge_at is not None:
+                timeout = max(0, hedge_at - time.monotonic())
+            if cancelled is not None:
+                timeout = CANCEL_POLL_INTERVAL if timeout is None else min(
+                    timeout, CANCEL_POLL_INTERVAL)
+            try:
+                stream, iterator, first_chunk, error, ttft = results.get(
+                    timeout=timeout)
+            except queue.Empty:
+                if cancelled is not None and cancelled.is_set():
+                    _abandon(winner, results)
+                    breaker.release_probe()
+                    raise StreamCancelled()
+                if hedge_at is not None and time.monotonic() >= hedge_at:
+                    _start_attempt(create_stream, results, winner)
+                    in_flight += 1
+                    hedge_at = None
+                continue
+            in_flight -= 1
+            if error is None:
+                breaker.record_success()
+                latency.observe(ttft)
+                if on_success:
+                    on_success(ttft)
+                return stream, _replay(first_chunk, iterator)
+            last_error = error
+            if on_error:
+                on_error(error)
+
+        if not is_retryable(last_error):
+            # The upstream answered (e.g. 400/401), it is not unhealthy
+            breaker.record_success()
+            raise last_error
+        if attempt >= max_retries:
+            breaker.record_failure()
+            raise last_error
+        delay = backoff_delay(attempt)
+        if cancelled is not None:
+            if cancelled.wait(delay):
+                breaker.release_probe()
+                raise StreamCancelled()
+        else:
+            sleep(delay)
+        attempt += 1
+
+
+def _abandon(winner, results):
+    """Make late attempts close themselves, and close one that just won."""
+    with winner["lock"]:
+        winner["done"] = True
+    while True:
+        try:
+            stream = results.get_nowait()[0]
+        except queue.Empty:
+            return
+        if stream is not None:
+            close_stream(stream)
+
+
+def _replay(first_chunk, iterator):
+    if first_chunk is not None:
+        yield first_chunk
+    yield from iterator
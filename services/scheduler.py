@@ -0,0 +1,225 @@
+"""
+Per-user fair-share scheduling and rate limiting of generation turns.
+
+Every `add_message` / `regenerate_message` turn is keyed by user (see
+`app.get_session_id`): the login name, else a client id cookie set by the
+server. A token bucket per key bounds how often a user may start turns,
+and a fixed number of generation slots is handed out round-robin across
+sessions, lighter turns (text only, then images) before video turns. Waiting
+turns are promoted after `SCHEDULER_AGING` seconds so video is never starved.
+"""
+
+import collections
+import mimetypes
+import threading
+import time
+
+from config import (SCHEDULER_SLOTS, SCHEDULER_AGING, RATE_LIMIT_PER_MINUTE,
+                    RATE_LIMIT_BURST)
+from services.metrics import registry, QUEUE_WAIT
+from services.resilience import StreamCancelled, CANCEL_POLL_INTERVAL
+
+# Turn classes in priority order
+TURN_CLASSES = ("text", "image", "video")
+MAX_TRACKED_SESSIONS = 10000
+
+
+class RateLimited(Exception):
+
+    def __init__(self, retry_in):
+        self.retry_in = retry_in
+        super().__init__(f"Too many requests, retry in {retry_in:.0f}s")
+
+
+class TokenBucket:
+
+    def __init__(self, rate, burst, clock=time.monotonic):
+        self.rate = rate
+        self.burst = burst
+        self._clock = clock
+        self._tokens = float(burst)
+        self._updated = clock()
+
+    def take(self):
+        """Take one token, or return the seconds until one is available."""
+        now = self._clock()
+        self._tokens = min(self.burst,
+                           self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return 0
+        return (1 - self._tokens) / self.rate
+
+
+def classify_turn(history):
+    """Class of the last user turn, from the kind of files attached to it."""
+    for item in reversed(history):
+        if item["role"] != "user":
+            continue
+        turn_class = "text"
+        for file_path in item["content"][0]["content"]:
+            mime_type = mimetypes.guess_type(file_path)[0] or ""
+            if mime_type.startswith("video"):
+                return "video"
+            turn_class = "image"
+        return turn_class
+    return "text"
+
+
+class _Ticket:
+
+    def __init__(self, session_id, turn_class, enqueued_at):
+        self.session_id = session_id
+        self.turn_class = turn_class
+        self.enqueued_at = enqueued_at
+        self.granted = threading.Event()
+
+
+class FairScheduler:
+
+    def __init__(self, slots=SCHEDULER_SLOTS, aging=SCHEDULER_AGING,
+                 rate_per_minute=RATE_LIMIT_PER_MINUTE,
+                 burst=RATE_LIMIT_BURST, clock=time.monotonic):
+        self.slots = slots
+        self.aging = aging
+        self.rate = rate_per_minute / 60.0
+        self.burst = burst
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._running = 0
+        self._buckets = {}
+        # class -> session -> FIFO of tickets; the session order is the
+        # round-robin order within the class
+        self._queues = {
+            turn_class: collections.OrderedDict()
+            for turn_class in TURN_CLASSES
+        }
+        self._wait_stats = {
+            turn_class: {"count": 0, "total": 0.0, "max": 0.0}
+            for turn_class in TURN_CLASSES
+        }
+
+    def check_rate(self, session_id):
+        """Raise RateLimited when the session exhausted its token bucket."""
+        if self.rate <= 0:
+            return
+        with self._lock:
+            bucket = self._buckets.get(session_id)
+            if bucket is None:
+                if len(self._buckets) >= MAX_TRACKED_SESSIONS:
+                    self._prune_buckets()
+                bucket = self._buckets[session_id] = TokenBucket(
+                    self.rate, self.burst, self._clock)
+            retry_in = bucket.take()
+        if retry_in:
+            raise RateLimited(retry_in)
+
+    def _prune_buckets(self):
+        # A bucket idle long enough to be full again carries no state
+        idle = self.burst / self.rate
+        now = self._clock()
+        self._buckets = {
+            session_id: bucket
+            for session_id, bucket in self._buckets.items()
+            if now - bucket._updated < idle
+        }
+
+    def acquire(self, session_id, turn_class, cancelled=None):
+        """Wait for a generation slot, returns the time spent waiting."""
+        ticket = _Ticket(session_id, turn_class, self._clock())
+        with self._lock:
+            self._queues[turn_class].setdefault(session_id,
+                                                collections.deque()).append(
+                                                    ticket)
+            self._dispatch()
+        while not ticket.granted.wait(CANCEL_POLL_INTERVAL):
+            if cancelled is None or not cancelled.is_set():
+                continue
+            with self._lock:
+                if ticket.granted.is_set():
+                    break
+                self._remove(ticket)
+            raise StreamCancelled()
+        waited = self._clock() - ticket.enqueued_at
+        with self._lock:
+            stats = self._wait_stats[turn_class]
+            stats["count"] += 1
+            stats["total"] += waited
+            stats["max"] = max(stats["max"], waited)
+        QUEUE_WAIT.observe(waited, turn_class=turn_class)
+        return waited
+
+    def release(self):
+        with self._lock:
+            self._running -= 1
+            self._dispatch()
+
+    def _remove(self, ticket):
+        sessions = self._queues[ticket.turn_class]
+        tickets = sessions[ticket.session_id]
+        tickets.remove(ticket)
+        if not tickets:
+            del sessions[ticket.session_id]
+
+    def _next_ticket(self):
+        now = self._clock()
+        # Turns that waited past the aging delay go first, whatever their class
+        aged = [
+            tickets[0] for sessions in self._queues.values()
+            for tickets in sessions.values()
+            if now - tickets[0].enqueued_at >= self.aging
+        ]
+        if aged:
+            return min(aged, key=lambda ticket: ticket.enqueued_at)
+        for turn_class in TURN_CLASSES:
+            sessions = self._queues[turn_class]
+            if sessions:
+                return next(iter(sessions.values()))[0]
+        return None
+
+    def _dispatch(self):
+        while self._running < self.slots:
+            ticket = self._next_ticket()
+            if ticket is None:
+                return
+            sessions = self._queues[ticket.turn_class]
+            tickets = sessions.pop(ticket.session_id)
+            tickets.popleft()
+            if tickets:
+                # Back of the line for this session's next turn
+                sessions[ticket.session_id] = tickets
+            self._running += 1
+            ticket.granted.set()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "running": self._running,
+                "queued": {
+                    turn_class: sum(len(tickets) for tickets in sessions.values())
+                    for turn_class, sessions in self._queues.items()
+                },
+                "wait_seconds": {
+                    turn_class: dict(stats)
+                    for turn_class, stats in self._wait_stats.items()
+                },
+            }
+
+
+scheduler = FairScheduler()
+
+RUNNING = registry.gauge("qwen_scheduler_running",
+                         "Generation turns holding a scheduler slot")
+QUEUED = registry.gauge("qwen_scheduler_queued",
+                        "Generation turns waiting for a slot", ("turn_class",))
+
+
+def _collect():
+    stats = scheduler.stats()
+    RUNNING.set(stats["running"])
+    for turn_class, depth in stats["queued"].items():
+        QUEUED.set(depth, turn_class=turn_class)
+
+
+registry.add_collector(_collect)
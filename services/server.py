@@ -0,0 +1,161 @@
+"""
+HTTP server assembly: a FastAPI app carrying the operational routes, with the
+Gradio demo mounted at `/`, served by uvicorn.
+"""
+
+import uuid
+
+import gradio as gr
+import uvicorn
+from fastapi import FastAPI, Header
+from fastapi.responses import JSONResponse, PlainTextResponse
+from starlette.datastructures import Headers, MutableHeaders
+
+from config import MODEL, THINKING_MODEL, base_url, is_cn, save_history, PROFILE_MAX_SECONDS, COMPRESSION_ENABLED, CLIENT_COOKIE, CLIENT_COOKIE_MAX_AGE
+from services.compression import AssetCacheMiddleware, CompressionMiddleware, versioned_assets
+from services.diagnostics import run_diagnostics
+from services.health import prober
+from services.janitor import janitor
+from services.media import MediaFileMiddleware
+from services.metrics import registry
+from services.profiler import ProfilerBusy, is_admin, sampler
+from services.usage import ledger
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+class ClientCookieMiddleware:
+    """
+    Gives each browser a random client id cookie when it loads the page, the
+    key of anonymous users for scheduling, rate limit and quota.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "GET" or \
+                scope["path"] != "/" or \
+                CLIENT_COOKIE in Headers(scope=scope).get("cookie", ""):
+            await self.app(scope, receive, send)
+            return
+        cookie = (f"{CLIENT_COOKIE}={uuid.uuid4().hex}; Path=/; "
+                  f"Max-Age={CLIENT_COOKIE_MAX_AGE}; HttpOnly; SameSite=Lax")
+
+        async def send_with_cookie(message):
+            if message["type"] == "http.response.start":
+                MutableHeaders(raw=message["headers"]).append(
+                    "Set-Cookie", cookie)
+            await send(message)
+
+        await self.app(scope, receive, send_with_cookie)
+
+
+def create_app(demo, max_threads=40, show_error=False, favicon_path=None,
+               routers=(), css=None):
+    """
+    Build the FastAPI app with extra routes, the given `routers` and the
+    Gradio UI at `/` styled with `css`.
+    """
+    app = FastAPI(on_startup=[prober.start, janitor.start],
+                  on_shutdown=[prober.stop, janitor.stop])
+    for router in routers:
+        app.include_router(router)
+    # Immutable caching and ETag revalidation of the media Gradio serves
+    app.add_middleware(MediaFileMiddleware)
+    app.add_middleware(AssetCacheMiddleware)
+    app.add_middleware(ClientCookieMiddleware)
+    # Outermost, so it sees the final headers of every response
+    if COMPRESSION_ENABLED:
+        app.add_middleware(CompressionMiddleware)
+
+    @app.get("/health")
+    def health():
+        """Liveness: the process is up and serving requests."""
+        return prober.liveness()
+
+    @app.get("/ready")
+    @app.get("/api/status")
+    def status():
+        """Readiness from the cached prober snapshot, 503 when not ready."""
+        readiness = prober.readiness()
+        return JSONResponse(readiness,
+                            status_code=200 if readiness["ready"] else 503)
+
+    @app.get("/config")
+    def config():
+        return {
+            "model": MODEL,
+            "thinking_model": THINKING_MODEL,
+            "base_url": base_url,
+            "is_cn": is_cn,
+            "save_history": save_history,
+        }
+
+    @app.get("/network-test")
+    def network_test(x_admin_token: str | None = Header(default=None)):
+        """On-demand concurrent connectivity diagnostics."""
+        # Every run sends outbound probes, not for anonymous callers
+        if not is_admin(x_admin_token):
+            return JSONResponse({"error": "forbidden"}, status_code=403)
+        return run_diagnostics()
+
+    @app.get("/metrics")
+    def metrics():
+        return PlainTextResponse(registry.render(),
+                                 media_type=PROMETHEUS_CONTENT_TYPE)
+
+    @app.get("/admin/usage")
+    def usage(x_admin_token: str | None = Header(default=None)):
+        """Token usage aggregated per model."""
+        if not is_admin(x_admin_token):
+            return JSONResponse({"error": "forbidden"}, status_code=403)
+        return ledger.stats()
+
+    @app.post("/admin/profile")
+    def profile(seconds: float = 10,
+                x_admin_token: str | None = Header(default=None)):
+        """Sample every thread for `seconds`, return folded stacks."""
+        if not is_admin(x_admin_token):
+            return JSONResponse({"error": "forbidden"}, status_code=403)
+        seconds = min(max(seconds, 0.1), PROFILE_MAX_SECONDS)
+        try:
+            folded, path = sampler.sample_to_file(seconds)
+        except ProfilerBusy:
+            return JSONResponse({"error": "a profile is already running"},
+                                status_code=409)
+        return PlainTextResponse(folded + "\n",
+                                 headers={"X-Profile-Path": path})
+
+    head = None
+    if favicon_path:
+        # Linked by content, the browser would ask for a bare /favicon.ico
+        favicon_url = versioned_assets.add_file("/favicon.ico", favicon_path)
+        head = f'<link rel="icon" href=".{favicon_url}">'
+
+    # Gradio reads the thread limit from the Blocks when the app starts
+    demo.max_threads = max_threads
+    app = gr.mount_gradio_app(app,
+                              demo,
+                              path="/",
+                              show_error=show_error,
+                              favicon_path=favicon_path,
+                              css=css,
+                              head=head)
+    # The page loads /theme.css?v=<theme_hash>, set when mounting
+    versioned_assets.register("/theme.css", demo.theme_hash)
+    return app
+
+
+def serve(demo, host, port, max_threads=40, debug=False, favicon_path=None,
+          routers=(), css=None):
+    app = create_app(demo,
+                     max_threads=max_threads,
+                     show_error=debug,
+                     favicon_path=favicon_path,
+                     routers=routers,
+                     css=css)
+    uvicorn.run(app,
+                host=host,
+                port=port,
+                log_level="info" if debug else "warning")
@@ -0,0 +1,124 @@
+"""
+State shared by the worker processes of `app_prod.py --workers N`.
+
+A small key-value store with expiry on a local SQLite file (WAL mode, so
+readers never wait on the writer). Each thread keeps its own connection.
+Values are JSON. It backs the media cache, so a file uploaded to OSS by
+one worker is not uploaded again by another, and the registries of uploads
+and OSS objects the janitor reclaims.
+"""
+
+import json
+import sqlite3
+import threading
+import time
+import uuid
+
+from config import SHARED_STATE_PATH
+from services.log import get_logger
+
+logger = get_logger("shared_state")
+
+
+class SharedCache:
+
+    def __init__(self, namespace, path=SHARED_STATE_PATH, clock=time.time):
+        self.namespace = namespace
+        self.path = path
+        self._clock = clock
+        self._local = threading.local()
+        self._ready = False
+        self._ready_lock = threading.Lock()
+
+    def _connection(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=5,
+                                         isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        if not self._ready:
+            with self._ready_lock:
+                connection.execute(
+                    "CREATE TABLE IF NOT EXISTS cache (namespace TEXT, "
+                    "key TEXT, value TEXT, expires REAL, "
+                    "PRIMARY KEY (namespace, key))")
+                self._ready = True
+        return connection
+
+    def get(self, key, default=None):
+        try:
+            row = self._connection().execute(
+                "SELECT value, expires FROM cache WHERE namespace=? AND key=?",
+                (self.namespace, key)).fetchone()
+        except sqlite3.Error as e:
+            logger.warning("Shared cache read failed: %s", e)
+            return default
+        if row is None or (row[1] and row[1] < self._clock()):
+            return default
+        return json.loads(row[0])
+
+    def set(self, key, value, ttl=None):
+        expires = self._clock() + ttl if ttl else None
+        try:
+            self._connection().execute(
+                "INSERT OR REPLACE INTO cache VALUES (?, ?, ?, ?)",
+                (self.namespace, key, json.dumps(value), expires))
+        except sqlite3.Error as e:
+            logger.warning("Shared cache write failed: %s", e)
+
+    def setdefault(self, key, value):
+        """The value of `key`, set to `value` first if there is none."""
+        try:
+            self._connection().execute(
+                "INSERT OR IGNORE INTO cache VALUES (?, ?, ?, NULL)",
+                (self.namespace, key, json.dumps(value)))
+        except sqlite3.Error as e:
+            logger.warning("Shared cache write failed: %s", e)
+            return value
+        return self.get(key, value)
+
+    def items(self):
+        """Unexpired (key, value) pairs of this namespace."""
+        try:
+            rows = self._connection().execute(
+                "SELECT key, value FROM cache WHERE namespace=? AND "
+                "(expires IS NULL OR expires >= ?)",
+                (self.namespace, self._clock())).fetchall()
+        except sqlite3.Error as e:
+            logger.warning("Shared cache read failed: %s", e)
+            return []
+        return [(key, json.loads(value)) for key, value in rows]
+
+    def delete(self, key):
+        try:
+            self._connection().execute(
+                "DELETE FROM cache WHERE namespace=? AND key=?",
+                (self.namespace, key))
+        except sqlite3.Error as e:
+            logger.warning("Shared cache write failed: %s", e)
+
+    def purge_expired(self):
+        """Drop expired entries of every namespace, returns how many."""
+        try:
+            return self._connection().execute(
+                "DELETE FROM cache WHERE expires IS NOT NULL AND expires < ?",
+                (self._clock(),)).rowcount
+        except sqlite3.Error as e:
+            logger.warning("Shared cache purge failed: %s", e)
+            return 0
+
+
+# OSS URLs of uploaded files, see file_path_to_oss_url()
+media_cache = SharedCache("media")
+# Gradio uploads received by the app, reclaimed by services/janitor.py
+upload_registry = SharedCache("uploads")
+# OSS objects the app uploaded and when their URL was last signed, same
+oss_registry = SharedCache("oss_objects")
+_instance = SharedCache("instance")
+
+
+def instance_id():
+    """Random id of the app on this host, the same for all its workers."""
+    return _instance.setdefault("id", uuid.uuid4().hex[:12])
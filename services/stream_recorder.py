@@ -0,0 +1,78 @@
+"""
+Records upstream chat-completion streams to fixture files.
+
+Enabled by `RECORD_STREAMS_DIR`: every stream consumed by `submit` is written
+as JSONL, a header line followed by one line per chunk with its offset from
+the request start and its `content` / `reasoning_content` deltas. The fixtures
+are replayed by `benchmarks/replay.py`.
+"""
+
+import json
+import os
+import time
+import uuid
+from datetime import datetime
+
+from services.log import get_logger
+
+FIXTURE_VERSION = 1
+
+logger = get_logger("stream_recorder")
+
+
+def _usage_dict(usage):
+    if usage is None:
+        return None
+    if hasattr(usage, "model_dump"):
+        return usage.model_dump()
+    return dict(usage)
+
+
+def record_stream(chunks, model, directory, started_at):
+    """
+    Yield `chunks` unchanged while recording them. `started_at` is the
+    `time.monotonic()` of the request, so the first offset is the TTFT.
+    """
+    records = []
+    complete = False
+    try:
+        for chunk in chunks:
+            offset = time.monotonic() - started_at
+            record = {"t": round(offset, 4)}
+            if chunk and chunk.choices:
+                choice = chunk.choices[0]
+                delta = choice.delta
+                record["delta"] = {
+                    "content": getattr(delta, "content", None),
+                    "reasoning_content": getattr(delta, "reasoning_content",
+                                                 None),
+                }
+                if choice.finish_reason:
+                    record["finish_reason"] = choice.finish_reason
+            usage = _usage_dict(getattr(chunk, "usage", None))
+            if usage:
+                record["usage"] = usage
+            records.append(record)
+            yield chunk
+        complete = True
+    finally:
+        _write_fixture(directory, model, records, complete)
+
+
+def _write_fixture(directory, model, records, complete):
+    try:
+        os.makedirs(directory, exist_ok=True)
+        name = f"{datetime.now().strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}.jsonl"
+        with open(os.path.join(directory, name), "w") as fixture:
+            fixture.write(
+                json.dumps({
+                    "version": FIXTURE_VERSION,
+                    "model": model,
+                    "recorded_at": datetime.now().isoformat(),
+                    "complete": complete,
+                    "chunks": len(records),
+                }) + "\n")
+            for record in records:
+                fixture.write(json.dumps(record, ensure_ascii=False) + "\n")
+    except Exception as e:
+        logger.warning("Could not write stream fixture: %s", e)
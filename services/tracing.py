@@ -0,0 +1,206 @@
+"""
+Lightweight per-request tracing.
+
+A trace is opened for every `add_message` / `regenerate_message` turn and the
+stages of the turn (scheduling, attachment upload/encode, time to first token,
+streaming) are recorded as child spans. Finished traces are appended to
+`TRACE_EXPORT_PATH` as OTLP/JSON `resourceSpans` lines, and traces slower than
+`TRACE_SLOW_THRESHOLD` seconds, when set, are logged with their full span
+tree.
+
+Spans are passed explicitly rather than through contextvars: Gradio runs
+every step of a generator handler in a fresh thread context.
+"""
+
+import json
+import os
+import threading
+import time
+
+from config import TRACE_EXPORT_PATH, TRACE_SLOW_THRESHOLD
+from services.log import get_logger
+
+SERVICE_NAME = "qwen3-vl-demo"
+
+logger = get_logger("tracing")
+_export_lock = threading.Lock()
+
+
+def _new_id(size):
+    return os.urandom(size).hex()
+
+
+def _otlp_value(value):
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+class Span:
+
+    def __init__(self, trace, name, parent_id=None, **attributes):
+        self.trace = trace
+        self.name = name
+        self.span_id = _new_id(8)
+        self.parent_id = parent_id
+        self.attributes = attributes
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.error = None
+        trace.spans.append(self)
+
+    def child(self, name, **attributes):
+        return Span(self.trace, name, self.span_id, **attributes)
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+        return self
+
+    def end(self, error=None):
+        if self.end_ns is None:
+            self.end_ns = time.time_ns()
+            if error is not None:
+                self.error = f"{type(error).__name__}: {error}"
+
+    @property
+    def duration(self):
+        end_ns = self.end_ns if self.end_ns is not None else time.time_ns()
+        return (end_ns - self.start_ns) / 1e9
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.end(exc)
+        return False
+
+    def to_otlp(self):
+        span = {
+            "traceId": self.trace.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": 1,
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": str(self.end_ns or time.time_ns()),
+            "attributes": [{
+                "key": key,
+                "value": _otlp_value(value)
+            } for key, value in self.attributes.items()],
+            "status": {
+                "code": 2,
+                "message": self.error
+            } if self.error else {
+                "code": 1
+            },
+        }
+        if self.parent_id:
+            span["parentSpanId"] = self.parent_id
+        return span
+
+
+class _NoopSpan:
+    """Stand-in used when tracing is disabled, every call is free."""
+
+    duration = 0.0
+
+    def child(self, name, **attributes):
+        return self
+
+    def set(self, **attributes):
+        return self
+
+    def end(self, error=None):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+class Trace:
+
+    def __init__(self, name, **attributes):
+        self.trace_id = _new_id(16)
+        self.spans = []
+        self.root = Span(self, name, **attributes)
+
+    def finish(self, error=None):
+        self.root.end(error)
+        for span in self.spans:
+            # Spans left open by an abandoned generator end with the trace
+            span.end()
+        export(self)
+
+    def tree(self):
+        children = {}
+        for span in self.spans:
+            children.setdefault(span.parent_id, []).append(span)
+        lines = []
+
+        def walk(span, depth):
+            attributes = " ".join(f"{key}={value}"
+                                  for key, value in span.attributes.items())
+            error = f" ERROR {span.error}" if span.error else ""
+            lines.append(f"{'  ' * depth}{span.name} {span.duration * 1000:.1f}ms "
+                         f"{attributes}{error}".rstrip())
+            for child in children.get(span.span_id, []):
+                walk(child, depth + 1)
+
+        walk(self.root, 0)
+        return "\n".join(lines)
+
+    def to_otlp(self):
+        return {
+            "resourceSpans": [{
+                "resource": {
+                    "attributes": [{
+                        "key": "service.name",
+                        "value": _otlp_value(SERVICE_NAME)
+                    }]
+                },
+                "scopeSpans": [{
+                    "scope": {
+                        "name": "qwen3-vl-demo.tracing"
+                    },
+                    "spans": [span.to_otlp() for span in self.spans],
+                }],
+            }]
+        }
+
+
+class _NoopTrace:
+    root = NOOP_SPAN
+
+    def finish(self, error=None):
+        pass
+
+
+def start_trace(name, **attributes):
+    """Open a trace, or a no-op one when neither sink is configured."""
+    if not TRACE_EXPORT_PATH and TRACE_SLOW_THRESHOLD <= 0:
+        return _NoopTrace()
+    return Trace(name, **attributes)
+
+
+def export(trace):
+    if TRACE_SLOW_THRESHOLD > 0 and trace.root.duration >= TRACE_SLOW_THRESHOLD:
+        logger.info("Slow request trace %s\n%s", trace.trace_id,
+                    trace.tree())
+    if not TRACE_EXPORT_PATH:
+        return
+    try:
+        line = json.dumps(trace.to_otlp())
+        with _export_lock:
+            with open(TRACE_EXPORT_PATH, "a") as sink:
+                sink.write(line + "\n")
+    except Exception as e:
+        logger.warning("Could not export trace: %s", e)
@@ -0,0 +1,212 @@
+"""
+Token usage and cost accounting.
+
+Streams are requested with `stream_options.include_usage`, so the upstream
+sends the prompt/completion/reasoning token counts in a final chunk. When it
+does not (older gateways, cancelled or failed streams) the counts are
+estimated from the request messages and the streamed text. Usage is
+aggregated per session, conversation and model, exported as metrics, and a
+per-session token quota over a fixed window is checked before a turn is
+sent upstream. Prompt tokens the upstream served from its prompt cache are
+counted as well, giving the cache hit ratio per model.
+"""
+
+import collections
+import threading
+import time
+
+from config import (TOKEN_QUOTA_PER_USER, TOKEN_QUOTA_WINDOW,
+                    MODEL_PRICE_PROMPT, MODEL_PRICE_COMPLETION,
+                    ESTIMATE_IMAGE_TOKENS, ESTIMATE_VIDEO_TOKENS)
+from services.metrics import registry
+
+CHARS_PER_TOKEN = 4
+MAX_TRACKED_CONVERSATIONS = 10000
+MAX_TRACKED_SESSIONS = 10000
+
+
+class QuotaExceeded(Exception):
+
+    def __init__(self, used, quota, retry_in):
+        self.used = used
+        self.quota = quota
+        self.retry_in = retry_in
+        super().__init__(f"Token quota exceeded ({used}/{quota}), "
+                         f"retry in {retry_in:.0f}s")
+
+
+class Usage(collections.namedtuple(
+        "Usage", "prompt completion reasoning estimated cached",
+        defaults=(0, ))):
+
+    @property
+    def total(self):
+        return self.prompt + self.completion
+
+    def cost(self):
+        """USD cost from the per-million-token prices."""
+        return (self.prompt * MODEL_PRICE_PROMPT +
+                self.completion * MODEL_PRICE_COMPLETION) / 1e6
+
+
+def estimate_text_tokens(text):
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN if text else 0
+
+
+def estimate_prompt_tokens(messages):
+    """Rough prompt size of OpenAI-style messages."""
+    tokens = 0
+    for message in messages:
+        content = message["content"]
+        if isinstance(content, str):
+            tokens += estimate_text_tokens(content)
+            continue
+        for part in content:
+            if part["type"] == "text":
+                tokens += estimate_text_tokens(part["text"])
+            elif part["type"] == "image_url":
+                tokens += ESTIMATE_IMAGE_TOKENS
+            elif part["type"] == "video_url":
+                tokens += ESTIMATE_VIDEO_TOKENS
+    return tokens
+
+
+def usage_from_stream(reported, messages, reasoning_content, answer_content):
+    """`Usage` from the upstream usage chunk, else estimated locally."""
+    if reported is not None and getattr(reported, "prompt_tokens", None):
+        details = getattr(reported, "completion_tokens_details", None)
+        reasoning = getattr(details, "reasoning_tokens", None) or 0
+        prompt_details = getattr(reported, "prompt_tokens_details", None)
+        cached = getattr(prompt_details, "cached_tokens", None) or 0
+        return Usage(reported.prompt_tokens, reported.completion_tokens or 0,
+                     reasoning, False, cached)
+    reasoning = estimate_text_tokens(reasoning_content)
+    return Usage(estimate_prompt_tokens(messages),
+                 reasoning + estimate_text_tokens(answer_content), reasoning,
+                 True)
+
+
+class _Window:
+    """Tokens used by one session within the current quota window."""
+
+    def __init__(self, started):
+        self.started = started
+        self.used = 0
+
+
+class UsageLedger:
+
+    def __init__(self, quota=TOKEN_QUOTA_PER_USER, window=TOKEN_QUOTA_WINDOW,
+                 clock=time.monotonic):
+        self.quota = quota
+        self.window = window
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._windows = {}
+        self._conversations = collections.OrderedDict()
+        self._models = collections.defaultdict(collections.Counter)
+
+    def _current_window(self, session_id, now):
+        window = self._windows.get(session_id)
+        if window is None or now - window.started >= self.window:
+            if window is None and len(self._windows) >= MAX_TRACKED_SESSIONS:
+                self._prune_windows(now)
+            window = self._windows[session_id] = _Window(now)
+        return window
+
+    def _prune_windows(self, now):
+        self._windows = {
+            session_id: window
+            for session_id, window in self._windows.items()
+            if now - window.started < self.window
+        }
+
+    def check_quota(self, session_id):
+        """Raise QuotaExceeded when the session used up its token quota."""
+        if self.quota <= 0:
+            return
+        now = self._clock()
+        with self._lock:
+            window = self._current_window(session_id, now)
+            used = window.used
+            retry_in = window.started + self.window - now
+        if used >= self.quota:
+            QUOTA_REJECTIONS.inc()
+            raise QuotaExceeded(used, self.quota, retry_in)
+
+    def record(self, session_id, conversation_id, model, usage):
+        source = "estimated" if usage.estimated else "reported"
+        with self._lock:
+            self._current_window(session_id, self._clock()).used += usage.total
+            conversation = self._conversations.pop(conversation_id, None) or \
+                collections.Counter()
+            conversation.update(prompt=usage.prompt,
+                                completion=usage.completion,
+                                reasoning=usage.reasoning,
+                                cached=usage.cached,
+                                turns=1)
+            self._conversations[conversation_id] = conversation
+            while len(self._conversations) > MAX_TRACKED_CONVERSATIONS:
+                self._conversations.popitem(last=False)
+            self._models[model].update(prompt=usage.prompt,
+                                       completion=usage.completion,
+                                       reasoning=usage.reasoning,
+                                       cached=usage.cached,
+                                       turns=1)
+        TOKENS.inc(usage.prompt, model=model, kind="prompt", source=source)
+        TOKENS.inc(usage.completion, model=model, kind="completion",
+                   source=source)
+        TOKENS.inc(usage.reasoning, model=model, kind="reasoning",
+                   source=source)
+        if usage.cached:
+            TOKENS.inc(usage.cached, model=model, kind="cached", source=source)
+        COST.inc(usage.cost(), model=model)
+
+    def session_usage(self, session_id):
+        with self._lock:
+            window = self._windows.get(session_id)
+            used = window.used if window else 0
+        return {"used": used, "quota": self.quota, "window_s": self.window}
+
+    def conversation_usage(self, conversation_id):
+        with self._lock:
+            return dict(self._conversations.get(conversation_id, {}))
+
+    def stats(self):
+        with self._lock:
+            return {
+                "models": {
+                    model: dict(counts)
+                    for model, counts in self._models.items()
+                },
+                "tracked_sessions": len(self._windows),
+                "tracked_conversations": len(self._conversations),
+            }
+
+
+TOKENS = registry.counter("qwen_tokens_total",
+                          "Tokens per model, kind and whether reported or estimated",
+                          ("model", "kind", "source"))
+COST = registry.counter("qwen_cost_usd_total",
+                        "Estimated spend from the configured token prices",
+                        ("model",))
+QUOTA_REJECTIONS = registry.counter(
+    "qwen_quota_rejections_total",
+    "Turns refused because the session exhausted its token quota")
+
+CACHE_HIT_RATIO = registry.gauge(
+    "qwen_prompt_cache_hit_ratio",
+    "Share of prompt tokens the upstream served from its prompt cache",
+    ("model",))
+
+ledger = UsageLedger()
+
+
+def _collect():
+    for model, counts in ledger.stats()["models"].items():
+        if counts["prompt"]:
+            CACHE_HIT_RATIO.set(counts["cached"] / counts["prompt"],
+                                model=model)
+
+
+registry.add_collector(_collect)
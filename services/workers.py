@@ -0,0 +1,218 @@
+"""
+Multi-process serving for `app_prod.py --workers N`.
+
+`WorkerPool` starts N worker processes, each serving the full app on its own
+loopback port, and restarts the ones that die. The public port is held by
+`create_proxy_app`, a streaming reverse proxy that pins every browser to one
+worker with a cookie: Gradio keeps the queue, session state and SSE streams
+of a session in the process that created them, so a session must never
+change worker. Requests without the cookie are placed by a hash of the
+client address, so the parallel first requests of a page agree.
+
+`/metrics` is answered by the proxy with the samples of every worker,
+labelled `worker="<index>"`.
+"""
+
+import asyncio
+import hashlib
+import multiprocessing
+import threading
+import time
+
+import httpx
+from fastapi import FastAPI, Request
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from starlette.background import BackgroundTask
+
+from config import WORKER_COOKIE
+from services.log import get_logger
+
+logger = get_logger("workers")
+
+HOP_BY_HOP_HEADERS = {
+    "connection", "keep-alive", "proxy-authenticate", "proxy-authorization",
+    "te", "trailer", "transfer-encoding", "upgrade"
+}
+# Rewritten by the proxy itself
+REPLACED_HEADERS = {"content-length", "x-forwarded-for", "x-forwarded-proto"}
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+RESTART_BACKOFF_MAX = 30
+
+
+class WorkerPool:
+    """Keeps `count` processes running `target(index, port)`."""
+
+    def __init__(self, target, ports):
+        self.target = target
+        self.ports = ports
+        self._context = multiprocessing.get_context("spawn")
+        self._processes = [None] * len(ports)
+        self._restarts = [0] * len(ports)
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _spawn(self, index):
+        process = self._context.Process(target=self.target,
+                                        args=(index, self.ports[index]),
+                                        name=f"qwen3-vl-worker-{index}",
+                                        daemon=True)
+        process.start()
+        self._processes[index] = process
+        logger.info("Worker %d started (pid %d, port %d)", index, process.pid,
+                    self.ports[index])
+
+    def start(self):
+        for index in range(len(self.ports)):
+            self._spawn(index)
+        self._thread = threading.Thread(target=self._supervise,
+                                        name="worker-pool",
+                                        daemon=True)
+        self._thread.start()
+
+    def _supervise(self):
+        while not self._stop.wait(1):
+            for index, process in enumerate(self._processes):
+                if process.is_alive() or self._stop.is_set():
+                    continue
+                self._restarts[index] += 1
+                delay = min(RESTART_BACKOFF_MAX, 2**self._restarts[index])
+                logger.error("Worker %d exited with code %s, restarting in %ds",
+                             index, process.exitcode, delay)
+                if self._stop.wait(delay):
+                    return
+                self._spawn(index)
+
+    def stop(self, timeout=10):
+        self._stop.set()
+        for process in self._processes:
+            if process and process.is_alive():
+                process.terminate()
+        deadline = time.monotonic() + timeout
+        for process in self._processes:
+            if process:
+                process.join(max(0, deadline - time.monotonic()))
+                if process.is_alive():
+                    process.kill()
+
+
+def _client_address(request):
+    forwarded = request.headers.get("x-forwarded-for")
+    if forwarded:
+        return forwarded.split(",")[0].strip()
+    return request.client.host if request.client else ""
+
+
+def pick_worker(request, count):
+    """Worker of the request's sticky cookie, else by client address."""
+    cookie = request.cookies.get(WORKER_COOKIE)
+    if cookie is not None and cookie.isdigit() and int(cookie) < count:
+        return int(cookie)
+    digest = hashlib.sha1(_client_address(request).encode()).digest()
+    return int.from_bytes(digest[:4], "big") % count
+
+
+def merge_expositions(texts):
+    """
+    Merge Prometheus text expositions, adding a `worker` label to every
+    sample and keeping one HELP/TYPE header per metric family.
+    """
+    families = {}
+    for worker, text in texts:
+        family = None
+        for line in text.splitlines():
+            if not line:
+                continue
+            if line.startswith("# "):
+                name = line.split()[2]
+                family = families.setdefault(name, {"header": [], "samples": []})
+                if len(family["header"]) < 2:
+                    family["header"].append(line)
+                continue
+            if family is None:
+                continue
+            name, _, value = line.rpartition(" ")
+            if name.endswith("}"):
+                name = f'{name[:-1]},worker="{worker}"}}'
+            else:
+                name = f'{name}{{worker="{worker}"}}'
+            family["samples"].append(f"{name} {value}")
+    lines = []
+    for family in families.values():
+        lines.extend(family["header"])
+        lines.extend(family["samples"])
+    return "\n".join(lines) + "\n"
+
+
+def create_proxy_app(ports, timeout=300):
+    """Sticky streaming reverse proxy in front of the loopback workers."""
+    upstreams = [f"http://127.0.0.1:{port}" for port in ports]
+    client = httpx.AsyncClient(timeout=httpx.Timeout(timeout, connect=5),
+                               limits=httpx.Limits(max_connections=None,
+                                                   max_keepalive_connections=200))
+    app = FastAPI(docs_url=None,
+                  redoc_url=None,
+                  openapi_url=None,
+                  on_shutdown=[client.aclose])
+
+    @app.get("/metrics")
+    async def metrics():
+        responses = await asyncio.gather(
+            *(client.get(f"{upstream}/metrics") for upstream in upstreams),
+            return_exceptions=True)
+        texts = [(index, response.text)
+                 for index, response in enumerate(responses)
+                 if isinstance(response, httpx.Response) and response.is_success]
+        return PlainTextResponse(merge_expositions(texts),
+                                 media_type=PROMETHEUS_CONTENT_TYPE)
+
+    @app.api_route("/{path:path}",
+                   methods=["GET", "POST", "PUT", "PATCH", "DELETE", "OPTIONS",
+                            "HEAD"])
+    async def proxy(path: str, request: Request):
+        headers = [(name, value) for name, value in request.headers.raw
+                   if name.decode().lower() not in HOP_BY_HOP_HEADERS |
+                   REPLACED_HEADERS]
+        client_host = request.client.host if request.client else ""
+        headers.append((b"x-forwarded-for", ", ".join(
+            filter(None, [request.headers.get("x-forwarded-for"),
+                          client_host])).encode()))
+        headers.append((b"x-forwarded-proto",
+                        request.headers.get("x-forwarded-proto",
+                                            request.url.scheme).encode()))
+        body = await request.body()
+        preferred = pick_worker(request, len(upstreams))
+        # Fall over to the next worker while the preferred one is restarting
+        for attempt in range(len(upstreams)):
+            index = (preferred + attempt) % len(upstreams)
+            upstream_request = client.build_request(
+                request.method,
+                upstreams[index] + request.url.path,
+                params=request.url.query,
+                headers=headers,
+                content=body)
+            try:
+                response = await client.send(upstream_request, stream=True)
+                break
+            except httpx.ConnectError:
+                continue
+        else:
+            return PlainTextResponse("No worker available", status_code=503)
+
+        response_headers = [(name, value)
+                            for name, value in response.headers.raw
+                            if name.decode().lower() not in HOP_BY_HOP_HEADERS]
+        proxied = StreamingResponse(response.aiter_raw(),
+                                    status_code=response.status_code,
+                                    background=BackgroundTask(response.aclose))
+        proxied.raw_headers = response_headers
+        if request.cookies.get(WORKER_COOKIE) != str(index):
+            proxied.set_cookie(WORKER_COOKIE, str(index), httponly=True,
+                               samesite="lax")
+        return proxied
+
+    return app
+
+
+def split_capacity(total, workers):
+    """Per-worker share of a capacity, so the aggregate stays `total`."""
+    return max(1, -(-total // workers))
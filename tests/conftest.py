@@ -0,0 +1,11 @@
+import os
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+# app.py loads its assets relative to the repository
+os.chdir(ROOT)
+# Keep the shared caches and janitor locks of a test run to itself
+os.environ["SHARED_STATE_PATH"] = os.path.join(
+    tempfile.mkdtemp(prefix="qwen3-vl-tests-"), "shared.sqlite3")
@@ -0,0 +1,68 @@
+import os
+
+import pytest
+
+import app
+import batch
+from benchmarks.microbench import SyntheticClient, synthetic_stream
+
+
+class FailingClient(SyntheticClient):
+
+    def create(self, **kwargs):
+        error = RuntimeError("HTTP 400")
+        error.status_code = 400
+        raise error
+
+
+@pytest.fixture
+def image(tmp_path):
+    path = tmp_path / "cat.png"
+    path.write_bytes(b"\x89PNG\r\n\x1a\n" + os.urandom(256))
+    return str(path)
+
+
+@pytest.fixture(autouse=True)
+def local_media(monkeypatch):
+    # Files are inlined as base64, no OSS bucket
+    monkeypatch.setattr(app, "get_bucket", lambda: None)
+
+
+def test_run_job_returns_answer_and_usage(monkeypatch, image):
+    touched = []
+    monkeypatch.setattr(app.janitor, "touch",
+                        lambda path, stat: touched.append(path))
+    monkeypatch.setattr(app, "client",
+                        SyntheticClient(synthetic_stream(2, 3)))
+
+    result = batch.run_job(app, {
+        "id": "job-1",
+        "files": [image],
+        "prompt": "What is it?",
+    })
+
+    assert result["status"] == "ok"
+    assert result["id"] == "job-1"
+    assert result["answer"] == "word2 word3 word4 "
+    assert result["reasoning"] == "thought0 thought1 "
+    assert result["usage"]["completion"] > 0
+    # The caller's input files are not uploads the janitor keeps alive
+    assert touched == []
+
+
+def test_run_job_missing_file(monkeypatch, tmp_path):
+    monkeypatch.setattr(app, "client", SyntheticClient(synthetic_stream(0, 1)))
+
+    with pytest.raises(FileNotFoundError):
+        batch.run_job(app, {
+            "id": "job-2",
+            "files": [str(tmp_path / "missing.png")],
+            "prompt": "What is it?",
+        })
+
+
+def test_run_job_upstream_error(monkeypatch, image):
+    monkeypatch.setattr(app, "client", FailingClient([]))
+
+    with pytest.raises(RuntimeError, match="HTTP 400"):
+        batch.run_job(app, {"id": "job-3", "files": [image], "prompt": "Hi"})
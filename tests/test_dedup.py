@@ -0,0 +1,60 @@
+import os
+import shutil
+
+from PIL import Image, ImageDraw
+
+from services.dedup import AttachmentDeduplicator
+
+
+def screenshot(path, value, compress_level=6):
+    image = Image.new("RGB", (1280, 800), "white")
+    draw = ImageDraw.Draw(image)
+    draw.rectangle((0, 0, 1280, 60), fill=(30, 60, 120))
+    for row in range(12):
+        draw.text((40, 100 + row * 50), f"Row {row}: status ok", fill="black")
+    draw.text((40, 720), f"Total: {value}", fill="black")
+    image.save(path, compress_level=compress_level)
+    return path
+
+
+def check(dedup, path):
+    return dedup.check_file(path, os.stat(path), "image")
+
+
+def test_exact_copy_becomes_a_reference(tmp_path):
+    first = screenshot(tmp_path / "a.png", 41)
+    copy = shutil.copy(first, tmp_path / "b.png")
+    dedup = AttachmentDeduplicator()
+
+    assert check(dedup, first) is None
+    assert check(dedup, copy) == "[Same image as image #1 above]"
+
+
+def test_screenshots_differing_in_one_value_are_both_sent(tmp_path):
+    first = screenshot(tmp_path / "a.png", 41)
+    second = screenshot(tmp_path / "b.png", 42)
+    dedup = AttachmentDeduplicator(distance=2)
+
+    assert check(dedup, first) is None
+    assert check(dedup, second) is None
+
+
+def test_reencoded_copy_matches_only_with_perceptual_dedup(tmp_path):
+    first = screenshot(tmp_path / "a.png", 41)
+    reencoded = screenshot(tmp_path / "b.png", 41, compress_level=1)
+
+    exact = AttachmentDeduplicator()
+    assert check(exact, first) is None
+    assert check(exact, reencoded) is None
+
+    perceptual = AttachmentDeduplicator(distance=2)
+    assert check(perceptual, first) is None
+    assert check(perceptual, reencoded) == "[Same image as image #1 above]"
+
+
+def test_urls_are_kept_apart_by_kind():
+    dedup = AttachmentDeduplicator()
+
+    assert dedup.check_url("https://example.com/clip.mp4", "video") is None
+    assert dedup.check_url("https://example.com/clip.mp4", "video") == \
+        "[Same video as video #1 above]"
@@ -0,0 +1,93 @@
+import http.server
+import socket
+import threading
+import time
+
+import pytest
+
+from services.diagnostics import run_diagnostics
+
+
+class Handler(http.server.BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path == "/slow":
+            time.sleep(2)
+        self.send_response(500 if self.path == "/error" else 200)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def http_url():
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def open_port():
+    listener = socket.socket()
+    listener.bind(("127.0.0.1", 0))
+    listener.listen()
+    yield listener.getsockname()[1]
+    listener.close()
+
+
+def closed_port():
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        return probe.getsockname()[1]
+
+
+def test_local_services_are_ok(http_url, open_port):
+    results = run_diagnostics(http_services={"local": http_url + "/"},
+                              dns_hosts=["localhost"], ports=[open_port])
+
+    assert results["status"] == "OK"
+    local = results["external_services"]["local"]
+    assert local["status"] == "OK"
+    assert local["status_code"] == 200
+    assert local["latency_ms"] >= 0
+    addresses = results["dns_resolution"]["localhost"]["addresses"]
+    assert {"127.0.0.1", "::1"} & set(addresses)
+    assert results["port_connectivity"][open_port]["status"] == "OPEN"
+
+
+def test_refused_service_degrades_status(http_url):
+    port = closed_port()
+    results = run_diagnostics(
+        http_services={"error": http_url + "/error",
+                       "refused": f"http://127.0.0.1:{port}/"},
+        dns_hosts=[], ports=[port])
+
+    # An HTTP error status still proves the service is reachable
+    assert results["external_services"]["error"]["status_code"] == 500
+    assert results["external_services"]["refused"]["status"] == "FAILED"
+    assert results["port_connectivity"][port]["status"] == "CLOSED"
+    assert results["status"] == "DEGRADED"
+
+
+def test_probes_run_concurrently_under_the_deadline(http_url):
+    results = run_diagnostics(
+        http_services={f"slow{i}": http_url + "/slow" for i in range(3)},
+        dns_hosts=[], ports=[], deadline=0.5, probe_timeout=5)
+
+    assert results["duration_ms"] < 1500
+    assert {result["status"]
+            for result in results["external_services"].values()} == \
+        {"TIMEOUT"}
+    assert results["status"] == "DEGRADED"
+
+
+def test_no_probes():
+    results = run_diagnostics(http_services={}, dns_hosts=[], ports=[])
+
+    assert results["status"] == "OK"
+    assert results["duration_ms"] == 0.0
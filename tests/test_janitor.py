@@ -0,0 +1,71 @@
+import threading
+import time
+
+from config import MEDIA_URL_TTL
+from services import janitor as janitor_module
+from services.janitor import OSS_EXPIRY_MARGIN, MediaJanitor
+from services.shared_state import oss_registry
+
+
+class FakeBucket:
+
+    def __init__(self, objects):
+        self.objects = set(objects)
+
+    def batch_delete_objects(self, keys):
+        self.objects -= set(keys)
+
+
+class Clock:
+
+    def __init__(self, now):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+def test_reclaims_only_recorded_objects_after_their_url_expired(monkeypatch):
+    clock = Clock(1_000_000.0)
+    janitor = MediaJanitor(interval=0, clock=clock)
+    with janitor.signing("prefix/a/old.png", 10):
+        pass
+    clock.now += MEDIA_URL_TTL + OSS_EXPIRY_MARGIN
+    with janitor.signing("prefix/a/fresh.png", 20):
+        pass
+    # Uploaded by another deployment sharing the bucket
+    bucket = FakeBucket(["prefix/a/old.png", "prefix/a/fresh.png",
+                         "prefix/b/other.png"])
+    monkeypatch.setattr(janitor_module, "get_bucket", lambda: bucket)
+
+    reclaimed = janitor.reclaim_oss(clock.now)
+
+    assert reclaimed == {"files": 1, "bytes": 10}
+    assert bucket.objects == {"prefix/a/fresh.png", "prefix/b/other.png"}
+    assert oss_registry.get("prefix/a/old.png") is None
+
+
+def test_signing_holds_off_the_delete(monkeypatch):
+    clock = Clock(2_000_000.0)
+    janitor = MediaJanitor(interval=0, clock=clock)
+    with janitor.signing("prefix/a/busy.png", 10):
+        pass
+    clock.now += MEDIA_URL_TTL + OSS_EXPIRY_MARGIN
+    bucket = FakeBucket(["prefix/a/busy.png"])
+    monkeypatch.setattr(janitor_module, "get_bucket", lambda: bucket)
+    # The scan sees it expired, then a turn signs it again
+    monkeypatch.setattr(janitor, "_expired_objects",
+                        lambda now: ["prefix/a/busy.png"])
+    reclaimed = []
+
+    with janitor.signing("prefix/a/busy.png", 10):
+        sweeper = threading.Thread(
+            target=lambda: reclaimed.append(janitor.reclaim_oss(clock.now)))
+        sweeper.start()
+        time.sleep(0.1)
+        # Still waiting for the URL to be handed out
+        assert not reclaimed
+    sweeper.join(5)
+
+    assert reclaimed == [{"files": 0, "bytes": 0}]
+    assert bucket.objects == {"prefix/a/busy.png"}
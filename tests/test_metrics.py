@@ -0,0 +1,37 @@
+import uuid
+
+from services.metrics import TOKENS_PER_SECOND, StreamTimer
+
+
+class FakeClock:
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_output_rate_counts_reported_tokens_not_chunks():
+    clock = FakeClock()
+    labels = dict(model=f"test-{uuid.uuid4().hex}", upstream="mock")
+    timer = StreamTimer(labels["model"], labels["upstream"], clock=clock)
+    # Four chunks over two seconds, carrying 100 tokens in all
+    for now in (1.0, 1.5, 2.5, 3.0):
+        clock.now = now
+        timer.on_chunk(answer=True)
+    timer.finish("success", completion_tokens=100)
+
+    assert TOKENS_PER_SECOND.snapshot(**labels)["sum"] == 50.0
+
+
+def test_output_rate_skipped_without_reported_usage():
+    clock = FakeClock()
+    labels = dict(model=f"test-{uuid.uuid4().hex}", upstream="mock")
+    timer = StreamTimer(labels["model"], labels["upstream"], clock=clock)
+    for now in (1.0, 2.0):
+        clock.now = now
+        timer.on_chunk(answer=True)
+    timer.finish("success")
+
+    assert TOKENS_PER_SECOND.snapshot(**labels) is None
@@ -0,0 +1,167 @@
+import threading
+import time
+import uuid
+
+import openai
+import pytest
+
+from benchmarks.microbench import SyntheticClient, synthetic_stream
+from benchmarks.mock_upstream import MockUpstream
+from services import resilience
+from services.resilience import (CircuitBreaker, CircuitOpenError,
+                                 StreamCancelled, get_breaker,
+                                 get_latency_tracker, resilient_stream)
+
+
+class FakeClock:
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class UpstreamError(Exception):
+
+    def __init__(self, status_code):
+        self.status_code = status_code
+        super().__init__(f"HTTP {status_code}")
+
+
+class HeldStream:
+    """A stream whose first chunk waits for `release`, and records close()."""
+
+    def __init__(self, chunks, release):
+        self.chunks = chunks
+        self.release = release
+        self.closed = False
+
+    def __iter__(self):
+        self.release.wait()
+        yield from self.chunks
+
+    def close(self):
+        self.closed = True
+
+
+def upstream_name():
+    # Breakers and latency trackers are shared per upstream
+    return f"test-{uuid.uuid4().hex}"
+
+
+def test_breaker_opens_after_threshold():
+    clock = FakeClock()
+    breaker = CircuitBreaker("up", failure_threshold=3, reset_timeout=10,
+                             clock=clock)
+    for _ in range(3):
+        breaker.before_call()
+        breaker.record_failure()
+
+    assert breaker.state == CircuitBreaker.OPEN
+    clock.now = 4
+    with pytest.raises(CircuitOpenError) as error:
+        breaker.before_call()
+    assert error.value.retry_in == pytest.approx(6)
+
+
+def test_half_open_breaker_lets_one_probe_through():
+    clock = FakeClock()
+    breaker = CircuitBreaker("up", failure_threshold=1, reset_timeout=10,
+                             clock=clock)
+    breaker.record_failure()
+    clock.now = 10
+
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    breaker.before_call()
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED
+    breaker.before_call()
+
+
+def test_failed_probe_reopens_breaker():
+    clock = FakeClock()
+    breaker = CircuitBreaker("up", failure_threshold=5, reset_timeout=10,
+                             clock=clock)
+    for _ in range(5):
+        breaker.record_failure()
+    clock.now = 10
+    breaker.before_call()
+    breaker.record_failure()
+
+    assert breaker.state == CircuitBreaker.OPEN
+    clock.now = 15
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+
+
+def test_retries_until_first_token():
+    chunks = synthetic_stream(0, 3)
+    client = SyntheticClient(chunks)
+    attempts = []
+    errors = []
+
+    def create():
+        attempts.append(None)
+        if len(attempts) < 3:
+            raise UpstreamError(503)
+        return client.chat.completions.create()
+
+    _, response = resilient_stream(create, upstream_name(), max_retries=2,
+                                   hedge=False, sleep=lambda delay: None,
+                                   on_error=errors.append)
+
+    assert list(response) == chunks
+    assert len(attempts) == 3
+    assert [error.status_code for error in errors] == [503, 503]
+
+
+def test_cancel_during_retry_backoff(monkeypatch):
+    # Always waits long enough for the cancellation to land in the backoff
+    monkeypatch.setattr(resilience, "backoff_delay", lambda attempt: 30)
+    cancelled = threading.Event()
+    upstream = upstream_name()
+    with MockUpstream(error_rate=1.0, error_status=503) as mock:
+        client = openai.OpenAI(base_url=mock.base_url, api_key="mock",
+                               max_retries=0)
+        threading.Timer(0.3, cancelled.set).start()
+        with pytest.raises(StreamCancelled):
+            resilient_stream(
+                lambda: client.chat.completions.create(
+                    model="mock", messages=[], stream=True),
+                upstream, hedge=False, cancelled=cancelled)
+        assert mock.requests == 1
+
+    # A cancelled request says nothing about the upstream
+    assert get_breaker(upstream).state == CircuitBreaker.CLOSED
+
+
+def test_cancel_before_first_token_closes_hedged_attempts(monkeypatch):
+    monkeypatch.setattr(resilience, "HEDGE_MIN_DELAY", 0.05)
+    upstream = upstream_name()
+    for _ in range(resilience.HEDGE_MIN_SAMPLES):
+        get_latency_tracker(upstream).observe(0.05)
+    release = threading.Event()
+    opened = []
+
+    def create():
+        stream = HeldStream(synthetic_stream(0, 3), release)
+        opened.append(stream)
+        return stream
+
+    cancelled = threading.Event()
+    threading.Timer(0.3, cancelled.set).start()
+    with pytest.raises(StreamCancelled):
+        resilient_stream(create, upstream, hedge=True, cancelled=cancelled)
+    assert len(opened) == 2
+
+    # The abandoned attempts close their stream once it produces a token
+    release.set()
+    for _ in range(50):
+        if all(stream.closed for stream in opened):
+            break
+        time.sleep(0.02)
+    assert all(stream.closed for stream in opened)
+    assert get_breaker(upstream).state == CircuitBreaker.CLOSED
@@ -0,0 +1,94 @@
+import threading
+import time
+
+from config import GENERATION_CONCURRENCY_ID, SCHEDULER_SLOTS
+from services.scheduler import FairScheduler
+
+
+def wait_until(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+def start_turn(scheduler, session_id, granted):
+
+    def run():
+        scheduler.acquire(session_id, "text")
+        granted.append(session_id)
+
+    threading.Thread(target=run, daemon=True).start()
+
+
+def queued(scheduler):
+    return sum(scheduler.stats()["queued"].values())
+
+
+def test_second_session_overtakes_backlogged_session():
+    scheduler = FairScheduler(slots=1, rate_per_minute=0)
+    scheduler.acquire("heavy", "text")
+    granted = []
+    for _ in range(3):
+        start_turn(scheduler, "heavy", granted)
+    wait_until(lambda: queued(scheduler) == 3)
+    start_turn(scheduler, "light", granted)
+    wait_until(lambda: queued(scheduler) == 4)
+
+    for served in range(1, 5):
+        scheduler.release()
+        wait_until(lambda: len(granted) == served)
+
+    # First in, first out would serve "light" last
+    assert granted == ["heavy", "light", "heavy", "heavy"]
+
+
+def test_generation_lane_admits_more_turns_than_scheduler_slots():
+    import app
+
+    limits = {
+        fn.concurrency_limit
+        for fn in app.demo.fns.values()
+        if fn.concurrency_id == GENERATION_CONCURRENCY_ID
+    }
+    assert len(limits) == 1
+    limit = limits.pop()
+    # Otherwise Gradio's FIFO queue holds the backlog, not the scheduler
+    assert limit is None or limit > SCHEDULER_SLOTS
+
+
+def test_anonymous_users_behind_one_ip_get_their_own_key():
+    import app
+    from benchmarks.loadtest import FakeRequest
+
+    first, second = FakeRequest(0), FakeRequest(0)
+    assert first.client.host == second.client.host
+    assert app.get_session_id(first) != app.get_session_id(second)
+
+    # Without the cookie, the Gradio session, never the IP
+    first.cookies = {}
+    assert app.get_session_id(first) == f"session:{first.session_hash}"
+    first.username = "alice"
+    assert app.get_session_id(first) == "user:alice"
+
+
+def test_page_load_sets_client_cookie():
+    from fastapi import FastAPI
+    from fastapi.testclient import TestClient
+
+    from config import CLIENT_COOKIE
+    from services.server import ClientCookieMiddleware
+
+    server = FastAPI()
+    server.get("/")(lambda: "page")
+    server.get("/other")(lambda: "other")
+    server.add_middleware(ClientCookieMiddleware)
+    browser = TestClient(server)
+
+    client_id = browser.get("/").cookies[CLIENT_COOKIE]
+    assert client_id
+    assert CLIENT_COOKIE not in browser.get("/other").headers.get(
+        "set-cookie", "")
+    # A returning browser keeps its id
+    assert "set-cookie" not in browser.get("/").headers
+    assert browser.cookies[CLIENT_COOKIE] == client_id
@@ -0,0 +1,32 @@
+import modelscope_studio.components.antd as antd
+import modelscope_studio.components.base as ms
+import gradio as gr
+from config import get_text
+
+
+def CompareButton():
+    state = gr.State({"compare": False})
+    with antd.Button(get_text("Compare", "对比"),
+                     shape="round",
+                     color="primary") as compare_btn:
+        with ms.Slot("icon"):
+            antd.Icon("ColumnWidthOutlined")
+
+    def toggle_compare(state_value):
+        state_value["compare"] = not state_value["compare"]
+        return gr.update(value=state_value)
+
+    def apply_state_change(state_value):
+        return gr.update(variant="solid" if state_value["compare"] else "")
+
+    state.change(fn=apply_state_change,
+                 inputs=[state],
+                 outputs=[compare_btn],
+                 queue=False)
+
+    compare_btn.click(fn=toggle_compare,
+                      inputs=[state],
+                      outputs=[state],
+                      queue=False)
+
+    return state
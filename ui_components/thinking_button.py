@@ -20,8 +20,14 @@ def ThinkingButton():
         return gr.update(
             variant="solid" if state_value["enable_thinking"] else "")
 
-    state.change(fn=apply_state_change, inputs=[state], outputs=[thinking_btn])
+    state.change(fn=apply_state_change,
+                 inputs=[state],
+                 outputs=[thinking_btn],
+                 queue=False)
 
-    thinking_btn.click(fn=toggle_thinking, inputs=[state], outputs=[state])
+    thinking_btn.click(fn=toggle_thinking,
+                       inputs=[state],
+                       outputs=[state],
+                       queue=False)
 
     return state